@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import platform
+import queue
+import signal
+import time
+from datetime import datetime, timezone
+from multiprocessing import cpu_count, get_context
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from data_collection import save_users_to_csv  # noqa: E402
+from database import (  # noqa: E402
+    create_tables,
+    fetch_similarity_users,
+    load_normalized_data,
+    most_common_properties,
+)
+from grouping import group_pairs  # noqa: E402
+from metrics import peak_rss_mb  # noqa: E402
+from pool import connect  # noqa: E402
+from synthetic import generate_users  # noqa: E402
+from user_similarity import find_similar_users  # noqa: E402
+from util import get_csv_filepath, get_output_filepath  # noqa: E402
+from visualization import (  # noqa: E402
+    visualize_common_properties,
+    visualize_groups,
+)
+
+# Synthetic users are dense in matches (about a quarter of all pairs reach the
+# Weak threshold), so the reported pairs grow with n ** 2: 10k users already
+# report 12.5M pairs. Larger sizes have to be asked for with --sizes.
+BENCHMARK_SIZES = (1000, 10000)
+OUTPUT_BENCHMARK_DIR = "output_benchmarks"
+
+# Every run loads into this schema, dropped before and after each size.
+BENCHMARK_SCHEMA = "benchmark"
+
+
+def timed(stages, stage, users, fn, *args, **kwargs):
+    """
+    Run one benchmark stage and append its measurements to stages.
+
+    Returns:
+        The result of fn(*args, **kwargs).
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = fn(*args, **kwargs)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    own_rss, children_rss = peak_rss_mb()
+    stages.append(
+        {
+            "stage": stage,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "users_per_s": round(users / wall, 1) if wall > 0 else None,
+            "peak_rss_mb": own_rss,
+            "children_peak_rss_mb": children_rss,
+        }
+    )
+    print(f"[{users} users] {stage}: {wall:.2f}s")
+    return result
+
+
+def reset_schema(conn, create=True):
+    """Drop the benchmark schema and optionally recreate it as the search path."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE;")
+        if create:
+            cursor.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA};")
+            cursor.execute(f"SET search_path TO {BENCHMARK_SCHEMA};")
+    conn.commit()
+
+
+def run_size(size, seed=0, blocking="strict", workers=None, grouping="communities"):
+    """
+    Run the whole pipeline on size synthetic users.
+
+    Returns:
+        dict: Size, result counts and one measurement dict per stage.
+    """
+    stages = []
+    users = timed(stages, "fetch", size, generate_users, size, seed=seed)
+    csv_name = f"benchmark_users_{size}.csv"
+    timed(stages, "normalize", size, save_users_to_csv, users, filename=csv_name)
+    del users
+
+    conn = connect()
+    try:
+        reset_schema(conn)
+        create_tables(conn)
+        timed(
+            stages,
+            "load_normalized_data",
+            size,
+            load_normalized_data,
+            conn,
+            get_csv_filepath(csv_name),
+        )
+        users_df = timed(stages, "fetch_users", size, fetch_similarity_users, conn)
+        common_props = timed(
+            stages, "most_common_properties", size, most_common_properties, conn
+        )
+        reset_schema(conn, create=False)
+    finally:
+        conn.close()
+
+    pair_df, strong_groups, weak_groups = timed(
+        stages,
+        "find_similar_users",
+        size,
+        find_similar_users,
+        users_df,
+        blocking=blocking,
+        workers=workers,
+        grouping=grouping,
+    )
+    timed(
+        stages, "build_groups", size, group_pairs, pair_df, mode=grouping, workers=workers
+    )
+
+    def visualize():
+        visualize_groups(strong_groups, weak_groups)
+        visualize_common_properties(common_props)
+
+    timed(stages, "visualization", size, visualize)
+    return {
+        "users": size,
+        "pairs": len(pair_df),
+        "strong_groups": len(strong_groups),
+        "weak_groups": len(weak_groups),
+        "stages": stages,
+    }
+
+
+def run_size_in_child(results, size, *args):
+    try:
+        results.put(run_size(size, *args))
+    except Exception as e:
+        results.put({"users": size, "failed": True, "error": repr(e)})
+        raise
+
+
+def child_failure(size, exitcode):
+    """Describe a benchmark child that exited without a result."""
+    if exitcode is not None and exitcode < 0:
+        name = signal.Signals(-exitcode).name
+        error = f"killed by {name}"
+        if -exitcode == signal.SIGKILL:
+            error += " (out of memory?)"
+    else:
+        error = f"exited with code {exitcode}"
+    print(f"[{size} users] failed: {error}")
+    return {"users": size, "failed": True, "exitcode": exitcode, "error": error}
+
+
+def run_benchmark(
+    sizes=BENCHMARK_SIZES, seed=0, blocking="strict", workers=None, grouping="communities"
+):
+    """
+    Benchmark every size in a fresh process, so peak RSS is measured per size.
+    A size whose process fails or is killed (e.g. by the OOM killer) is
+    recorded as failed and the next size runs.
+
+    Returns:
+        dict: The report (environment, parameters and per-size results).
+    """
+    context = get_context()
+    results = []
+    for size in sizes:
+        size_results = context.Queue()
+        process = context.Process(
+            target=run_size_in_child,
+            args=(size_results, size, seed, blocking, workers, grouping),
+        )
+        process.start()
+        result = None
+        while result is None:
+            try:
+                result = size_results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    result = child_failure(size, process.exitcode)
+        process.join()
+        results.append(result)
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "parameters": {
+            "seed": seed,
+            "blocking": blocking,
+            "workers": workers or cpu_count(),
+            "grouping": grouping,
+        },
+        "results": results,
+    }
+
+
+def compare_reports(baseline, report):
+    """
+    Compare the stage wall times of two reports.
+
+    Returns:
+        list: (users, stage, baseline seconds, seconds, ratio) for every stage
+              present in both reports.
+    """
+    before = {
+        (result["users"], stage["stage"]): stage["wall_s"]
+        for result in baseline["results"]
+        for stage in result.get("stages", [])
+    }
+    rows = []
+    for result in report["results"]:
+        for stage in result.get("stages", []):
+            key = (result["users"], stage["stage"])
+            if key in before and before[key] > 0:
+                ratio = stage["wall_s"] / before[key]
+                rows.append((*key, before[key], stage["wall_s"], round(ratio, 3)))
+    return rows
+
+
+def save_report(report, filename=None):
+    """Write a report to the benchmark output directory and return its path."""
+    if filename is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"benchmark_{stamp}.json"
+    path = get_output_filepath(filename, OUTPUT_BENCHMARK_DIR)
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Benchmark report saved to {path}")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--blocking", default="strict", choices=["strict", "approximate", "none"]
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--grouping", default="communities", choices=["communities", "components"]
+    )
+    parser.add_argument("--output", default=None, help="Report file name.")
+    parser.add_argument(
+        "--compare", default=None, help="Baseline report to compare with."
+    )
+    args = parser.parse_args()
+
+    blocking = None if args.blocking == "none" else args.blocking
+    report = run_benchmark(args.sizes, args.seed, blocking, args.workers, args.grouping)
+    save_report(report, args.output)
+    if args.compare and os.path.exists(args.compare):
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        for users, stage, before, after, ratio in compare_reports(baseline, report):
+            print(f"{users:>7} {stage:<24} {before:>10.3f}s -> {after:>10.3f}s  x{ratio}")
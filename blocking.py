@@ -0,0 +1,428 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from features import (
+    CATEGORICAL_FIELDS,
+    EXACT_FIELDS,
+    FUZZY_FIELDS,
+    MATCH_SCORE,
+    WEAK_THRESHOLD,
+    encode_users,
+    exact_scores_block,
+    location_scores,
+    normalize_field,
+)
+from fuzzy import cutoff_ratio_pairs
+from geo import parse_coordinates
+from util import join_indices, unique_codes
+
+# Fuzzy fields with at most this many distinct values are blocked on the connected
+# components of their vocabulary similarity graph instead of character prefixes.
+CATEGORICAL_VOCAB_LIMIT = 256
+
+# Lower bound on Levenshtein.ratio for any pair that fuzz.ratio rounds up to 80.
+# Slightly below 0.795 so floating point rounding can never drop a match.
+MIN_FUZZY_RATIO = 0.79
+
+BLOCKING_MODES = ("strict", "approximate")
+
+# Users per side of the tiles strict blocking is evaluated on (see
+# tile_candidates); its memory use is bounded by the tile, not by n.
+TILE_SIZE = 512
+
+
+def value_cover_keys(vocab):
+    """
+    Build blocking keys for the values of a fuzzy field such that any two
+    values with fuzz.ratio >= 80 share at least one key.
+
+    Small vocabularies are grouped into connected components of the ratio >= 80
+    graph. Otherwise each value is indexed on the prefix of its character multiset
+    (rarest characters first): Levenshtein.ratio is 2 * LCS / (len1 + len2) and the
+    LCS never exceeds the number of shared characters, so two values reaching
+    MIN_FUZZY_RATIO share at least ceil(r * len / (2 - r)) characters and therefore
+    a token within their first len - that + 1 tokens.
+
+    Parameters:
+        vocab (list): Distinct normalized values of the field.
+
+    Returns:
+        tuple: (values, keys) int64 arrays, one entry per (value code, key),
+               ordered by value code.
+    """
+    vocab = list(vocab)
+
+    if len(vocab) <= CATEGORICAL_VOCAB_LIMIT:
+        parent = list(range(len(vocab)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        a, b = np.triu_indices(len(vocab), 1)
+        matched = cutoff_ratio_pairs(vocab, a, b, MATCH_SCORE) > 0
+        for a, b in zip(a[matched].tolist(), b[matched].tolist()):
+            parent[find(a)] = find(b)
+        roots = np.array([find(i) for i in range(len(vocab))], dtype=np.int64)
+        return np.arange(len(vocab), dtype=np.int64), roots
+
+    tokens_per_value = []
+    frequency = {}
+    for value in vocab:
+        if value:
+            seen = {}
+            tokens = []
+            for char in value:
+                seen[char] = seen.get(char, 0) + 1
+                tokens.append((char, seen[char]))
+        else:
+            # fuzz.ratio("", "") is 100, so empty values still need a shared key.
+            tokens = [("", 0)]
+        tokens_per_value.append(tokens)
+        for token in tokens:
+            frequency[token] = frequency.get(token, 0) + 1
+
+    token_ids = {}
+    value_codes = []
+    value_keys = []
+    for code, tokens in enumerate(tokens_per_value):
+        tokens = sorted(tokens, key=lambda t: (frequency[t], t))
+        overlap = max(
+            1, math.ceil(MIN_FUZZY_RATIO * len(tokens) / (2 - MIN_FUZZY_RATIO) - 1e-9)
+        )
+        for token in tokens[: len(tokens) - overlap + 1]:
+            value_codes.append(code)
+            value_keys.append(token_ids.setdefault(token, len(token_ids)))
+    return np.array(value_codes, dtype=np.int64), np.array(value_keys, dtype=np.int64)
+
+
+def string_cover_keys(values):
+    """
+    Build the cover keys (see value_cover_keys) of a fuzzy field per user.
+
+    Parameters:
+        values (list): Normalized field values, one per user.
+
+    Returns:
+        tuple: (users, keys) int64 arrays, one entry per (user, key).
+    """
+    codes, vocab = pd.factorize(pd.Series(values, dtype=object))
+    value_codes, value_keys = value_cover_keys(vocab)
+    users, entries = join_indices(value_codes, codes.astype(np.int64))
+    return entries.astype(np.int64), value_keys[users]
+
+
+def add_cover_keys(features):
+    """
+    Add the cover keys of every fuzzy field to a feature table (see
+    features.encode_users) for tile_candidates: "<field>_cover_keys" holds the
+    keys of all vocabulary values, "<field>_cover_offsets" where the keys of
+    each value code start.
+    """
+    for field in FUZZY_FIELDS:
+        vocab = features[f"{field}_vocab"]
+        value_codes, value_keys = value_cover_keys(vocab)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(value_codes, minlength=len(vocab)), out=offsets[1:])
+        features[f"{field}_cover_keys"] = value_keys
+        features[f"{field}_cover_offsets"] = offsets
+    return features
+
+
+def value_entries(features, field, values):
+    """
+    Return the cover keys of value codes as (owners, keys) entries, owners
+    being positions in values.
+    """
+    offsets = features[f"{field}_cover_offsets"]
+    starts = offsets[values]
+    counts = offsets[values + 1] - starts
+    owners = np.repeat(np.arange(len(values)), counts)
+    positions = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    positions += np.arange(int(counts.sum()))
+    return owners, features[f"{field}_cover_keys"][positions]
+
+
+def shared_cover_keys(features, field, rows, cols):
+    """
+    Return the boolean (len(rows), len(cols)) matrix of users sharing a cover
+    key of a fuzzy field; only these can earn its point.
+    """
+    codes = features[field]
+    row_values, row_index = np.unique(codes[rows], return_inverse=True)
+    col_values, col_index = np.unique(codes[cols], return_inverse=True)
+    row_owners, row_keys = value_entries(features, field, row_values.astype(np.int64))
+    col_owners, col_keys = value_entries(features, field, col_values.astype(np.int64))
+    ia, ib = join_indices(row_keys, col_keys)
+    shared = np.zeros((len(row_values), len(col_values)), dtype=bool)
+    shared[row_owners[ia], col_owners[ib]] = True
+    return shared[row_index.reshape(-1)][:, col_index.reshape(-1)]
+
+
+def tile_candidates(features, rows, cols, strict=True):
+    """
+    Candidate pairs (i, j), i < j, of a tile of users that can reach the Weak
+    threshold.
+
+    Exact, categorical and location points are known from the feature table;
+    a fuzzy field can only score when the users share one of its cover keys
+    (see add_cover_keys). Pairs whose known points plus possible fuzzy points
+    stay below WEAK_THRESHOLD cannot be reported, so dropping them loses no
+    pair compare_users would return. A "focus" mask in the feature table
+    keeps only pairs involving a focused user; with strict=False that is the
+    only filter.
+
+    Parameters:
+        features (dict): Output of encode_users with add_cover_keys applied.
+        rows, cols (ndarray): User indices of the tile.
+        strict (bool): Apply the point bound described above.
+
+    Returns:
+        tuple: (left, right, num_pairs), num_pairs being the number of pairs
+               of the tile before filtering.
+    """
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    upper = rows[:, None] < cols[None, :]
+    left = np.broadcast_to(rows[:, None], upper.shape)[upper]
+    right = np.broadcast_to(cols[None, :], upper.shape)[upper]
+    num_pairs = len(left)
+    keep = np.ones(num_pairs, dtype=bool)
+    focus = features.get("focus")
+    if focus is not None:
+        keep &= focus[left] | focus[right]
+    if strict:
+        points = np.zeros(upper.shape, dtype=np.int8)
+        for field in EXACT_FIELDS + CATEGORICAL_FIELDS:
+            points += exact_scores_block(features, field, rows, cols) >= MATCH_SCORE
+        for field in FUZZY_FIELDS:
+            points += shared_cover_keys(features, field, rows, cols)
+        points = points[upper]
+        # Location only decides the pairs one point short.
+        short = np.flatnonzero(keep & (points == WEAK_THRESHOLD - 1))
+        points[short] += location_scores(features, left[short], right[short]) > 0
+        keep &= points >= WEAK_THRESHOLD
+    return left[keep], right[keep], num_pairs
+
+
+def tile_ranges(n, tile_size=TILE_SIZE, focus=None):
+    """
+    Yield (i0, i1, j0, j1) tiles covering the upper triangle of n users; with
+    a focus mask only tiles holding a focused user.
+    """
+    for i0 in range(0, n, tile_size):
+        i1 = min(i0 + tile_size, n)
+        for j0 in range(i0, n, tile_size):
+            j1 = min(j0 + tile_size, n)
+            if focus is None or focus[i0:i1].any() or focus[j0:j1].any():
+                yield i0, i1, j0, j1
+
+
+def pairs_from_blocks(index_entries, probe_entries, n):
+    """Return unique pair codes (i * n + j, i < j) for users sharing a key."""
+    index_users, index_keys = index_entries
+    probe_users, probe_keys = probe_entries
+    ia, ib = join_indices(index_keys, probe_keys)
+    left = index_users[ia]
+    right = probe_users[ib]
+    keep = left != right
+    left, right = left[keep], right[keep]
+    return unique_codes(np.minimum(left, right) * n + np.maximum(left, right))
+
+
+def restrict_entries(entries, focus):
+    """Keep the (users, keys) entries of users selected by the boolean focus mask."""
+    if focus is None:
+        return entries
+    users, keys = entries
+    keep = focus[users]
+    return users[keep], keys[keep]
+
+
+def strict_candidates(users_df, focus=None, features=None):
+    """
+    Candidate pairs guaranteed to include every pair reaching the Weak threshold.
+
+    The pairs are collected tile by tile (see tile_candidates), so only the
+    result grows with n; find_similar_users does not collect them at all but
+    lets every worker filter its own tiles.
+
+    With a focus mask only the pairs involving at least one focused user are
+    returned.
+    """
+    n = len(users_df)
+    if features is None:
+        features = encode_users(users_df)
+    features = add_cover_keys(dict(features))
+    if focus is not None:
+        features["focus"] = focus
+    codes = [np.empty(0, dtype=np.int64)]
+    for i0, i1, j0, j1 in tile_ranges(n, focus=focus):
+        left, right, _ = tile_candidates(features, np.arange(i0, i1), np.arange(j0, j1))
+        codes.append(left.astype(np.int64) * n + right)
+    return unique_codes(np.concatenate(codes))
+
+
+def soundex(value):
+    """Return the American Soundex code of a string ("" for values without letters)."""
+    letters = [char for char in value.upper() if char.isalpha() and char.isascii()]
+    if not letters:
+        return ""
+    digits = {}
+    for group, digit in (
+        ("BFPV", "1"),
+        ("CGJKQSXZ", "2"),
+        ("DT", "3"),
+        ("L", "4"),
+        ("MN", "5"),
+        ("R", "6"),
+    ):
+        for char in group:
+            digits[char] = digit
+    code = letters[0]
+    previous = digits.get(letters[0], "")
+    for char in letters[1:]:
+        digit = digits.get(char, "")
+        if digit and digit != previous:
+            code += digit
+        if char not in "HW":
+            previous = digit
+    return (code + "000")[:4]
+
+
+def approximate_keys(users_df):
+    """
+    Cheap single-field blocking keys.
+
+    They are aimed at duplicates: on 1000 synthetic users (seed 0) the pairs
+    sharing a key hold 69% of the Strong but only 23.5% of the Weak pairs,
+    which mostly share two subscription fields only (see README).
+
+    Returns:
+        tuple: (users, keys) int64 arrays.
+    """
+    n = len(users_df)
+    gender = normalize_field(users_df, "gender")
+    birth = normalize_field(users_df, "date_of_birth")
+    zip_code = normalize_field(users_df, "zip_code")
+    lat, lng, valid = parse_coordinates(users_df)
+    first_name = normalize_field(users_df, "first_name")
+    last_name = normalize_field(users_df, "last_name")
+    city = normalize_field(users_df, "city")
+    street = normalize_field(users_df, "street_name")
+    subscription = list(
+        zip(
+            *(
+                normalize_field(users_df, field)
+                for field in (
+                    "subscription_plan",
+                    "subscription_status",
+                    "payment_method",
+                    "subscription_term",
+                )
+            )
+        )
+    )
+
+    users = []
+    keys = []
+    for i in range(n):
+        user_keys = [
+            f"birth:{gender[i]}|{birth[i][:4]}",
+            f"zip:{zip_code[i][:3]}",
+            f"first:{soundex(first_name[i])}",
+            f"last:{soundex(last_name[i])}",
+            f"city:{city[i][:3].lower()}",
+            f"street:{street[i][:3].lower()}",
+            "subscription:" + "|".join(subscription[i]),
+        ]
+        if valid[i]:
+            user_keys.append(f"geo:{math.floor(lat[i] * 10)},{math.floor(lng[i] * 10)}")
+        users.extend([i] * len(user_keys))
+        keys.extend(user_keys)
+
+    key_codes, _ = pd.factorize(pd.Series(keys, dtype=object))
+    return np.array(users, dtype=np.int64), key_codes.astype(np.int64)
+
+
+def approximate_candidates(users_df, focus=None):
+    """Candidate pairs sharing at least one approximate blocking key."""
+    entries = approximate_keys(users_df)
+    return pairs_from_blocks(entries, restrict_entries(entries, focus), len(users_df))
+
+
+def focus_candidates(n, focus):
+    """All pairs involving at least one focused user."""
+    rows = np.flatnonzero(focus).astype(np.int64)
+    cols = np.arange(n, dtype=np.int64)
+    left = np.repeat(rows, n)
+    right = np.tile(cols, len(rows))
+    keep = left != right
+    left, right = left[keep], right[keep]
+    return unique_codes(np.minimum(left, right) * n + np.maximum(left, right))
+
+
+def candidate_pairs(users_df, mode="strict", focus=None, features=None):
+    """
+    Generate the user pairs worth scoring.
+
+    Parameters:
+        users_df (DataFrame): Users as returned by fetch_users.
+        mode (str): "strict" (no pair reaching the Weak threshold is lost) or
+                    "approximate" (faster, lower recall); None (with a focus
+                    mask) pairs the focused users with everyone.
+        focus (ndarray): Optional boolean mask of users; only pairs involving at
+                         least one of them are generated.
+        features (dict): The encode_users table of users_df, if already built
+                         (strict mode needs it).
+
+    Returns:
+        tuple: (left, right) arrays of positional user indices with left < right,
+               in the same order itertools.combinations would produce them.
+    """
+    if focus is not None:
+        focus = np.asarray(focus, dtype=bool)
+    if mode == "strict":
+        codes = strict_candidates(users_df, focus, features)
+    elif mode == "approximate":
+        codes = approximate_candidates(users_df, focus)
+    elif mode is None and focus is not None:
+        codes = focus_candidates(len(users_df), focus)
+    else:
+        raise ValueError(
+            f"Unknown blocking mode {mode!r}, expected one of {BLOCKING_MODES}"
+        )
+    n = max(len(users_df), 1)
+    return codes // n, codes % n
+
+
+def uid_pair_candidates(users_df, user1, user2, focus=None):
+    """
+    Turn uid pairs generated elsewhere (e.g. database.fetch_trigram_candidates)
+    into candidate pairs; pairs with a uid missing from users_df are dropped.
+
+    Parameters:
+        users_df (DataFrame): Users as returned by fetch_similarity_users.
+        user1, user2 (array-like): Uids of the two users of every pair.
+        focus (ndarray): Optional boolean mask of users; only pairs involving at
+                         least one of them are kept.
+
+    Returns:
+        tuple: (left, right) arrays like candidate_pairs returns them.
+    """
+    n = len(users_df)
+    positions = pd.Index([str(uid) for uid in users_df["uid"]])
+    left = positions.get_indexer([str(uid) for uid in user1]).astype(np.int64)
+    right = positions.get_indexer([str(uid) for uid in user2]).astype(np.int64)
+    keep = (left >= 0) & (right >= 0) & (left != right)
+    if focus is not None:
+        focus = np.asarray(focus, dtype=bool)
+        keep &= focus[left] | focus[right]
+    left, right = left[keep], right[keep]
+    codes = unique_codes(np.minimum(left, right) * n + np.maximum(left, right))
+    n = max(n, 1)
+    return codes // n, codes % n
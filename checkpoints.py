@@ -0,0 +1,205 @@
+import hashlib
+import importlib
+import inspect
+import json
+import os
+from datetime import datetime, timezone
+
+from metrics import stage
+from util import create_output_dir
+
+OUTPUT_CHECKPOINTS_DIR = "output_checkpoints"
+
+MANIFEST_FILE = "manifest.json"
+
+# Bytes read at a time when hashing a file.
+HASH_BLOCK = 1 << 20
+
+
+def fingerprint(value):
+    """Return the SHA-256 of a JSON-serializable value (key order ignored)."""
+    data = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def file_digest(path):
+    """Return the SHA-256 of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_version(*modules):
+    """
+    Fingerprint the source of modules (given by name), so that editing the
+    code a stage runs invalidates its checkpoint.
+    """
+    return fingerprint(
+        {
+            name: file_digest(inspect.getsourcefile(importlib.import_module(name)))
+            for name in modules
+        }
+    )
+
+
+def open_checkpoints(directory=OUTPUT_CHECKPOINTS_DIR, enabled=True, rerun=()):
+    """
+    Open the stage checkpoints of a run (see run_stage).
+
+    The manifest records, per stage, the fingerprint of its inputs, the state
+    of the files it wrote and a digest of its result, which later stages take
+    as input. Stages run in order, so after a failure the next run skips the
+    stages already done and resumes at the failed one.
+
+    Parameters:
+        directory (str): Directory of the manifest.
+        enabled (bool): Without it every stage simply runs.
+        rerun (iterable): Names of stages to run even if up to date.
+
+    Returns:
+        dict: The checkpoint state.
+    """
+    path = os.path.join(create_output_dir(directory), MANIFEST_FILE)
+    stages = {}
+    if enabled and os.path.exists(path):
+        try:
+            with open(path) as manifest:
+                stages = json.load(manifest)
+        except ValueError:
+            print(f"Ignoring unreadable checkpoint manifest {path}")
+    return {"path": path, "enabled": enabled, "rerun": set(rerun), "stages": stages}
+
+
+def save_checkpoints(checkpoints):
+    """Write the manifest atomically (a crash leaves the previous one intact)."""
+    temporary = checkpoints["path"] + ".tmp"
+    with open(temporary, "w") as manifest:
+        json.dump(checkpoints["stages"], manifest, indent=2, default=str)
+    os.replace(temporary, checkpoints["path"])
+
+
+def file_state(path):
+    """Return the size and modification time of a file."""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def stage_digest(checkpoints, name):
+    """Return the result digest of a stage (None if it has not completed)."""
+    entry = checkpoints["stages"].get(name)
+    if entry is None or entry["status"] != "done":
+        return None
+    return entry["digest"]
+
+
+def is_fresh(checkpoints, name, inputs, outputs=(), validate=None):
+    """
+    Check whether a stage completed with the same inputs and its persisted
+    output is still what it wrote: every output file present and unchanged,
+    and validate() (e.g. a database signature) equal to the recorded digest.
+    """
+    entry = checkpoints["stages"].get(name)
+    if (
+        entry is None
+        or entry["status"] != "done"
+        or entry["inputs"] != inputs
+        or name in checkpoints["rerun"]
+        or set(entry["outputs"]) != set(outputs)
+    ):
+        return False
+    for path, state in entry["outputs"].items():
+        if not os.path.exists(path) or file_state(path) != {
+            "size": state["size"],
+            "mtime_ns": state["mtime_ns"],
+        }:
+            return False
+    return validate is None or validate() == entry["digest"]
+
+
+def run_stage(
+    checkpoints,
+    name,
+    inputs,
+    run,
+    outputs=(),
+    validate=None,
+    restore=None,
+    keep_value=False,
+):
+    """
+    Run one stage of a run unless its checkpoint is still valid.
+
+    Parameters:
+        checkpoints (dict): See open_checkpoints.
+        name (str): Stage name.
+        inputs (dict): Everything the result depends on (upstream digests,
+                       parameters, code_version of the modules it runs);
+                       JSON-serializable.
+        run (callable): Runs the stage and returns its value.
+        outputs (list): Files the stage writes; they are content-hashed into
+                        its digest.
+        validate (callable): Returns a signature of state the stage leaves
+                             outside files (e.g. loaded tables); it becomes
+                             the digest.
+        restore (callable): Rebuilds the value of a skipped stage from its
+                            outputs.
+        keep_value (bool): Record the (JSON-serializable) value in the
+                           manifest and return it when the stage is skipped.
+
+    The stage is measured as "main.<name>" (see metrics.stage), skipped
+    stages included.
+
+    Returns:
+        The value of run(), or of the skipped stage.
+    """
+    with stage(f"main.{name}") as record:
+        if not checkpoints["enabled"]:
+            return run()
+        stages = checkpoints["stages"]
+        inputs = fingerprint(inputs)
+        if is_fresh(checkpoints, name, inputs, outputs, validate):
+            print(f"Stage {name} is up to date, skipping it.")
+            record["skipped"] = True
+            if restore is not None:
+                return restore()
+            return stages[name].get("value")
+
+        stages[name] = {
+            "status": "running",
+            "inputs": inputs,
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        save_checkpoints(checkpoints)
+        try:
+            value = run()
+        except BaseException:
+            stages[name]["status"] = "failed"
+            save_checkpoints(checkpoints)
+            raise
+
+        files = {
+            path: {**file_state(path), "sha256": file_digest(path)}
+            for path in outputs
+            if os.path.exists(path)
+        }
+        entry = stages[name]
+        entry["outputs"] = files
+        if keep_value:
+            # Round trip, so a skipped stage returns exactly what a fresh one did.
+            value = json.loads(json.dumps(value, default=str))
+            entry["value"] = value
+        if validate is not None:
+            entry["digest"] = validate()
+        else:
+            entry["digest"] = fingerprint(
+                {
+                    "files": {path: state["sha256"] for path, state in files.items()},
+                    "value": entry.get("value"),
+                }
+            )
+        entry["status"] = "done"
+        entry["finished"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        save_checkpoints(checkpoints)
+        return value
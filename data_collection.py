@@ -1,34 +1,84 @@
+import asyncio
+import math
+import os
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
+import aiohttp
 import pandas as pd
 import requests
 
-from util import get_csv_filepath
+import settings
+from metrics import count, timed_stage
+from response_store import append_batch, open_store, read_users, stored_users
+from util import get_dataset_filepath, write_dataset
 
-API_URL = "https://random-data-api.com/api/v2/users?size={batch_size}&response_type=json"
+API_URL = settings.RANDOM_DATA_API_URL + "?size={batch_size}&response_type=json"
 MAX_RETRIES = 5
 INITIAL_DELAY = 0.5  # Starting delay for exponential backoff
+MAX_DELAY = 10
+
+# Async fetch engine (fetch_random_users_async): requests in flight, token
+# bucket rate (requests per second) and burst, lowest rate it backs off to and
+# the factor restoring the rate after every successful request.
+MAX_CONCURRENCY = settings.FETCH_CONCURRENCY
+RATE_LIMIT = settings.FETCH_RATE_LIMIT
+RATE_BURST = 2
+MIN_RATE = 0.2
+RATE_RECOVERY = 1.1
+REQUEST_TIMEOUT = 30
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header (seconds or HTTP date); None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, delay=INITIAL_DELAY):
+    """Exponential backoff with full jitter: uniform in [0, delay * 2 ** attempt]."""
+    return random.uniform(0, min(delay * 2**attempt, MAX_DELAY))
 
 
 def fetch_users_sync(url, delay=INITIAL_DELAY):
     """Fetch users synchronously, handling rate limits with exponential backoff."""
     for attempt in range(1, MAX_RETRIES + 1):
+        if attempt > 1:
+            count("http_retries")
+        count("http_requests")
         response = requests.get(url)
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 429:  # Rate limited
-            delay = min(delay * 2, 10)
+            count("http_429")
+            wait = retry_after_seconds(response.headers.get("Retry-After"))
+            if wait is None:
+                wait = backoff_delay(attempt, delay)
             print(
-                f"Rate limited. Retrying in {delay:.2f}s (Attempt {attempt}/{MAX_RETRIES})..."
+                f"Rate limited. Retrying in {wait:.2f}s (Attempt {attempt}/{MAX_RETRIES})..."
             )
-            time.sleep(delay)
+            time.sleep(wait)
         else:
+            count("http_errors")
             print(f"Error fetching data: Status code {response.status_code}")
             return []
     print("Max retries reached. Skipping request.")
     return []
 
 
+@timed_stage(items=len, unit="users")
 def fetch_random_users(total=1000, batch_size=100):
     """Fetch users synchronously, handling API rate limits."""
     users = []
@@ -44,12 +94,308 @@ def fetch_random_users(total=1000, batch_size=100):
     return users
 
 
-def save_users_to_csv(users, filename="random_users.csv"):
-    """Normalize nested JSON and save to CSV."""
-    df = pd.json_normalize(users)
-    users_csv_path = get_csv_filepath(filename)
-    df.to_csv(users_csv_path, index=False)
-    print(f"Saved {len(df)} users to {filename}")
+def token_bucket(rate=RATE_LIMIT, burst=RATE_BURST):
+    """
+    Create a token bucket rate limiter, shared by the requests of one fetch.
+
+    It holds up to burst tokens and refills rate tokens per second; every
+    request takes one (see acquire_token). A 429 halves the rate and pauses
+    the bucket (see throttle_bucket), and successes restore the rate step by
+    step up to its initial value (see recover_bucket).
+
+    Returns:
+        dict: The limiter state.
+    """
+    return {
+        "rate": rate,
+        "max_rate": rate,
+        "burst": burst,
+        "tokens": burst,
+        "updated": time.monotonic(),
+        "paused_until": 0.0,
+        "lock": asyncio.Lock(),
+        "throttled": 0,
+    }
+
+
+async def acquire_token(bucket):
+    """Wait until the bucket allows one more request."""
+    async with bucket["lock"]:
+        while True:
+            now = time.monotonic()
+            if now < bucket["paused_until"]:
+                await asyncio.sleep(bucket["paused_until"] - now)
+                continue
+            elapsed = now - bucket["updated"]
+            bucket["tokens"] = min(
+                bucket["burst"], bucket["tokens"] + elapsed * bucket["rate"]
+            )
+            bucket["updated"] = now
+            if bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                return
+            await asyncio.sleep((1 - bucket["tokens"]) / bucket["rate"])
+
+
+def throttle_bucket(bucket, retry_after=None):
+    """
+    Adapt the bucket to a 429 response: halve its rate and pause it for
+    Retry-After seconds (one refill interval without the header). The bucket
+    restarts empty, so waiting requests resume one by one.
+    """
+    bucket["rate"] = max(MIN_RATE, bucket["rate"] / 2)
+    pause = retry_after if retry_after is not None else 1 / bucket["rate"]
+    bucket["paused_until"] = max(bucket["paused_until"], time.monotonic() + pause)
+    bucket["tokens"] = 0
+    bucket["updated"] = bucket["paused_until"]
+    bucket["throttled"] += 1
+
+
+def recover_bucket(bucket):
+    """Raise the rate of the bucket after a successful request."""
+    bucket["rate"] = min(bucket["max_rate"], bucket["rate"] * RATE_RECOVERY)
+
+
+def create_session(concurrency=MAX_CONCURRENCY):
+    """
+    Create a pooled HTTP session for fetch_random_users_async.
+
+    The connector keeps at most concurrency connections open and reuses them
+    (keep-alive) across batches and across fetches sharing the session. Must
+    be called (and closed) inside the event loop that uses it.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency),
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        raise_for_status=False,
+    )
+
+
+async def fetch_batch_async(session, url, bucket, semaphore, delay=INITIAL_DELAY):
+    """
+    Fetch one batch, retrying 429s, server errors and connection failures.
+
+    Every attempt takes a token from the bucket. A 429 throttles the shared
+    bucket (honouring Retry-After); other failures wait a jittered backoff
+    before the next attempt. Client errors other than 429 are not retried.
+
+    Returns:
+        list: The users of the batch ([] if it could not be fetched).
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        await acquire_token(bucket)
+        if attempt > 1:
+            count("http_retries")
+        count("http_requests")
+        async with semaphore:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        recover_bucket(bucket)
+                        return await response.json()
+                    status = response.status
+                    retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = None
+                count("http_errors")
+                print(f"Request failed: {e!r} (Attempt {attempt}/{MAX_RETRIES})")
+        if status == 429:
+            count("http_429")
+            throttle_bucket(bucket, retry_after)
+            print(
+                f"Rate limited. Rate lowered to {bucket['rate']:.2f}/s "
+                f"(Attempt {attempt}/{MAX_RETRIES})..."
+            )
+            if retry_after is not None:
+                continue
+        elif status is not None and status < 500:
+            count("http_errors")
+            print(f"Error fetching data: Status code {status}")
+            return []
+        elif status is not None:
+            count("http_errors")
+        await asyncio.sleep(backoff_delay(attempt, delay))
+    print("Max retries reached. Skipping request.")
+    return []
+
+
+async def stream_random_users_async(
+    total=1000,
+    batch_size=100,
+    sink=None,
+    concurrency=MAX_CONCURRENCY,
+    rate=RATE_LIMIT,
+    session=None,
+    url=API_URL,
+):
+    """
+    Fetch batches with concurrency workers and hand each one to a sink.
+
+    Nothing is kept here: a worker only requests its next batch once
+    await sink(number, batch) has returned, so a slow sink (e.g. a full
+    queue) holds the fetch back. Requests share a token bucket limiter
+    starting at rate requests per second (see token_bucket) and a pooled
+    session, which is created and closed here unless one is given (see
+    create_session).
+
+    Parameters:
+        total (int): Number of users; total // batch_size batches are fetched.
+        batch_size (int): Users per request.
+        sink (coroutine function): Receives the batch number and users of
+                                   every batch ([] for a failed batch).
+        concurrency (int): Requests in flight at most.
+        rate (float): Initial (and highest) requests per second.
+        session (ClientSession): Optional session to reuse.
+        url (str): Endpoint with a {batch_size} placeholder.
+
+    Returns:
+        dict: Numbers of batches, failed batches and 429 responses.
+    """
+    num_batches = total // batch_size
+    batch_url = url.format(batch_size=batch_size)
+    bucket = token_bucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    numbers = iter(range(num_batches))
+    stats = {"batches": num_batches, "failed": 0, "throttled": 0}
+
+    async def worker():
+        for number in numbers:
+            batch = await fetch_batch_async(session, batch_url, bucket, semaphore)
+            if not batch:
+                stats["failed"] += 1
+            await sink(number, batch)
+
+    own_session = session is None
+    if own_session:
+        session = create_session(concurrency)
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, num_batches))))
+    finally:
+        if own_session:
+            await session.close()
+    stats["throttled"] = bucket["throttled"]
+    return stats
+
+
+async def fetch_random_users_async(
+    total=1000,
+    batch_size=100,
+    concurrency=MAX_CONCURRENCY,
+    rate=RATE_LIMIT,
+    session=None,
+    url=API_URL,
+    on_batch=None,
+):
+    """
+    Fetch users with up to concurrency batch requests in flight.
+
+    Parameters:
+        total, batch_size, concurrency, rate, session, url: See
+            stream_random_users_async.
+        on_batch (callable): Called with the users of every fetched batch as
+                             soon as it arrives (e.g. to store it).
+
+    Returns:
+        list: User dicts, batches in request order (failed batches are empty).
+    """
+    batches = [[] for _ in range(total // batch_size)]
+
+    async def collect(number, batch):
+        batches[number] = batch
+        if batch and on_batch is not None:
+            on_batch(batch)
+
+    stats = await stream_random_users_async(
+        total, batch_size, collect, concurrency, rate, session, url
+    )
+    users = [user for batch in batches for user in batch]
+    print(
+        f"Total users fetched: {len(users)} in {stats['batches']} batches "
+        f"({stats['failed']} failed, rate limited {stats['throttled']} times)."
+    )
+    return users
+
+
+@timed_stage(items=len, unit="users")
+def fetch_random_users_concurrent(total=1000, batch_size=100, **options):
+    """Run fetch_random_users_async to completion (options as it takes them)."""
+    return asyncio.run(fetch_random_users_async(total, batch_size, **options))
+
+
+@timed_stage(items=len, unit="users")
+def fetch_random_users_stored(
+    total=1000, batch_size=100, store=None, offline=False, **options
+):
+    """
+    Fetch users through the raw response store (see response_store).
+
+    Batches already stored are replayed from disk; only the users still
+    missing for total are fetched (which resumes an interrupted fetch), and
+    every fetched batch is appended to the store as soon as it arrives.
+
+    Parameters:
+        total (int): Number of users.
+        batch_size (int): Users per request.
+        store (dict): Store of response_store.open_store (the default store
+                      if None).
+        offline (bool): Never touch the network; return the stored users only.
+        options: Further arguments of fetch_random_users_async.
+
+    Returns:
+        list: The first total stored users.
+    """
+    store = store or open_store()
+    missing = total - stored_users(store)
+    if missing > 0 and not offline:
+        print(f"{stored_users(store)} users stored, fetching {missing} more...")
+        asyncio.run(
+            fetch_random_users_async(
+                math.ceil(missing / batch_size) * batch_size,
+                batch_size,
+                on_batch=lambda batch: append_batch(store, batch),
+                **options,
+            )
+        )
+    users = read_users(store, total)
+    print(f"Total users read from the response store: {len(users)}")
+    return users
+
+
+def normalize_users(users):
+    """
+    Flatten nested JSON users into one column per field ("address.city", ...).
+
+    The result is what save_users_to_csv writes; load_normalized_data and
+    database.similarity_frame also take it directly, without the CSV.
+    """
+    return pd.json_normalize(users)
+
+
+@timed_stage()
+def save_users_to_csv(users, filename="random_users.csv", output_format="csv"):
+    """
+    Normalize nested JSON (unless given a normalized DataFrame) and save to CSV,
+    or to Parquet / Arrow IPC with output_format (see util.get_dataset_filepath).
+    """
+    df = users if isinstance(users, pd.DataFrame) else normalize_users(users)
+    users_path = get_dataset_filepath(filename, output_format)
+    write_dataset(df, users_path)
+    print(f"Saved {len(df)} users to {os.path.basename(users_path)}")
+
+
+def save_users_to_csv_async(users, filename="random_users.csv", output_format="csv"):
+    """
+    Write the file of save_users_to_csv in a background thread.
+
+    The users must not be modified until the write is done.
+
+    Returns:
+        Future: Call result() to wait for the file (and raise its errors).
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(save_users_to_csv, users, filename, output_format)
+    executor.shutdown(wait=False)
+    return future
 
 
 if __name__ == "__main__":
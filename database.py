@@ -1,4 +1,13 @@
+import io
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+from psycopg2.extras import execute_values
+
+from metrics import timed_stage
+from util import iter_dataset, read_dataset
 
 
 def create_addresses_table(conn):
@@ -81,16 +90,130 @@ def create_users_table(conn):
         )
 
 
+def create_similarity_tables(conn):
+    """
+    Create the tables persisting similarity results between runs.
+
+    scored_users lists the users already compared with everyone before them,
+    similarity_pairs holds every pair reaching the Weak threshold and
+    similarity_groups the connected component and group of each user with at
+    least one Strong / Weak connection.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scored_users (
+                uid UUID PRIMARY KEY REFERENCES users(uid)
+            );
+
+            CREATE TABLE IF NOT EXISTS similarity_pairs (
+                user1_uid UUID REFERENCES users(uid),
+                user2_uid UUID REFERENCES users(uid),
+                personal_points SMALLINT,
+                address_points SMALLINT,
+                employment_points SMALLINT,
+                subscription_points SMALLINT,
+                field_mask INT,
+                total_points SMALLINT,
+                connection_type TEXT,
+                PRIMARY KEY (user1_uid, user2_uid)
+            );
+
+            CREATE TABLE IF NOT EXISTS similarity_groups (
+                connection_type TEXT,
+                uid UUID REFERENCES users(uid),
+                component_id INT,
+                group_id INT,
+                PRIMARY KEY (connection_type, uid)
+            );
+        """
+        )
+
+
 def create_tables(conn):
     """Create all normalized tables by invoking modular table creation functions."""
     create_addresses_table(conn)
     create_employment_table(conn)
     create_subscriptions_table(conn)
     create_users_table(conn)
+    create_similarity_tables(conn)
     conn.commit()
     print("Tables created successfully.")
 
 
+# B-tree indexes of create_indexes, as (table, columns): the foreign keys every
+# user query joins on, the columns analytic queries group or filter on and the
+# lookups of the incremental similarity updates.
+BTREE_INDEXES = (
+    ("users", "address_id"),
+    ("users", "employment_id"),
+    ("users", "subscription_id"),
+    ("users", "gender, date_of_birth"),
+    ("addresses", "state, city"),
+    ("addresses", "zip_code"),
+    ("similarity_pairs", "user2_uid"),
+    ("similarity_groups", "connection_type, component_id"),
+)
+
+# Text columns with a pg_trgm GIN index, probed by fetch_trigram_candidates.
+TRIGRAM_INDEXES = (
+    ("users", "first_name"),
+    ("users", "last_name"),
+    ("addresses", "city"),
+    ("addresses", "street_name"),
+    ("addresses", "street_address"),
+)
+
+
+def index_name(table, columns, suffix="idx"):
+    """Return the index name of columns ("a, b") of a table, e.g. users_a_b_idx."""
+    names = [column.strip() for column in columns.split(",")]
+    return "_".join([table, *names, suffix])
+
+
+@timed_stage()
+def create_indexes(conn, trigram=True):
+    """
+    Create the secondary indexes and refresh the planner statistics.
+
+    Indexes are created IF NOT EXISTS, so the call is cheap once they exist.
+    Building them after a bulk load is faster than maintaining them during it.
+    The trigram indexes need the pg_trgm extension and are skipped (with a
+    message) when it cannot be created.
+
+    Parameters:
+        conn: Database connection with the tables of create_tables.
+        trigram (bool): Also create the pg_trgm GIN indexes.
+
+    Returns:
+        bool: Whether the trigram indexes exist.
+    """
+    with conn.cursor() as cursor:
+        for table, columns in BTREE_INDEXES:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name(table, columns)} "
+                f"ON {table} ({columns});"
+            )
+        conn.commit()
+        if trigram:
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            except Exception as e:
+                conn.rollback()
+                print("Skipping trigram indexes, pg_trgm is not available:", e)
+                trigram = False
+        if trigram:
+            for table, column in TRIGRAM_INDEXES:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name(table, column, 'trgm_idx')} "
+                    f"ON {table} USING GIN ({column} gin_trgm_ops);"
+                )
+        cursor.execute("ANALYZE users, addresses, employment, subscriptions;")
+    conn.commit()
+    print("Indexes created successfully.")
+    return trigram
+
+
 def insert_address(cursor, row):
     """Insert an address and return its generated id."""
     query = """
@@ -171,23 +294,750 @@ def insert_user(cursor, row, address_id, employment_id, subscription_id):
     )
 
 
-def load_normalized_data(conn, csv_file):
-    """Read CSV file and insert normalized data into the database."""
-    df = pd.read_csv(csv_file)
+# Modes of load_normalized_data.
+LOAD_MODES = ("copy", "rows")
+
+# CSV rows read and copied per chunk in "copy" mode.
+COPY_CHUNK_SIZE = 50000
+
+# Table column -> CSV column of every normalized table.
+ADDRESS_COLUMNS = {
+    "city": "address.city",
+    "street_name": "address.street_name",
+    "street_address": "address.street_address",
+    "zip_code": "address.zip_code",
+    "state": "address.state",
+    "country": "address.country",
+    "latitude": "address.coordinates.lat",
+    "longitude": "address.coordinates.lng",
+}
+EMPLOYMENT_COLUMNS = {"title": "employment.title", "key_skill": "employment.key_skill"}
+SUBSCRIPTION_COLUMNS = {
+    "plan": "subscription.plan",
+    "status": "subscription.status",
+    "payment_method": "subscription.payment_method",
+    "term": "subscription.term",
+}
+USER_COLUMNS = {
+    "uid": "uid",
+    "password": "password",
+    "first_name": "first_name",
+    "last_name": "last_name",
+    "username": "username",
+    "email": "email",
+    "avatar": "avatar",
+    "gender": "gender",
+    "phone_number": "phone_number",
+    "social_insurance_number": "social_insurance_number",
+    "date_of_birth": "date_of_birth",
+    "credit_card_number": "credit_card.cc_number",
+}
+
+
+def table_frame(chunk, columns):
+    """
+    Select the CSV columns of a table from a chunk, renamed to table columns;
+    columns missing from the chunk are empty.
+    """
+    frame = chunk.reindex(columns=list(columns.values()))
+    frame.columns = list(columns)
+    return frame
+
+
+def normalized_chunks(source, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Yield chunks of normalized users from a CSV, Parquet or Arrow file (read
+    as text, the latter two memory-mapped) or from a DataFrame already in
+    memory (see data_collection.normalize_users).
+    """
+    if isinstance(source, pd.DataFrame):
+        return (
+            source.iloc[start : start + chunk_size]
+            for start in range(0, len(source), chunk_size)
+        )
+    return iter_dataset(source, chunk_size, dtype=str)
+
+
+def reserve_ids(cursor, table, count):
+    """Draw count ids from the serial sequence of a table."""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id');", (table,))
+    sequence = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT array_agg(nextval(%s::regclass)) FROM generate_series(1, %s);",
+        (sequence, count),
+    )
+    return cursor.fetchone()[0]
+
+
+def copy_frame(cursor, table, frame):
+    """Stream a DataFrame into a table with COPY FROM STDIN (missing values as NULL)."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv);",
+        buffer,
+    )
+
+
+def copy_normalized_chunk(cursor, chunk, cache=None):
+    """
+    Load a chunk of CSV rows with one COPY per table.
+
+    The address, employment and subscription ids are reserved from their
+    sequences up front, so the users can be copied with their foreign keys
+    without a round trip per row. With a cache (dict of table -> natural key
+    cache), employment and subscriptions are resolved as shared dimension rows
+    through get_or_create_dimensions instead.
+    """
+    users = table_frame(chunk, USER_COLUMNS)
+    for table, columns, key in (
+        ("addresses", ADDRESS_COLUMNS, "address_id"),
+        ("employment", EMPLOYMENT_COLUMNS, "employment_id"),
+        ("subscriptions", SUBSCRIPTION_COLUMNS, "subscription_id"),
+    ):
+        frame = table_frame(chunk, columns)
+        if cache is not None and table in DIMENSION_KEYS:
+            users[key] = get_or_create_dimensions(
+                cursor, table, natural_keys(frame), cache.setdefault(table, {})
+            )
+            continue
+        frame.insert(0, "id", reserve_ids(cursor, table, len(frame)))
+        copy_frame(cursor, table, frame)
+        users[key] = frame["id"].to_numpy()
+    copy_frame(cursor, "users", users)
+
+
+# Natural keys of the deduplicated dimension tables (see load_normalized_data).
+DIMENSION_KEYS = {
+    "employment": ("title", "key_skill"),
+    "subscriptions": ("plan", "status", "payment_method", "term"),
+}
+
+
+def dimension_index(table):
+    """Return the name of the unique natural key index of a dimension table."""
+    return f"{table}_natural_key"
+
+
+def has_dimension_constraints(cursor):
+    """Return whether a dimension table has its unique natural key index."""
+    for table in DIMENSION_KEYS:
+        cursor.execute("SELECT to_regclass(%s);", (dimension_index(table),))
+        if cursor.fetchone()[0] is not None:
+            return True
+    return False
+
+
+def use_dimensions(cursor, dimensions):
+    """
+    Return whether a load stores dimension rows, adding the unique indexes
+    when dimensions is set.
+
+    The indexes stay once added, and plain inserts of a stored natural key
+    would violate them, so a load without dimensions is switched to
+    dimension mode (with a message) when they exist.
+    """
+    if dimensions:
+        create_dimension_constraints(cursor)
+        return True
+    if has_dimension_constraints(cursor):
+        print("Dimension tables have unique natural keys, loading in dimension mode.")
+        return True
+    return False
+
+
+def create_dimension_constraints(cursor):
+    """
+    Add a unique index on the natural key of every dimension table.
+
+    Existing duplicate rows are merged first: users are pointed at the lowest
+    id of their natural key and the other rows are deleted. Missing values
+    count as equal (NULLS NOT DISTINCT), which needs PostgreSQL 15+; older
+    servers raise a RuntimeError.
+    """
+    for table, columns in DIMENSION_KEYS.items():
+        index = dimension_index(table)
+        cursor.execute("SELECT to_regclass(%s);", (index,))
+        if cursor.fetchone()[0] is not None:
+            continue
+        if cursor.connection.server_version < 150000:
+            raise RuntimeError(
+                "Dimension mode needs PostgreSQL 15+ (unique indexes with "
+                "NULLS NOT DISTINCT)"
+            )
+        key = ", ".join(columns)
+        reference = "employment_id" if table == "employment" else "subscription_id"
+        duplicates = f"""
+            SELECT id, MIN(id) OVER (PARTITION BY {key}) AS keep_id FROM {table}
+        """
+        cursor.execute(
+            f"""
+            UPDATE users u SET {reference} = d.keep_id
+            FROM ({duplicates}) d
+            WHERE u.{reference} = d.id AND d.id <> d.keep_id;
+
+            DELETE FROM {table} t
+            USING ({duplicates}) d
+            WHERE t.id = d.id AND d.id <> d.keep_id;
+
+            CREATE UNIQUE INDEX {index} ON {table} ({key}) NULLS NOT DISTINCT;
+            """
+        )
+
+
+def natural_keys(frame):
+    """Return the rows of a frame as tuples, with missing values as None."""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return list(frame.itertuples(index=False, name=None))
+
+
+def get_or_create_dimensions(cursor, table, keys, cache):
+    """
+    Resolve natural keys to dimension ids, creating the missing rows.
+
+    Keys already in the cache cost no database round trip; all other distinct
+    keys are resolved in one INSERT ... ON CONFLICT statement returning the id
+    of the new or existing row.
+
+    Parameters:
+        cursor: Database cursor.
+        table (str): A table of DIMENSION_KEYS.
+        keys (list): Natural key tuples, one per user.
+        cache (dict): Natural key -> id, updated in place.
+
+    Returns:
+        list: The id of every key.
+    """
+    # Sorted, so concurrent loads lock new keys in the same order.
+    missing = sorted(set(key for key in keys if key not in cache), key=repr)
+    if missing:
+        columns = DIMENSION_KEYS[table]
+        key = ", ".join(columns)
+        rows = execute_values(
+            cursor,
+            f"""
+            INSERT INTO {table} ({key}) VALUES %s
+            ON CONFLICT ({key}) DO UPDATE SET {columns[0]} = EXCLUDED.{columns[0]}
+            RETURNING id, {key};
+            """,
+            missing,
+            fetch=True,
+        )
+        for row in rows:
+            cache[tuple(row[1:])] = row[0]
+    return [cache[key] for key in keys]
+
+
+# How load_normalized_data treats users whose uid is already stored.
+CONFLICT_MODES = ("skip", "update", "error")
+
+# Staging table of the upsert path, and (table, alias, staged id column, CSV
+# columns) of every table it merges into.
+STAGING_TABLE = "staging_users"
+STAGED_TABLES = (
+    ("users", "u", "user_id", USER_COLUMNS),
+    ("addresses", "a", "address_id", ADDRESS_COLUMNS),
+    ("employment", "e", "employment_id", EMPLOYMENT_COLUMNS),
+    ("subscriptions", "t", "subscription_id", SUBSCRIPTION_COLUMNS),
+)
+
+
+def staged_columns(alias=None):
+    """Return the staged value columns (all but uid), optionally alias-qualified."""
+    return [
+        f"{alias or table_alias}.{column}"
+        for _, table_alias, _, columns in STAGED_TABLES
+        for column in columns
+        if column != "uid"
+    ]
+
+
+def stage_chunk(cursor, chunk, values=True):
+    """
+    Copy a chunk into a fresh temporary staging table and match it with users.
+
+    The staging table has the typed columns of all four tables, the position
+    of every row in the chunk, and the ids of the stored user (and its
+    address, employment and subscription rows) with the same uid. changed
+    tells whether a stored user differs from its staged values. With
+    values=False only the uids are copied (enough to skip stored users).
+
+    Returns:
+        int: Number of staged users that are already stored.
+    """
+    value_columns = ", ".join(staged_columns())
+    cursor.execute(
+        f"""
+        DROP TABLE IF EXISTS {STAGING_TABLE};
+        CREATE TEMP TABLE {STAGING_TABLE} AS
+        SELECT u.uid, {value_columns}, 0 AS position, u.id AS user_id,
+               u.address_id, u.employment_id, u.subscription_id, FALSE AS changed
+        FROM users u, addresses a, employment e, subscriptions t
+        WITH NO DATA;
+        """
+    )
+    staged = {"uid": "uid"}
+    if values:
+        for _, _, _, columns in STAGED_TABLES:
+            staged.update(columns)
+    frame = table_frame(chunk, staged)
+    frame["position"] = range(len(frame))
+    copy_frame(cursor, STAGING_TABLE, frame)
+    changed = f"({', '.join(staged_columns('s'))}) IS DISTINCT FROM ({value_columns})"
+    cursor.execute(
+        f"""
+        UPDATE {STAGING_TABLE} s SET
+            user_id = u.id,
+            address_id = u.address_id,
+            employment_id = u.employment_id,
+            subscription_id = u.subscription_id,
+            changed = {changed if values else "FALSE"}
+        FROM users u
+        LEFT JOIN addresses a ON a.id = u.address_id
+        LEFT JOIN employment e ON e.id = u.employment_id
+        LEFT JOIN subscriptions t ON t.id = u.subscription_id
+        WHERE u.uid = s.uid;
+        """
+    )
+    return cursor.rowcount
+
+
+def update_staged_users(cursor, dimensions=False):
+    """
+    Overwrite the stored users whose staged values changed, set-based.
+
+    Users and addresses are updated in place, and so are employment and
+    subscriptions unless they are shared dimension rows: then the changed
+    natural keys are created if missing and the users repointed to them.
+
+    Returns:
+        int: Number of updated users.
+    """
+    updated = 0
+    for table, alias, staged_id, columns in STAGED_TABLES:
+        columns = [column for column in columns if column != "uid"]
+        if dimensions and table in DIMENSION_KEYS:
+            key = ", ".join(columns)
+            stored_key = ", ".join(f"{alias}.{column}" for column in columns)
+            staged_key = ", ".join(f"s.{column}" for column in columns)
+            cursor.execute(
+                f"""
+                INSERT INTO {table} ({key})
+                SELECT DISTINCT {key} FROM {STAGING_TABLE} WHERE changed ORDER BY {key}
+                ON CONFLICT DO NOTHING;
+
+                UPDATE users u SET {staged_id} = {alias}.id
+                FROM {STAGING_TABLE} s
+                JOIN {table} {alias} ON ({stored_key}) IS NOT DISTINCT FROM ({staged_key})
+                WHERE u.id = s.user_id AND s.changed;
+                """
+            )
+            continue
+        assignments = ", ".join(f"{column} = s.{column}" for column in columns)
+        cursor.execute(
+            f"""
+            UPDATE {table} {alias} SET {assignments}
+            FROM {STAGING_TABLE} s
+            WHERE {alias}.id = s.{staged_id} AND s.changed;
+            """
+        )
+        if table == "users":
+            updated = cursor.rowcount
+    return updated
+
+
+def merge_normalized_chunk(
+    cursor, chunk, on_conflict="skip", dimensions=False, cache=None, summary=False
+):
+    """
+    Load a chunk of CSV rows, skipping or updating the users already stored.
+
+    The chunk is staged once (see stage_chunk, only its uids when skipping);
+    existing uids are skipped or updated with set-based statements, and only
+    the new users go through copy_normalized_chunk, so reloading an
+    overlapping feed costs one staging COPY plus work proportional to the new
+    rows. A uid repeated within the chunk keeps its last row. With summary,
+    the property value counts are moved from the old to the new values of
+    updated users and the new users are added.
+
+    Returns:
+        dict: Numbers of inserted, updated and skipped rows.
+    """
+    unique = chunk.drop_duplicates("uid", keep="last")
+    existing = stage_chunk(cursor, unique, values=on_conflict == "update")
+    updated = 0
+    if on_conflict == "update":
+        changed = f"u.id IN (SELECT user_id FROM {STAGING_TABLE} WHERE changed)"
+        if summary:
+            add_property_counts(cursor, changed, sign=-1)
+        updated = update_staged_users(cursor, dimensions)
+        if summary:
+            add_property_counts(cursor, changed)
+    cursor.execute(
+        f"SELECT position FROM {STAGING_TABLE} WHERE user_id IS NULL ORDER BY position;"
+    )
+    new = unique.iloc[[row[0] for row in cursor.fetchall()]]
+    if len(new):
+        copy_normalized_chunk(cursor, new, cache)
+        if summary:
+            add_property_counts(
+                cursor,
+                f"u.uid IN (SELECT uid FROM {STAGING_TABLE} WHERE user_id IS NULL)",
+            )
+    return {
+        "inserted": len(new),
+        "updated": updated,
+        "skipped": len(chunk) - len(unique) + existing - updated,
+    }
+
+
+def existing_uids(cursor, uids):
+    """Return the subset of uids (strings) already stored in users."""
+    cursor.execute(
+        "SELECT uid::text FROM users WHERE uid = ANY(%s::uuid[]);", (list(uids),)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def copy_chunks(
+    cursor, chunks, on_conflict="skip", dimensions=False, cache=None, summary=False
+):
+    """
+    Load CSV chunks (read with dtype=str) the way copy mode does.
+
+    Parameters:
+        cursor: Database cursor.
+        chunks (iterable): DataFrames of CSV rows.
+        on_conflict, dimensions: See load_normalized_data.
+        cache (dict): Dimension cache (None without dimensions).
+        summary (bool): Whether to maintain the property value count summary.
+
+    Returns:
+        dict: Numbers of inserted, updated and skipped rows.
+    """
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    for chunk in chunks:
+        if on_conflict == "error":
+            copy_normalized_chunk(cursor, chunk, cache)
+            if summary:
+                add_property_counts(
+                    cursor, "u.uid = ANY(%(uids)s::uuid[])", {"uids": list(chunk["uid"])}
+                )
+            counts["inserted"] += len(chunk)
+            continue
+        merged = merge_normalized_chunk(
+            cursor, chunk, on_conflict, dimensions, cache, summary
+        )
+        for key, count in merged.items():
+            counts[key] += count
+    return counts
+
+
+def loaded_rows(counts):
+    """Return the rows a load processed, from its counts (None if it failed)."""
+    return None if counts is None else sum(counts.values())
+
+
+@timed_stage(items=loaded_rows, profile=True)
+def load_normalized_data(
+    conn, csv_file, mode="copy", dimensions=False, cache=None, on_conflict="skip"
+):
+    """
+    Read CSV file and insert normalized data into the database.
+
+    The property value count summary is kept up to date when it exists (see
+    create_property_summary).
+
+    Parameters:
+        conn: Database connection.
+        csv_file (str | DataFrame): CSV (or Parquet / Arrow file) written by
+                                    save_users_to_csv, or the normalized
+                                    users in memory (see
+                                    data_collection.normalize_users), which
+                                    skips writing and parsing the file.
+        mode (str): "copy" streams the file in chunks through COPY FROM STDIN
+                    (values are kept as written in the CSV); "rows" inserts
+                    row by row.
+        dimensions (bool): Store employment and subscriptions as deduplicated
+                           dimension rows shared by all users with the same
+                           natural key (adds the unique constraints on first
+                           use, PostgreSQL 15+). Once they exist every load
+                           uses dimension mode.
+        cache (dict): Optional table -> {natural key: id} cache to reuse across
+                      loads with dimensions; it is cleared if the load fails.
+        on_conflict (str): What to do with users whose uid is already stored:
+                           "skip" them, "update" them from the CSV (copy mode
+                           only) or "error" (the whole load is rolled back).
+
+    Returns:
+        dict: Numbers of inserted, updated and skipped rows, or None if the
+              load failed.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode {mode!r}, expected one of {LOAD_MODES}")
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(
+            f"Unknown conflict mode {on_conflict!r}, expected one of {CONFLICT_MODES}"
+        )
+    if mode == "rows" and on_conflict == "update":
+        raise ValueError('on_conflict="update" requires mode="copy"')
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
     try:
         with conn.cursor() as cursor:
-            for index, row in df.iterrows():
-                # Insert data into addresses, employment, and subscriptions tables at first
-                address_id = insert_address(cursor, row)
-                employment_id = insert_employment(cursor, row)
-                subscription_id = insert_subscription(cursor, row)
-                # Insert user records with foreign key references
-                insert_user(cursor, row, address_id, employment_id, subscription_id)
+            dimensions = use_dimensions(cursor, dimensions)
+            if dimensions and cache is None:
+                cache = {}
+            summary = has_property_summary(cursor)
+            if mode == "copy":
+                counts = copy_chunks(
+                    cursor,
+                    normalized_chunks(csv_file),
+                    on_conflict,
+                    dimensions,
+                    cache if dimensions else None,
+                    summary,
+                )
+            else:
+                df = (
+                    csv_file
+                    if isinstance(csv_file, pd.DataFrame)
+                    else read_dataset(csv_file)
+                )
+                if on_conflict == "skip":
+                    stored = existing_uids(cursor, df["uid"].astype(str))
+                    keep = ~df["uid"].isin(stored) & ~df["uid"].duplicated(keep="last")
+                    counts["skipped"] = len(df) - int(keep.sum())
+                    df = df[keep]
+                if dimensions:
+                    employment_keys = natural_keys(table_frame(df, EMPLOYMENT_COLUMNS))
+                    subscription_keys = natural_keys(
+                        table_frame(df, SUBSCRIPTION_COLUMNS)
+                    )
+                for position, (index, row) in enumerate(df.iterrows()):
+                    # Insert data into addresses, employment, and subscriptions tables at first
+                    address_id = insert_address(cursor, row)
+                    if dimensions:
+                        employment_id = get_or_create_dimensions(
+                            cursor,
+                            "employment",
+                            [employment_keys[position]],
+                            cache.setdefault("employment", {}),
+                        )[0]
+                        subscription_id = get_or_create_dimensions(
+                            cursor,
+                            "subscriptions",
+                            [subscription_keys[position]],
+                            cache.setdefault("subscriptions", {}),
+                        )[0]
+                    else:
+                        employment_id = insert_employment(cursor, row)
+                        subscription_id = insert_subscription(cursor, row)
+                    # Insert user records with foreign key references
+                    insert_user(cursor, row, address_id, employment_id, subscription_id)
+                if summary and len(df):
+                    add_property_counts(
+                        cursor,
+                        "u.uid = ANY(%(uids)s::uuid[])",
+                        {"uids": df["uid"].astype(str).tolist()},
+                    )
+                counts["inserted"] = len(df)
         conn.commit()
         print("Data loaded successfully into normalized tables.")
+        print(
+            f"Inserted {counts['inserted']}, updated {counts['updated']}, "
+            f"skipped {counts['skipped']} users."
+        )
+        return counts
+    except Exception as e:
+        conn.rollback()
+        if cache:
+            cache.clear()
+        print("Error loading data:", e)
+        return None
+
+
+@timed_stage(items=loaded_rows, profile=True)
+def load_normalized_stream(
+    conn, chunks, dimensions=False, cache=None, on_conflict="skip"
+):
+    """
+    Load chunks of normalized users in copy mode as they arrive.
+
+    Every chunk is committed on its own, so only one chunk is held in memory
+    and in the open transaction. A failure rolls back the current chunk only;
+    the committed chunks stay, and running the load again with
+    on_conflict="skip" completes it.
+
+    Parameters:
+        conn: Database connection.
+        chunks (iterable): DataFrames of normalized users (see
+                           pipeline.stream_users), consumed lazily.
+        dimensions, cache, on_conflict: See load_normalized_data.
+
+    Returns:
+        dict: Numbers of inserted, updated and skipped rows, or None if the
+              load failed.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(
+            f"Unknown conflict mode {on_conflict!r}, expected one of {CONFLICT_MODES}"
+        )
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    try:
+        with conn.cursor() as cursor:
+            dimensions = use_dimensions(cursor, dimensions)
+            if dimensions and cache is None:
+                cache = {}
+            summary = has_property_summary(cursor)
+            conn.commit()
+            for chunk in chunks:
+                chunk_counts = copy_chunks(
+                    cursor,
+                    [chunk],
+                    on_conflict,
+                    dimensions,
+                    cache if dimensions else None,
+                    summary,
+                )
+                conn.commit()
+                for key, count in chunk_counts.items():
+                    counts[key] += count
+        print("Data streamed successfully into normalized tables.")
+        return counts
     except Exception as e:
         conn.rollback()
+        if cache:
+            cache.clear()
         print("Error loading data:", e)
+        return None
+    finally:
+        print(
+            f"Inserted {counts['inserted']}, updated {counts['updated']}, "
+            f"skipped {counts['skipped']} users."
+        )
+
+
+def load_partition(pool, partition, on_conflict, dimensions, cache, summary):
+    """
+    Load one partition on its own pooled connection and commit it.
+
+    Returns:
+        tuple: (counts, cache) with the dimension ids resolved by the partition.
+    """
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            counts = copy_chunks(
+                cursor,
+                normalized_chunks(partition),
+                on_conflict,
+                dimensions,
+                cache,
+                summary,
+            )
+        conn.commit()
+        return counts, cache
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+@timed_stage(items=loaded_rows)
+def load_normalized_data_parallel(
+    pool,
+    csv_file,
+    partitions=4,
+    workers=None,
+    dimensions=False,
+    cache=None,
+    on_conflict="skip",
+):
+    """
+    Load a CSV in copy mode over several pooled connections at once.
+
+    Users are hash-partitioned on uid, so a uid always lands in the same
+    partition. The partitions are loaded by worker threads, each in its own
+    transaction on its own pooled connection and committed on its own: a
+    failing partition only rolls back itself.
+
+    Parameters:
+        pool: psycopg2 connection pool (see pool.get_pool) with at least
+              workers free connections.
+        csv_file (str | DataFrame): CSV or normalized users, as in
+                                    load_normalized_data.
+        partitions (int): Number of partitions.
+        workers (int): Partitions loaded at the same time (defaults to
+                       partitions).
+        dimensions, cache, on_conflict: See load_normalized_data. Each
+                                        partition starts from a copy of the
+                                        cache, which gets the ids of committed
+                                        partitions only.
+
+    Returns:
+        dict: Numbers of inserted, updated and skipped rows of the committed
+              partitions, and of the rows of failed partitions ("failed").
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(
+            f"Unknown conflict mode {on_conflict!r}, expected one of {CONFLICT_MODES}"
+        )
+    if cache is None:
+        cache = {}
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            dimensions = use_dimensions(cursor, dimensions)
+            summary = has_property_summary(cursor)
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+    df = (
+        csv_file
+        if isinstance(csv_file, pd.DataFrame)
+        else read_dataset(csv_file, dtype=str)
+    )
+    buckets = pd.util.hash_pandas_object(df["uid"], index=False).to_numpy() % partitions
+    parts = [df[buckets == k] for k in range(partitions)]
+    parts = [part for part in parts if len(part)]
+    counts = {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=workers or partitions) as executor:
+        futures = [
+            executor.submit(
+                load_partition,
+                pool,
+                part,
+                on_conflict,
+                dimensions,
+                (
+                    {table: dict(ids) for table, ids in cache.items()}
+                    if dimensions
+                    else None
+                ),
+                summary,
+            )
+            for part in parts
+        ]
+        for part, future in zip(parts, futures):
+            try:
+                part_counts, part_cache = future.result()
+            except Exception as e:
+                print("Error loading partition:", e)
+                counts["failed"] += len(part)
+                continue
+            for key, count in part_counts.items():
+                counts[key] += count
+            for table, ids in (part_cache or {}).items():
+                cache.setdefault(table, {}).update(ids)
+    print(
+        f"Inserted {counts['inserted']}, updated {counts['updated']}, "
+        f"skipped {counts['skipped']} users in {len(parts)} partitions "
+        f"({counts['failed']} rows in failed partitions)."
+    )
+    return counts
 
 
 def fetch_users(conn):
@@ -226,34 +1076,645 @@ def fetch_users(conn):
         return pd.DataFrame()
 
 
-def most_common_properties(conn):
+# Columns of fetch_similarity_users (the fields the similarity code reads), as
+# name -> SQL expression. uid and date_of_birth come as the text str() gives.
+SIMILARITY_COLUMNS = {
+    "uid": "u.uid::text",
+    "first_name": "u.first_name",
+    "last_name": "u.last_name",
+    "gender": "u.gender",
+    "date_of_birth": "u.date_of_birth::text",
+    "city": "a.city",
+    "street_name": "a.street_name",
+    "street_address": "a.street_address",
+    "zip_code": "a.zip_code",
+    "state": "a.state",
+    "latitude": "a.latitude",
+    "longitude": "a.longitude",
+    "employment_title": "e.title",
+    "key_skill": "e.key_skill",
+    "subscription_plan": "s.plan",
+    "subscription_status": "s.status",
+    "payment_method": "s.payment_method",
+    "subscription_term": "s.term",
+}
+
+# Explicit dtypes of the fetched columns; the others are object columns of str
+# (None for NULL, which the comparators read as "None" like fetch_users).
+SIMILARITY_DTYPES = {"latitude": "float64", "longitude": "float64"}
+
+# Rows transferred per round trip by the server-side cursor.
+FETCH_CHUNK_SIZE = 10000
+
+# Suffixes keeping the names of concurrently open server-side cursors unique.
+CURSOR_IDS = itertools.count()
+
+
+def iter_users(conn, columns=None, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Stream users through a named server-side cursor.
+
+    Only chunk_size rows are held in Python at a time; each chunk becomes a
+    DataFrame with explicit dtypes. Users come ordered by id.
+
+    Parameters:
+        conn: Database connection.
+        columns (dict): Name -> SQL expression over users u, addresses a,
+                        employment e and subscriptions s (defaults to
+                        SIMILARITY_COLUMNS).
+        chunk_size (int): Rows per chunk.
+
+    Yields:
+        DataFrame: One chunk of users.
+    """
+    columns = columns or SIMILARITY_COLUMNS
+    select = ", ".join(f"{expression} AS {name}" for name, expression in columns.items())
+    dtypes = {name: SIMILARITY_DTYPES.get(name, object) for name in columns}
+    with conn.cursor(name=f"iter_users_{next(CURSOR_IDS)}") as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(
+            f"""
+            SELECT {select}
+            FROM users u
+            JOIN addresses a ON u.address_id = a.id
+            JOIN employment e ON u.employment_id = e.id
+            JOIN subscriptions s ON u.subscription_id = s.id
+            ORDER BY u.id;
+            """
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=list(columns)).astype(dtypes)
+
+
+@timed_stage(items=len)
+def fetch_similarity_users(conn, columns=None, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Fetch the users with only the columns the similarity code reads.
+
+    A drop-in for fetch_users in find_similar_users / update_similar_users:
+    rows are streamed in chunks (see iter_users) and the chunks concatenated,
+    so the full result is never materialized as Python tuples.
+
+    Returns:
+        DataFrame: One row per user.
+    """
+    columns = columns or SIMILARITY_COLUMNS
+    try:
+        chunks = list(iter_users(conn, columns, chunk_size))
+    except Exception as e:
+        conn.rollback()
+        print("Error fetching users:", e)
+        return pd.DataFrame()
+    if not chunks:
+        return pd.DataFrame(columns=list(columns)).astype(
+            {name: SIMILARITY_DTYPES.get(name, object) for name in columns}
+        )
+    return pd.concat(chunks, ignore_index=True)
+
+
+# Normalized (json_normalize / CSV) column of every SIMILARITY_COLUMNS name.
+SIMILARITY_SOURCE_COLUMNS = {
+    **{
+        name: USER_COLUMNS[name]
+        for name in ("uid", "first_name", "last_name", "gender", "date_of_birth")
+    },
+    **{
+        name: ADDRESS_COLUMNS[name]
+        for name in (
+            "city",
+            "street_name",
+            "street_address",
+            "zip_code",
+            "state",
+            "latitude",
+            "longitude",
+        )
+    },
+    "employment_title": EMPLOYMENT_COLUMNS["title"],
+    "key_skill": EMPLOYMENT_COLUMNS["key_skill"],
+    "subscription_plan": SUBSCRIPTION_COLUMNS["plan"],
+    "subscription_status": SUBSCRIPTION_COLUMNS["status"],
+    "payment_method": SUBSCRIPTION_COLUMNS["payment_method"],
+    "subscription_term": SUBSCRIPTION_COLUMNS["term"],
+}
+
+
+def similarity_frame(users):
+    """
+    Build the fetch_similarity_users frame of normalized users in memory.
+
+    A uid repeated in users keeps its last row, as loading them would. The
+    values and dtypes are those fetch_similarity_users returns for the same
+    users freshly loaded: text columns hold str (None when missing) and
+    coordinates float64.
+
+    Parameters:
+        users (DataFrame): Normalized users (see data_collection.normalize_users).
+
+    Returns:
+        DataFrame: One row per distinct uid, in order of their last occurrence.
+    """
+    unique = users.drop_duplicates("uid", keep="last")
+    frame = table_frame(unique, SIMILARITY_SOURCE_COLUMNS).reset_index(drop=True)
+    for name in frame.columns:
+        if name in SIMILARITY_DTYPES:
+            frame[name] = pd.to_numeric(frame[name], errors="coerce").astype(
+                SIMILARITY_DTYPES[name]
+            )
+        else:
+            frame[name] = pd.Series(
+                [None if pd.isna(value) else str(value) for value in frame[name]],
+                dtype=object,
+            )
+    return frame
+
+
+# pg_trgm similarity (shared trigrams / all trigrams) a candidate pair needs on
+# the compared columns; 0.3 is the pg_trgm default.
+TRIGRAM_THRESHOLD = 0.3
+
+# Candidate pairs of fetch_trigram_candidates: users whose last and first names
+# are both similar, who share gender and birth date, or whose street addresses
+# and cities are similar. The join condition of each branch probes an index
+# (GIN for %, the B-tree on gender and date_of_birth), the WHERE clause filters.
+TRIGRAM_CANDIDATES_QUERY = """
+    SELECT u1.uid::text, u2.uid::text
+    FROM users u1
+    JOIN users u2 ON u2.last_name % u1.last_name
+    WHERE u1.id < u2.id AND u2.first_name % u1.first_name
+    UNION
+    SELECT u1.uid::text, u2.uid::text
+    FROM users u1
+    JOIN users u2 ON u2.gender = u1.gender AND u2.date_of_birth = u1.date_of_birth
+    WHERE u1.id < u2.id
+    UNION
+    SELECT u1.uid::text, u2.uid::text
+    FROM addresses a1
+    JOIN addresses a2 ON a2.street_address % a1.street_address
+    JOIN users u1 ON u1.address_id = a1.id
+    JOIN users u2 ON u2.address_id = a2.id
+    WHERE u1.id < u2.id AND a2.city % a1.city;
+"""
+
+
+@timed_stage(items=lambda pairs: len(pairs[0]), unit="pairs")
+def fetch_trigram_candidates(
+    conn, threshold=TRIGRAM_THRESHOLD, chunk_size=FETCH_CHUNK_SIZE
+):
+    """
+    Let the database pre-filter the user pairs worth scoring.
+
+    Pairs come from trigram similarity over the GIN indexes of create_indexes
+    (see TRIGRAM_CANDIDATES_QUERY), so only they are transferred and scored
+    exactly by find_similar_users(candidates=...). This is an approximate
+    blocking: pairs matching only on other fields (birth date, location,
+    subscription) are not proposed, and short names with a typo can fall
+    below the threshold. The candidates are therefore far from a superset
+    of the reported pairs: on 1000 synthetic users (seed 0) they hold 31% of
+    the Strong and 0.3% of the Weak pairs (see
+    user_similarity.measure_blocking_recall). Needs the pg_trgm extension.
+
+    Parameters:
+        conn: Database connection.
+        threshold (float): pg_trgm similarity threshold of the % operator.
+        chunk_size (int): Pairs transferred per round trip.
+
+    Returns:
+        tuple: (user1, user2) object arrays of uids, one entry per pair.
+    """
+    user1 = []
+    user2 = []
+    with conn.cursor() as cursor:
+        # Local to the transaction, like the server-side cursor below.
+        cursor.execute(
+            "SELECT set_config('pg_trgm.similarity_threshold', %s, true);",
+            (str(threshold),),
+        )
+    with conn.cursor(name=f"trigram_candidates_{next(CURSOR_IDS)}") as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(TRIGRAM_CANDIDATES_QUERY)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            pairs = np.array(rows, dtype=object).reshape(-1, 2)
+            user1.append(pairs[:, 0])
+            user2.append(pairs[:, 1])
+    if not user1:
+        return np.empty(0, dtype=object), np.empty(0, dtype=object)
+    return np.concatenate(user1), np.concatenate(user2)
+
+
+# Properties reported by most_common_properties, as (source, property -> SQL
+# expression) per table. Every table is reached through users, so each user
+# counts once even when employment and subscriptions are shared dimensions.
+PROPERTY_SOURCES = (
+    (
+        "users u",
+        {
+            "first_name": "u.first_name",
+            "last_name": "u.last_name",
+            "username": "u.username",
+            "gender": "u.gender",
+            "birth_year": "EXTRACT(YEAR FROM u.date_of_birth)",
+        },
+    ),
+    (
+        "users u JOIN addresses a ON a.id = u.address_id",
+        {
+            "city": "a.city",
+            "state": "a.state",
+            "country": "a.country",
+            "street_name": "a.street_name",
+            "street_address": "a.street_address",
+            "zip_code": "a.zip_code",
+        },
+    ),
+    (
+        "users u JOIN employment e ON e.id = u.employment_id",
+        {"employment_title": "e.title", "key_skill": "e.key_skill"},
+    ),
+    (
+        "users u JOIN subscriptions t ON t.id = u.subscription_id",
+        {
+            "subscription_plan": "t.plan",
+            "subscription_status": "t.status",
+            "payment_method": "t.payment_method",
+            "subscription_term": "t.term",
+        },
+    ),
+)
+PROPERTIES = [prop for _, properties in PROPERTY_SOURCES for prop in properties]
+
+# Properties that are not text, with the type their values are returned as
+# (the counting queries and the summary table hold every value as text).
+PROPERTY_TYPES = {"birth_year": int}
+
+# Optional summary of the value counts of every property, kept up to date by
+# load_normalized_data once create_property_summary has created it.
+PROPERTY_SUMMARY_TABLE = "property_value_counts"
+
+
+def property_counts_query(condition="TRUE", top_n=None):
+    """
+    Return a query of (property, value, count) rows over the users matching
+    condition, with values as text.
+
+    Each table is scanned once: GROUPING SETS count all of its properties in
+    one aggregate, and the tables are combined with UNION ALL. With top_n,
+    only the top_n most common values of every property are kept (ties in
+    any order).
+    """
+    branches = []
+    for source, properties in PROPERTY_SOURCES:
+        expressions = list(properties.values())
+        grouped = [f"GROUPING({expression}) = 0" for expression in expressions]
+        prop = " ".join(
+            f"WHEN {is_grouped} THEN '{name}'"
+            for is_grouped, name in zip(grouped, properties)
+        )
+        value = " ".join(
+            f"WHEN {is_grouped} THEN ({expression})::text"
+            for is_grouped, expression in zip(grouped, expressions)
+        )
+        rank = ""
+        if top_n:
+            rank = (
+                f", ROW_NUMBER() OVER (PARTITION BY GROUPING({', '.join(expressions)})"
+                " ORDER BY COUNT(*) DESC) AS rank"
+            )
+        sets = ", ".join(f"({expression})" for expression in expressions)
+        branches.append(
+            f"""
+            SELECT CASE {prop} END AS property, CASE {value} END AS value,
+                   COUNT(*) AS count{rank}
+            FROM {source}
+            WHERE {condition}
+            GROUP BY GROUPING SETS ({sets})
+            """
+        )
+    query = " UNION ALL ".join(branches)
+    if top_n:
+        query = f"""
+            SELECT property, value, count FROM ({query}) ranked
+            WHERE rank <= {int(top_n)}
+        """
+    return query
+
+
+def has_property_summary(cursor):
+    """Return whether the property value count summary table exists."""
+    cursor.execute("SELECT to_regclass(%s);", (PROPERTY_SUMMARY_TABLE,))
+    return cursor.fetchone()[0] is not None
+
+
+def create_property_summary(conn):
+    """
+    (Re)create the property value count summary from one scan of users.
+
+    From then on load_normalized_data updates it incrementally, and
+    most_common_properties / top_property_values can read it with summary=True.
+    Missing values are counted as one value per property (a unique key with
+    NULLS NOT DISTINCT), which needs PostgreSQL 15+; older servers raise a
+    RuntimeError.
+    """
+    if conn.server_version < 150000:
+        raise RuntimeError(
+            "The property summary needs PostgreSQL 15+ (unique keys with "
+            "NULLS NOT DISTINCT)"
+        )
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DROP TABLE IF EXISTS {PROPERTY_SUMMARY_TABLE};
+            CREATE TABLE {PROPERTY_SUMMARY_TABLE} (
+                property TEXT NOT NULL,
+                value TEXT,
+                count BIGINT NOT NULL,
+                UNIQUE NULLS NOT DISTINCT (property, value)
+            );
+            CREATE INDEX {PROPERTY_SUMMARY_TABLE}_top
+                ON {PROPERTY_SUMMARY_TABLE} (property, count DESC, value);
+            INSERT INTO {PROPERTY_SUMMARY_TABLE} (property, value, count)
+            {property_counts_query()};
+            """
+        )
+    conn.commit()
+
+
+def add_property_counts(cursor, condition, params=None, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) the property values of the users
+    matching condition to / from the summary table. Values whose count drops
+    to zero are deleted. condition is repeated per table, so its parameters
+    must be named (params is a dict). Rows are upserted in (property, value)
+    order, so concurrent loads lock them in the same order.
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO {PROPERTY_SUMMARY_TABLE} AS s (property, value, count)
+        SELECT property, value, {int(sign)} * count FROM ({property_counts_query(condition)}) c
+        ORDER BY property, value
+        ON CONFLICT (property, value) DO UPDATE SET count = s.count + EXCLUDED.count;
+        """,
+        params,
+    )
+    if sign < 0:
+        cursor.execute(f"DELETE FROM {PROPERTY_SUMMARY_TABLE} WHERE count <= 0;")
+
+
+def top_property_values(conn, top_n=5, summary=False):
+    """
+    Query the top_n most common values of every property.
+
+    Parameters:
+        conn: Database connection.
+        top_n (int): Number of values per property.
+        summary (bool): Read the maintained summary table (created on first
+                        use) instead of counting all users in one statement.
+
+    Returns:
+        dict: Property -> list of (value, count) tuples, most common first.
+              Values are text, or of their PROPERTY_TYPES type; ties are
+              ordered by value with summary=True and in any order otherwise.
+    """
+    if summary:
+        with conn.cursor() as cursor:
+            exists = has_property_summary(cursor)
+        if not exists:
+            create_property_summary(conn)
+        query = f"""
+            SELECT p.property, c.value, c.count
+            FROM unnest(%s::text[]) AS p(property)
+            CROSS JOIN LATERAL (
+                SELECT value, count FROM {PROPERTY_SUMMARY_TABLE} s
+                WHERE s.property = p.property
+                ORDER BY count DESC, value
+                LIMIT %s
+            ) c;
+        """
+        params = (PROPERTIES, top_n)
+    else:
+        query = property_counts_query(top_n=top_n)
+        params = ()
+    results = {prop: [] for prop in PROPERTIES}
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        for prop, value, count in cursor.fetchall():
+            if value is not None and prop in PROPERTY_TYPES:
+                value = PROPERTY_TYPES[prop](value)
+            results[prop].append((value, count))
+    for values in results.values():
+        values.sort(key=lambda item: -item[1])
+    return results
+
+
+@timed_stage()
+def most_common_properties(conn, summary=False):
     """
     Query the database for the most common values of each relevant property.
     Returns a dictionary where each key is a property and the value is a tuple (property_value, count).
+    All properties are counted in one query (see top_property_values); values
+    are text except birth_year, an int (see PROPERTY_TYPES).
     """
-    results = {}
-    queries = {
-        "first_name": "SELECT first_name, COUNT(*) AS count FROM users GROUP BY first_name ORDER BY count DESC LIMIT 1;",
-        "last_name": "SELECT last_name, COUNT(*) AS count FROM users GROUP BY last_name ORDER BY count DESC LIMIT 1;",
-        "username": "SELECT username, COUNT(*) AS count FROM users GROUP BY username ORDER BY count DESC LIMIT 1;",
-        "gender": "SELECT gender, COUNT(*) AS count FROM users GROUP BY gender ORDER BY count DESC LIMIT 1;",
-        "birth_year": "SELECT EXTRACT(YEAR FROM date_of_birth) AS birth_year, COUNT(*) AS count FROM users GROUP BY birth_year ORDER BY count DESC LIMIT 1;",
-        "city": "SELECT city, COUNT(*) AS count FROM addresses GROUP BY city ORDER BY count DESC LIMIT 1;",
-        "state": "SELECT state, COUNT(*) AS count FROM addresses GROUP BY state ORDER BY count DESC LIMIT 1;",
-        "country": "SELECT country, COUNT(*) AS count FROM addresses GROUP BY country ORDER BY count DESC LIMIT 1;",
-        "street_name": "SELECT street_name, COUNT(*) AS count FROM addresses GROUP BY street_name ORDER BY count DESC LIMIT 1;",
-        "street_address": "SELECT street_address, COUNT(*) AS count FROM addresses GROUP BY street_address ORDER BY count DESC LIMIT 1;",
-        "zip_code": "SELECT zip_code, COUNT(*) AS count FROM addresses GROUP BY zip_code ORDER BY count DESC LIMIT 1;",
-        "employment_title": "SELECT title, COUNT(*) AS count FROM employment GROUP BY title ORDER BY count DESC LIMIT 1;",
-        "key_skill": "SELECT key_skill, COUNT(*) AS count FROM employment GROUP BY key_skill ORDER BY count DESC LIMIT 1;",
-        "subscription_plan": "SELECT plan, COUNT(*) AS count FROM subscriptions GROUP BY plan ORDER BY count DESC LIMIT 1;",
-        "subscription_status": "SELECT status, COUNT(*) AS count FROM subscriptions GROUP BY status ORDER BY count DESC LIMIT 1;",
-        "payment_method": "SELECT payment_method, COUNT(*) AS count FROM subscriptions GROUP BY payment_method ORDER BY count DESC LIMIT 1;",
-        "subscription_term": "SELECT term, COUNT(*) AS count FROM subscriptions GROUP BY term ORDER BY count DESC LIMIT 1;",
+    return {
+        prop: values[0] if values else None
+        for prop, values in top_property_values(conn, 1, summary).items()
     }
 
+
+def users_signature(conn):
+    """
+    Return a signature of the stored users: their count and a hash of the
+    uid and stored values (those of STAGED_TABLES, without the surrogate ids)
+    of every user, so it changes whenever users are added, removed or
+    updated.
+    """
+    values = ", ".join(["u.uid", *staged_columns()])
     with conn.cursor() as cursor:
-        for prop, query in queries.items():
-            cursor.execute(query)
-            results[prop] = cursor.fetchone()
-    return results
+        cursor.execute(
+            f"""
+            SELECT count(*),
+                   md5(coalesce(string_agg(md5(ROW({values})::text), ',' ORDER BY u.uid), ''))
+            FROM users u
+            LEFT JOIN addresses a ON a.id = u.address_id
+            LEFT JOIN employment e ON e.id = u.employment_id
+            LEFT JOIN subscriptions t ON t.id = u.subscription_id;
+            """
+        )
+        count, digest = cursor.fetchone()
+    return f"{count}:{digest}"
+
+
+def fetch_unscored_uids(conn):
+    """Return the uids of users not yet compared with the rest of the population."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT u.uid::text FROM users u
+            LEFT JOIN scored_users s ON s.uid = u.uid
+            WHERE s.uid IS NULL;
+        """
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def mark_users_scored(cursor, uids):
+    """Record that the given users have been compared with everyone."""
+    execute_values(
+        cursor,
+        "INSERT INTO scored_users (uid) VALUES %s ON CONFLICT DO NOTHING;",
+        [(uid,) for uid in uids],
+        template="(%s::uuid)",
+    )
+
+
+def insert_similarity_pairs(cursor, pair_df):
+    """
+    Persist similarity pairs.
+
+    Parameters:
+        cursor: Database cursor.
+        pair_df (DataFrame): Edge list as returned by results.edges_frame.
+    """
+    rows = []
+    for row in pair_df.itertuples(index=False):
+        user1, user2 = sorted((str(row.User1), str(row.User2)))
+        rows.append(
+            (
+                user1,
+                user2,
+                int(row.Personal_Points),
+                int(row.Address_Points),
+                int(row.Employment_Points),
+                int(row.Subscription_Points),
+                int(row.Field_Mask),
+                int(row.Total_Points),
+                row.Connection_Type,
+            )
+        )
+    execute_values(
+        cursor,
+        """
+        INSERT INTO similarity_pairs (user1_uid, user2_uid, personal_points, address_points,
+                                      employment_points, subscription_points, field_mask,
+                                      total_points, connection_type)
+        VALUES %s
+        ON CONFLICT (user1_uid, user2_uid) DO UPDATE SET
+            personal_points = EXCLUDED.personal_points,
+            address_points = EXCLUDED.address_points,
+            employment_points = EXCLUDED.employment_points,
+            subscription_points = EXCLUDED.subscription_points,
+            field_mask = EXCLUDED.field_mask,
+            total_points = EXCLUDED.total_points,
+            connection_type = EXCLUDED.connection_type;
+        """,
+        rows,
+    )
+
+
+def fetch_affected_uids(cursor, connection_type, uids):
+    """
+    Return the given uids together with every member of the connected
+    components (of the connection_type graph) they currently belong to.
+    """
+    cursor.execute(
+        """
+        SELECT uid::text FROM similarity_groups
+        WHERE connection_type = %s AND component_id IN (
+            SELECT component_id FROM similarity_groups
+            WHERE connection_type = %s AND uid = ANY(%s::uuid[])
+        );
+        """,
+        (connection_type, connection_type, list(uids)),
+    )
+    return set(uids) | {row[0] for row in cursor.fetchall()}
+
+
+def fetch_component_edges(cursor, connection_type, uids):
+    """Return the connection_type edges (uid pairs) touching the given users."""
+    cursor.execute(
+        """
+        SELECT user1_uid::text, user2_uid::text FROM similarity_pairs
+        WHERE connection_type = %s
+          AND (user1_uid = ANY(%s::uuid[]) OR user2_uid = ANY(%s::uuid[]));
+        """,
+        (connection_type, list(uids), list(uids)),
+    )
+    return cursor.fetchall()
+
+
+def replace_similarity_groups(cursor, connection_type, uids, components):
+    """
+    Replace the component and group membership of the given users.
+
+    Parameters:
+        cursor: Database cursor.
+        connection_type (str): "Strong" or "Weak".
+        uids (iterable): Users whose membership is recomputed.
+        components (list): One list of groups (lists of uids) per connected
+                           component; users of the component missing from every
+                           group are stored without a group.
+    """
+    cursor.execute(
+        """
+        DELETE FROM similarity_groups
+        WHERE connection_type = %s AND uid = ANY(%s::uuid[]);
+        """,
+        (connection_type, list(uids)),
+    )
+    cursor.execute(
+        """
+        SELECT COALESCE(MAX(component_id), 0), COALESCE(MAX(group_id), 0)
+        FROM similarity_groups WHERE connection_type = %s;
+        """,
+        (connection_type,),
+    )
+    component_id, group_id = cursor.fetchone()
+    rows = []
+    for members, groups in components:
+        component_id += 1
+        grouped = set()
+        for group in groups:
+            group_id += 1
+            rows.extend((connection_type, uid, component_id, group_id) for uid in group)
+            grouped.update(group)
+        rows.extend(
+            (connection_type, uid, component_id, None)
+            for uid in members
+            if uid not in grouped
+        )
+    if rows:
+        execute_values(
+            cursor,
+            """
+            INSERT INTO similarity_groups (connection_type, uid, component_id, group_id)
+            VALUES %s;
+            """,
+            rows,
+            template="(%s, %s::uuid, %s, %s)",
+        )
+
+
+def fetch_similarity_groups(conn, connection_type):
+    """
+    Return the persisted groups of a connection type, largest first.
+
+    Returns:
+        list: Sorted lists of uids, one per group.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT array_agg(uid::text ORDER BY uid::text) AS members
+            FROM similarity_groups
+            WHERE connection_type = %s AND group_id IS NOT NULL
+            GROUP BY group_id
+            ORDER BY COUNT(*) DESC, MIN(uid::text);
+            """,
+            (connection_type,),
+        )
+        return [list(row[0]) for row in cursor.fetchall()]
@@ -0,0 +1,410 @@
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from fuzzy import cutoff_ratio_pairs
+from geo import load_coordinates, location_pairs
+
+# Compared fields per result category, in the order compare_users reports them.
+CATEGORY_FIELDS = {
+    "Personal": ("first_name", "last_name", "gender", "date_of_birth"),
+    "Address": ("city", "street_name", "street_address", "zip_code", "state", "location"),
+    "Employment": ("employment_title", "key_skill"),
+    "Subscription": (
+        "subscription_plan",
+        "subscription_status",
+        "payment_method",
+        "subscription_term",
+    ),
+}
+FIELDS = tuple(field for fields in CATEGORY_FIELDS.values() for field in fields)
+CATEGORIES = tuple(CATEGORY_FIELDS)
+
+# Fields compared for equality (gender after strip/lower).
+EXACT_FIELDS = ("gender", "date_of_birth")
+
+# Fuzzy-compared fields with a small vocabulary: their fuzz.ratio is precomputed for
+# every pair of distinct values, so matching them is a table lookup.
+CATEGORICAL_FIELDS = CATEGORY_FIELDS["Subscription"]
+
+# Fuzzy-compared free-text fields.
+FUZZY_FIELDS = (
+    "first_name",
+    "last_name",
+    "city",
+    "street_name",
+    "street_address",
+    "zip_code",
+    "state",
+    "employment_title",
+    "key_skill",
+)
+
+# Fields scored after the exact and categorical ones, cheapest first. A pair stops
+# being scored as soon as its remaining points can no longer change the outcome.
+STAGED_FIELDS = (
+    "location",
+    "state",
+    "employment_title",
+    "key_skill",
+    "zip_code",
+    "city",
+    "first_name",
+    "last_name",
+    "street_name",
+    "street_address",
+)
+
+# Personal fields are labelled with the first user's value instead of the field name.
+VALUE_LABELLED_FIELDS = CATEGORY_FIELDS["Personal"]
+
+# fuzz.ratio score a field needs to earn a point (ratio / 100.0 >= 0.8).
+MATCH_SCORE = 80
+
+# Total points needed for a Strong / Weak connection.
+STRONG_THRESHOLD = 5
+WEAK_THRESHOLD = 2
+
+
+def connection_type(total_points, strong_threshold=STRONG_THRESHOLD):
+    """Classify a pair by its total points ("Strong", "Weak" or None)."""
+    if total_points >= strong_threshold:
+        return "Strong"
+    if total_points >= WEAK_THRESHOLD:
+        return "Weak"
+    return None
+
+
+def normalize_field(users_df, field):
+    """
+    Return the values of a field exactly as the comparators see them.
+
+    Parameters:
+        users_df (DataFrame): Users as returned by fetch_users.
+        field (str): Column name.
+
+    Returns:
+        list: One string per user.
+    """
+    values = [str(value) for value in users_df[field].tolist()]
+    if field == "gender":
+        values = [value.strip().lower() for value in values]
+    return values
+
+
+def encode_field(values):
+    """
+    Dictionary-encode a list of strings.
+
+    Returns:
+        tuple: (codes, vocab) with int32 codes indexing into the vocab list.
+    """
+    codes, vocab = pd.factorize(pd.Series(values, dtype=object))
+    return codes.astype(np.int32), list(vocab)
+
+
+def ratio_table(vocab):
+    """Return the uint8 matrix of fuzz.ratio scores between all vocabulary values."""
+    size = len(vocab)
+    table = np.empty((size, size), dtype=np.uint8)
+    for a in range(size):
+        table[a, a] = 100
+        for b in range(a + 1, size):
+            table[a, b] = table[b, a] = fuzz.ratio(vocab[a], vocab[b])
+    return table
+
+
+def encode_users(users_df):
+    """
+    Build the columnar feature table used by the comparison engine.
+
+    Every field is normalized once: strings are dictionary-encoded into int32
+    code arrays with their vocabularies, categorical fields get a precomputed
+    vocabulary ratio table, and coordinates are resolved into the sorted codes
+    (i * n + j) of all pairs within the location radius.
+
+    Parameters:
+        users_df (DataFrame): Users as returned by fetch_users.
+
+    Returns:
+        dict: Feature name -> array (or vocabulary list).
+    """
+    features = {
+        "size": len(users_df),
+        "uid": np.array(users_df["uid"].tolist(), dtype=object),
+    }
+    for field in FIELDS:
+        if field == "location":
+            continue
+        codes, vocab = encode_field(normalize_field(users_df, field))
+        features[field] = codes
+        features[f"{field}_vocab"] = vocab
+        if field in CATEGORICAL_FIELDS:
+            features[f"{field}_ratio"] = ratio_table(vocab)
+        if field == "gender":
+            # Reported with the original spelling, compared normalized.
+            labels, label_vocab = encode_field([str(value) for value in users_df[field]])
+            features["gender_label"] = labels
+            features["gender_label_vocab"] = label_vocab
+
+    lat, lng, valid = load_coordinates(users_df)
+    features["latitude"] = lat
+    features["longitude"] = lng
+    features["coordinates_valid"] = valid
+    features["location_pairs"] = location_pairs(lat, lng, valid)
+    return features
+
+
+def exact_scores_block(features, field, rows, cols):
+    """
+    Broadcast-compare a block of users on an exact or categorical field.
+
+    Parameters:
+        features (dict): Output of encode_users.
+        field (str): One of EXACT_FIELDS or CATEGORICAL_FIELDS.
+        rows, cols (ndarray): User indices of the block.
+
+    Returns:
+        ndarray: uint8 scores of shape (len(rows), len(cols)).
+    """
+    codes = features[field]
+    left = codes[rows][:, None]
+    right = codes[cols][None, :]
+    if field in CATEGORICAL_FIELDS:
+        return features[f"{field}_ratio"][left, right]
+    return np.where(left == right, 100, 0).astype(np.uint8)
+
+
+def fuzzy_scores(features, field, left, right):
+    """
+    Thresholded fuzz.ratio scores of a fuzzy field for aligned pair arrays.
+
+    Each distinct pair of values is scored once, no matter how many user pairs
+    share it, with the cutoff-aware kernel: scores reaching MATCH_SCORE equal
+    fuzz.ratio, lower ones are 0.
+    """
+    codes = features[field]
+    vocab = features[f"{field}_vocab"]
+    code_left = codes[left].astype(np.int64)
+    code_right = codes[right].astype(np.int64)
+    value_pairs, inverse = np.unique(
+        code_left * len(vocab) + code_right, return_inverse=True
+    )
+    scores = cutoff_ratio_pairs(
+        vocab, value_pairs // len(vocab), value_pairs % len(vocab), MATCH_SCORE
+    )
+    return scores[inverse.reshape(-1)]
+
+
+def location_scores(features, left, right):
+    """Return 100 for pairs within the location radius and 0 otherwise."""
+    near = features["location_pairs"]
+    codes = left.astype(np.int64) * features["size"] + right
+    pos = np.minimum(np.searchsorted(near, codes), max(len(near) - 1, 0))
+    hit = near[pos] == codes if len(near) else np.zeros(len(codes), dtype=bool)
+    return np.where(hit, 100, 0).astype(np.uint8)
+
+
+def score_staged(features, left, right, scores, classify_only=False, counters=None):
+    """
+    Score STAGED_FIELDS on top of the exact and categorical scores already in
+    scores, skipping work that cannot change the outcome of a pair.
+
+    Before each field the pair's bound (points so far plus fields left) is
+    checked: a pair that can no longer reach WEAK_THRESHOLD is pruned. With
+    classify_only, a pair is also settled once it reaches STRONG_THRESHOLD or
+    once it is Weak and cannot become Strong; its scores then only give the
+    right connection_type, not the full points.
+
+    Parameters:
+        features (dict): Output of encode_users.
+        left, right (ndarray): Aligned user indices.
+        scores (ndarray): Score matrix with the exact/categorical columns filled
+                          in; updated in place.
+        classify_only (bool): Stop as soon as the connection type is known.
+        counters (Counter): Optional per-stage counters, updated in place.
+
+    Returns:
+        ndarray: The score matrix (skipped fields score 0).
+    """
+    counters = Counter() if counters is None else counters
+    points = (scores >= MATCH_SCORE).sum(axis=1)
+    stopped = np.zeros(len(left), dtype=bool)
+    counters["pairs"] += len(left)
+    for step, field in enumerate(STAGED_FIELDS):
+        remaining = len(STAGED_FIELDS) - step
+        active = points + remaining >= WEAK_THRESHOLD
+        if classify_only:
+            active &= points < STRONG_THRESHOLD
+            active &= (points < WEAK_THRESHOLD) | (points + remaining >= STRONG_THRESHOLD)
+        stopped |= ~active
+        index = np.flatnonzero(active)
+        counters[f"evaluated:{field}"] += len(index)
+        counters[f"skipped:{field}"] += len(left) - len(index)
+        if len(index) == 0:
+            continue
+        if field == "location":
+            field_scores = location_scores(features, left[index], right[index])
+        else:
+            field_scores = fuzzy_scores(features, field, left[index], right[index])
+        scores[index, FIELDS.index(field)] = field_scores
+        points[index] += field_scores >= MATCH_SCORE
+    counters["pruned"] += int((stopped & (points < WEAK_THRESHOLD)).sum())
+    counters["settled"] += int((stopped & (points >= WEAK_THRESHOLD)).sum())
+    return scores
+
+
+def score_pairs(features, left, right, classify_only=False, counters=None):
+    """
+    Score aligned pair arrays on every compared field.
+
+    Exact and categorical fields are scored for all pairs, the rest through
+    score_staged.
+
+    Returns:
+        ndarray: uint8 matrix of shape (len(left), len(FIELDS)) with fuzz.ratio-like
+                 scores (100 / 0 for exact fields and location; fuzzy scores
+                 below MATCH_SCORE are 0).
+    """
+    scores = np.zeros((len(left), len(FIELDS)), dtype=np.uint8)
+    for field in EXACT_FIELDS + CATEGORICAL_FIELDS:
+        codes = features[field]
+        k = FIELDS.index(field)
+        if field in CATEGORICAL_FIELDS:
+            scores[:, k] = features[f"{field}_ratio"][codes[left], codes[right]]
+        else:
+            scores[:, k] = np.where(codes[left] == codes[right], 100, 0)
+    return score_staged(features, left, right, scores, classify_only, counters)
+
+
+def score_block(features, rows, cols, classify_only=False, counters=None):
+    """
+    Score every pair (i, j) with i < j of a block of users.
+
+    Exact and categorical fields are compared by broadcasting over the whole
+    block; fuzzy fields and location go through score_staged on the
+    upper-triangle pairs.
+
+    Returns:
+        tuple: (left, right, scores) as in score_pairs.
+    """
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    upper = rows[:, None] < cols[None, :]
+    left = np.broadcast_to(rows[:, None], upper.shape)[upper]
+    right = np.broadcast_to(cols[None, :], upper.shape)[upper]
+    scores = np.zeros((len(left), len(FIELDS)), dtype=np.uint8)
+    for field in EXACT_FIELDS + CATEGORICAL_FIELDS:
+        block = exact_scores_block(features, field, rows, cols)
+        scores[:, FIELDS.index(field)] = block[upper]
+    scores = score_staged(features, left, right, scores, classify_only, counters)
+    return left, right, scores
+
+
+def format_counters(counters):
+    """
+    Render the staged-evaluation counters as a short report.
+
+    Returns:
+        str: One summary line and one line per staged field.
+    """
+    lines = [
+        f"Staged evaluation: {counters['pairs']} pairs, {counters['emitted']} reported, "
+        f"{counters['pruned']} pruned below Weak, {counters['settled']} settled early"
+    ]
+    for field in STAGED_FIELDS:
+        evaluated = counters[f"evaluated:{field}"]
+        skipped = counters[f"skipped:{field}"]
+        lines.append(f"  {field}: {evaluated} evaluated, {skipped} skipped")
+    return "\n".join(lines)
+
+
+def field_score(features, field, i, j):
+    """Return the fuzz.ratio-like score (0-100) of a single field for users i and j."""
+    if field == "location":
+        return int(location_scores(features, np.array([i]), np.array([j]))[0])
+    codes = features[field]
+    if field in CATEGORICAL_FIELDS:
+        return int(features[f"{field}_ratio"][codes[i], codes[j]])
+    if field in EXACT_FIELDS:
+        return 100 if codes[i] == codes[j] else 0
+    vocab = features[f"{field}_vocab"]
+    return fuzz.ratio(vocab[codes[i]], vocab[codes[j]])
+
+
+def field_label(features, field, i):
+    """Return the label compare_users reports for a matched field of user i."""
+    if field == "gender":
+        return features["gender_label_vocab"][features["gender_label"][i]]
+    if field in VALUE_LABELLED_FIELDS:
+        return features[f"{field}_vocab"][features[field][i]]
+    return field
+
+
+def pack_strings(values):
+    """
+    Pack a list of strings into a uint8 UTF-8 buffer and int64 character offsets.
+
+    Returns:
+        tuple: (data, offsets) with offsets of length len(values) + 1.
+    """
+    values = [str(value) for value in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    data = np.frombuffer("".join(values).encode("utf-8"), dtype=np.uint8)
+    return data, offsets
+
+
+def unpack_strings(data, offsets):
+    """Inverse of pack_strings."""
+    text = data.tobytes().decode("utf-8")
+    return [text[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def save_features(features, directory):
+    """
+    Write a feature table to a directory as memory-mappable .npy files.
+
+    Numeric arrays are saved as-is; string arrays and vocabularies are packed
+    with pack_strings; scalars are kept in the returned manifest.
+
+    Parameters:
+        features (dict): Output of encode_users (extra arrays are allowed).
+        directory (str): Existing directory to write into.
+
+    Returns:
+        dict: Manifest to pass to load_features.
+    """
+    manifest = {"arrays": [], "strings": [], "values": {}}
+    for name, value in features.items():
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(os.path.join(directory, f"{name}.npy"), value)
+            manifest["arrays"].append(name)
+        elif isinstance(value, (list, np.ndarray)):
+            data, offsets = pack_strings(value)
+            np.save(os.path.join(directory, f"{name}.data.npy"), data)
+            np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+            manifest["strings"].append(name)
+        else:
+            manifest["values"][name] = value
+    return manifest
+
+
+def load_features(directory, manifest):
+    """
+    Open a feature table written by save_features.
+
+    Numeric arrays are memory-mapped read-only, so every process reading the
+    table shares the same pages instead of holding its own copy.
+    """
+    features = dict(manifest["values"])
+    for name in manifest["arrays"]:
+        features[name] = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+    for name in manifest["strings"]:
+        data = np.load(os.path.join(directory, f"{name}.data.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"))
+        features[name] = unpack_strings(data, offsets)
+    return features
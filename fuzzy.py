@@ -0,0 +1,187 @@
+import math
+
+import Levenshtein
+import numpy as np
+
+# Width of the hashed q-gram count profiles used by the batch filters. Hash
+# collisions only ever raise the shared-count bound, so the filters stay exact.
+QGRAM_BUCKETS = 64
+
+# Slack for floating point error when turning a cutoff into a minimum ratio.
+RATIO_EPSILON = 1e-9
+
+
+def min_common(total_length, cutoff):
+    """
+    Smallest longest common subsequence two strings need to reach a cutoff.
+
+    fuzz.ratio is round(100 * 2 * LCS / (len1 + len2)), so a score of at least
+    cutoff requires 100 * 2 * LCS / total_length >= cutoff - 0.5.
+
+    Parameters:
+        total_length (int | ndarray): len1 + len2.
+        cutoff (int): Minimum fuzz.ratio score.
+
+    Returns:
+        int | ndarray: Required number of common characters.
+    """
+    return np.ceil((cutoff - 0.5) * np.asarray(total_length) / 200 - RATIO_EPSILON)
+
+
+def exact_ratio(s1, s2, cutoff):
+    """fuzz.ratio of two different non-empty strings when it reaches cutoff, else 0."""
+    similarity = Levenshtein.ratio(
+        s1, s2, score_cutoff=max((cutoff - 0.5) / 100 - RATIO_EPSILON, 0)
+    )
+    score = int(round(100 * similarity))
+    return score if score >= cutoff else 0
+
+
+def cutoff_ratio(s1, s2, cutoff):
+    """
+    Thresholded fuzz.ratio.
+
+    Returns exactly fuzz.ratio(s1, s2) when it is at least cutoff, and 0
+    otherwise. Pairs whose length difference alone keeps them below the cutoff
+    are rejected without comparing characters; the rest use the cutoff-aware
+    Levenshtein ratio, which stops as soon as the cutoff is out of reach.
+
+    Parameters:
+        s1, s2 (str): Values to compare.
+        cutoff (int): Minimum fuzz.ratio score (0-100).
+
+    Returns:
+        int: Score in 0-100.
+    """
+    if s1 is None or s2 is None:
+        return 0
+    if s1 == s2:
+        return 100
+    if not (isinstance(s1, str) and isinstance(s2, str)):
+        s1, s2 = str(s1), str(s2)
+    if not s1 or not s2:
+        return 0
+    total = len(s1) + len(s2)
+    if min(len(s1), len(s2)) < math.ceil((cutoff - 0.5) * total / 200 - RATIO_EPSILON):
+        return 0
+    return exact_ratio(s1, s2, cutoff)
+
+
+def qgram_profile(values, q):
+    """
+    Count the q-grams of every value into QGRAM_BUCKETS hashed buckets.
+
+    Parameters:
+        values (list): Strings.
+        q (int): Gram length (1 counts characters).
+
+    Returns:
+        ndarray: int32 matrix of shape (len(values), QGRAM_BUCKETS).
+    """
+    profile = np.zeros((len(values), QGRAM_BUCKETS), dtype=np.int32)
+    lengths = np.array([len(value) for value in values], dtype=np.int64)
+    chars = np.frombuffer("".join(values).encode("utf-32-le"), dtype=np.uint32)
+    if len(chars) == 0:
+        return profile
+    owner = np.repeat(np.arange(len(values)), lengths)
+    position = np.arange(len(chars)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    padded = np.concatenate([chars, np.zeros(q, dtype=np.uint32)]).astype(np.int64)
+    hashed = np.zeros(len(chars), dtype=np.int64)
+    for k in range(q):
+        hashed = hashed * 31 + padded[k : k + len(chars)]
+    valid = position <= lengths[owner] - q
+    np.add.at(profile, (owner[valid], hashed[valid] % QGRAM_BUCKETS), 1)
+    return profile
+
+
+def vocab_profiles(vocab):
+    """Return the (lengths, character profile, bigram profile) of a vocabulary."""
+    lengths = np.array([len(value) for value in vocab], dtype=np.int64)
+    return lengths, qgram_profile(vocab, 1), qgram_profile(vocab, 2)
+
+
+def candidate_mask(profiles, left, right, cutoff):
+    """
+    Vectorized filters over code pairs into a vocabulary.
+
+    A pair survives when it passes the length filter, the character-count
+    filter (shared characters bound the LCS) and the bigram filter (within
+    indel distance d, strings share at least max(len1, len2) - 1 - 2 * d
+    bigrams). Pairs that fail any filter cannot reach cutoff.
+
+    Returns:
+        ndarray: Boolean mask of the pairs that still need an exact check.
+    """
+    lengths, chars, bigrams = profiles
+    len_left = lengths[left]
+    len_right = lengths[right]
+    total = len_left + len_right
+    need = min_common(total, cutoff)
+    keep = np.minimum(len_left, len_right) >= need
+    index = np.flatnonzero(keep)
+    shared = np.minimum(chars[left[index]], chars[right[index]]).sum(axis=1)
+    keep[index] = shared >= need[index]
+    index = np.flatnonzero(keep)
+    distance = total[index] - 2 * need[index]
+    bound = np.maximum(len_left[index], len_right[index]) - 1 - 2 * distance
+    shared = np.minimum(bigrams[left[index]], bigrams[right[index]]).sum(axis=1)
+    keep[index] = shared >= bound
+    return keep
+
+
+def cutoff_ratio_pairs(vocab, left, right, cutoff):
+    """
+    Batch thresholded fuzz.ratio over pairs of vocabulary codes.
+
+    Equal codes score 100 and empty values 0; the other pairs go through the
+    vectorized filters of candidate_mask, computed on profiles of the values
+    the batch uses, and only the survivors are compared exactly.
+
+    Parameters:
+        vocab (list): Distinct strings.
+        left, right (ndarray): Aligned codes into vocab.
+        cutoff (int): Minimum fuzz.ratio score.
+
+    Returns:
+        ndarray: uint8 scores, equal to fuzz.ratio where it reaches cutoff and 0
+                 elsewhere.
+    """
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    scores = np.zeros(len(left), dtype=np.uint8)
+    if len(left) == 0:
+        return scores
+    used, inverse = np.unique(np.concatenate([left, right]), return_inverse=True)
+    profiles = vocab_profiles([vocab[code] for code in used.tolist()])
+    local_left = inverse[: len(left)]
+    local_right = inverse[len(left) :]
+    equal = left == right
+    scores[equal] = 100
+    nonempty = profiles[0] > 0
+    check = ~equal & nonempty[local_left] & nonempty[local_right]
+    index = np.flatnonzero(check)
+    index = index[candidate_mask(profiles, local_left[index], local_right[index], cutoff)]
+    scores[index] = [
+        exact_ratio(vocab[a], vocab[b], cutoff)
+        for a, b in zip(left[index].tolist(), right[index].tolist())
+    ]
+    return scores
+
+
+def cutoff_ratio_many(value, candidates, cutoff):
+    """
+    Batch thresholded fuzz.ratio of one value against an array of candidates.
+
+    Returns:
+        ndarray: uint8 scores, one per candidate (see cutoff_ratio_pairs).
+    """
+    vocab = [str(value)] + [str(candidate) for candidate in candidates]
+    codes = np.arange(1, len(vocab))
+    scores = cutoff_ratio_pairs(
+        vocab, np.zeros(len(codes), dtype=np.int64), codes, cutoff
+    )
+    equal = np.array([candidate == vocab[0] for candidate in vocab[1:]], dtype=bool)
+    scores[equal] = 100
+    missing = np.array([candidate is None for candidate in candidates], dtype=bool)
+    scores[missing | (value is None)] = 0
+    return scores
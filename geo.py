@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+from geopy.distance import geodesic
+
+from util import join_indices, unique_codes
+
+# Users closer than this share a location in compare_address.
+LOCATION_RADIUS_KM = 10
+
+# IUGG mean earth radius used by haversine_km.
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid, the model geopy's geodesic uses.
+WGS84_A = 6378.137
+WGS84_E2 = 6.69437999014e-3
+
+# Accuracy bound of haversine_km against geodesic(...).km: for distances of a few
+# tens of km the ratio geodesic / haversine stays within [0.9944, 1.0045], i.e. the
+# mean radius against the smallest (meridional, equator) and largest (polar) radius
+# of curvature of the ellipsoid; 20k random pairs up to 12 km measured
+# [0.99442, 1.00449]. Only distances inside this band around the radius are
+# re-checked with geodesic, so location matches are identical to the geodesic test.
+HAVERSINE_RATIO_BOUNDS = (0.994, 1.005)
+
+
+def parse_coordinates(users_df):
+    """
+    Convert latitude/longitude columns to float arrays.
+
+    Parameters:
+        users_df (DataFrame): Users with latitude and longitude columns.
+
+    Returns:
+        tuple: (lat, lng, valid) where valid marks users with usable coordinates.
+    """
+    lat = pd.to_numeric(users_df["latitude"], errors="coerce").to_numpy(dtype=float)
+    lng = pd.to_numeric(users_df["longitude"], errors="coerce").to_numpy(dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lng) & (np.abs(lat) <= 90)
+    return lat, lng, valid
+
+
+def load_coordinates(users_df):
+    """
+    Load coordinates once for the whole population and report unusable ones.
+
+    Every user whose latitude/longitude cannot be used for a distance check is
+    flagged a single time here instead of once per compared pair.
+
+    Parameters:
+        users_df (DataFrame): Users with uid, latitude and longitude columns.
+
+    Returns:
+        tuple: (lat, lng, valid) float and boolean arrays.
+    """
+    lat, lng, valid = parse_coordinates(users_df)
+    uids = users_df["uid"].tolist() if "uid" in users_df else users_df.index.tolist()
+    raw_lat = users_df["latitude"].tolist()
+    raw_lng = users_df["longitude"].tolist()
+    for i in np.flatnonzero(~valid):
+        print(f"Invalid coordinates for user {uids[i]}: ({raw_lat[i]}, {raw_lng[i]})")
+    return lat, lng, valid
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Vectorized great-circle distance in km on a sphere of EARTH_RADIUS_KM."""
+    phi1, lam1, phi2, lam2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    h = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def within_radius(lat1, lng1, lat2, lng2, radius_km=LOCATION_RADIUS_KM):
+    """
+    Vectorized equivalent of geodesic(coord1, coord2).km < radius_km.
+
+    Haversine settles every pair outside the HAVERSINE_RATIO_BOUNDS band around the
+    radius; the few pairs inside it are resolved with geodesic.
+
+    Returns:
+        ndarray: Boolean array, one entry per coordinate pair.
+    """
+    lat1, lng1, lat2, lng2 = map(np.atleast_1d, (lat1, lng1, lat2, lng2))
+    distance = haversine_km(lat1, lng1, lat2, lng2)
+    low, high = HAVERSINE_RATIO_BOUNDS
+    near = distance * high < radius_km
+    borderline = np.flatnonzero(~near & (distance * low < radius_km))
+    for k in borderline:
+        near[k] = geodesic((lat1[k], lng1[k]), (lat2[k], lng2[k])).km < radius_km
+    return near
+
+
+def within_distance(coord1, coord2, radius_km=LOCATION_RADIUS_KM):
+    """
+    Check a single pair of (latitude, longitude) tuples.
+
+    Unusable coordinates never match; they are reported by load_coordinates.
+    """
+    try:
+        lat1, lng1 = float(coord1[0]), float(coord1[1])
+        lat2, lng2 = float(coord2[0]), float(coord2[1])
+    except (TypeError, ValueError):
+        return False
+    lat = np.array([lat1, lat2])
+    lng = np.array([lng1, lng2])
+    if not (np.isfinite(lat).all() and np.isfinite(lng).all() and (abs(lat) <= 90).all()):
+        return False
+    return bool(within_radius(lat1, lng1, lat2, lng2, radius_km)[0])
+
+
+def ecef_km(lat, lng):
+    """Convert WGS-84 geodetic coordinates (degrees) to earth-centered x/y/z in km."""
+    phi = np.radians(lat)
+    lam = np.radians(lng)
+    sin_phi = np.sin(phi)
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_phi**2)
+    x = n * np.cos(phi) * np.cos(lam)
+    y = n * np.cos(phi) * np.sin(lam)
+    z = n * (1 - WGS84_E2) * sin_phi
+    return np.column_stack([x, y, z])
+
+
+def encode_cells(cells):
+    """Pack integer (x, y, z) grid cells into single int64 keys."""
+    shifted = cells.astype(np.int64) + (1 << 20)
+    return (shifted[:, 0] << 42) | (shifted[:, 1] << 21) | shifted[:, 2]
+
+
+def grid_keys(lat, lng, valid, cell_km=LOCATION_RADIUS_KM):
+    """
+    Place users on a 3D grid of cell_km cells over earth-centered coordinates.
+
+    The straight-line distance between two points never exceeds their geodesic
+    distance, so users closer than cell_km always sit in neighbouring cells. Each
+    user indexes its own cell and probes all 27 neighbours; users with invalid
+    coordinates get no keys.
+
+    Returns:
+        tuple: ((users, keys), (users, keys)) for the index and probe sides.
+    """
+    users = np.flatnonzero(valid).astype(np.int64)
+    cells = np.floor(ecef_km(lat[users], lng[users]) / cell_km).astype(np.int64)
+
+    offsets = np.array(
+        [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)],
+        dtype=np.int64,
+    )
+    probe_cells = (cells[:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+    probe_users = np.repeat(users, len(offsets))
+    return (users, encode_cells(cells)), (probe_users, encode_cells(probe_cells))
+
+
+def location_pairs(lat, lng, valid, radius_km=LOCATION_RADIUS_KM):
+    """
+    Find every pair of users closer than radius_km in bulk.
+
+    Parameters:
+        lat, lng (ndarray): Coordinates in degrees, one entry per user.
+        valid (ndarray): Boolean mask of usable coordinates.
+        radius_km (float): Distance threshold.
+
+    Returns:
+        ndarray: Sorted pair codes i * n + j with i < j.
+    """
+    n = len(lat)
+    (index_users, index_keys), (probe_users, probe_keys) = grid_keys(
+        lat, lng, valid, radius_km
+    )
+    ia, ib = join_indices(index_keys, probe_keys)
+    left, right = index_users[ia], probe_users[ib]
+    keep = left < right
+    left, right = left[keep], right[keep]
+    near = within_radius(lat[left], lng[left], lat[right], lng[right], radius_km)
+    return unique_codes(left[near] * n + right[near])
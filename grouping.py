@@ -0,0 +1,195 @@
+from multiprocessing import Pool, cpu_count
+
+import networkx as nx
+import networkx.algorithms.community as nx_comm
+import numpy as np
+import pandas as pd
+
+GROUPING_MODES = ("components", "communities")
+
+CONNECTION_TYPES = ("Strong", "Weak")
+
+# Components with at most this many users are always a single community, so
+# they never reach a worker.
+TRIVIAL_COMPONENT_SIZE = 2
+
+
+def encode_edges(user1, user2):
+    """
+    Map the uids of an edge list to dense node ids.
+
+    Returns:
+        tuple: (nodes, left, right) with nodes the uid of every node id and
+               left/right int64 node ids per edge.
+    """
+    codes, nodes = pd.factorize(
+        pd.Series(list(user1) + list(user2), dtype=object), sort=True
+    )
+    codes = codes.astype(np.int64)
+    return np.asarray(nodes, dtype=object), codes[: len(user1)], codes[len(user1) :]
+
+
+def connected_components(num_nodes, left, right):
+    """
+    Label the connected components of a sparse edge list.
+
+    Vectorized union-find: every round hooks the larger root of each edge onto
+    the smaller one, then compresses paths until every node points at its root.
+
+    Returns:
+        ndarray: Component label (its smallest node id) of every node.
+    """
+    parent = np.arange(num_nodes, dtype=np.int64)
+    while True:
+        root_left = parent[left]
+        root_right = parent[right]
+        split = root_left != root_right
+        if not split.any():
+            return parent
+        np.minimum.at(
+            parent,
+            np.maximum(root_left[split], root_right[split]),
+            np.minimum(root_left[split], root_right[split]),
+        )
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+
+def split_components(nodes, left, right):
+    """
+    Split an encoded edge list into its connected components.
+
+    Returns:
+        list: (members, user1, user2) per component with sorted member uids and
+              the uid arrays of its edges.
+    """
+    if len(left) == 0:
+        return []
+    labels = connected_components(len(nodes), left, right)
+    edge_labels = labels[left]
+    order = np.argsort(edge_labels, kind="stable")
+    edge_bounds = np.flatnonzero(np.diff(edge_labels[order])) + 1
+    component_labels = edge_labels[order][np.concatenate([[0], edge_bounds])]
+    # Nodes without an edge of this edge list keep singleton labels and are skipped.
+    node_order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[node_order]
+    starts = np.searchsorted(sorted_labels, component_labels, side="left")
+    stops = np.searchsorted(sorted_labels, component_labels, side="right")
+    components = []
+    for edges, start, stop in zip(np.split(order, edge_bounds), starts, stops):
+        members = node_order[start:stop]
+        components.append(
+            (sorted(nodes[members].tolist()), nodes[left[edges]], nodes[right[edges]])
+        )
+    return components
+
+
+def component_communities(component):
+    """Run greedy modularity community detection on one component."""
+    members, user1, user2 = component
+    if len(members) <= TRIVIAL_COMPONENT_SIZE:
+        return [members]
+    G = nx.Graph()
+    G.add_edges_from(zip(user1.tolist(), user2.tolist()))
+    communities = nx_comm.greedy_modularity_communities(G)
+    return [sorted(list(comm)) for comm in communities if len(comm) > 1]
+
+
+def detect_groups(components, mode="communities", workers=None):
+    """
+    Find the groups of every component.
+
+    Parameters:
+        components (list): Output of split_components.
+        mode (str): "components" (each connected component is a group) or
+                    "communities" (greedy modularity communities, computed per
+                    component in parallel).
+        workers (int): Worker processes for "communities" (defaults to cpu_count()).
+
+    Returns:
+        list: The groups (sorted uid lists) of each component, in input order.
+    """
+    if mode == "components":
+        return [[members] for members, _, _ in components]
+    if mode != "communities":
+        raise ValueError(
+            f"Unknown grouping mode {mode!r}, expected one of {GROUPING_MODES}"
+        )
+
+    results = [None] * len(components)
+    large = []
+    for k, component in enumerate(components):
+        if len(component[0]) <= TRIVIAL_COMPONENT_SIZE:
+            results[k] = component_communities(component)
+        else:
+            large.append(k)
+    # Largest components first, so the longest tasks start early.
+    large.sort(key=lambda k: -len(components[k][1]))
+    workers = min(workers or cpu_count(), len(large))
+    if workers > 1:
+        with Pool(workers) as pool:
+            found = pool.map(component_communities, [components[k] for k in large])
+    else:
+        found = [component_communities(components[k]) for k in large]
+    for k, groups in zip(large, found):
+        results[k] = groups
+    return results
+
+
+def order_groups(groups):
+    """Sort groups largest first, ties by their first uid."""
+    return sorted(groups, key=lambda group: (-len(group), group[0]))
+
+
+def group_pairs(pair_df, mode="communities", workers=None):
+    """
+    Build the Strong and Weak groups of an edge list in one pass.
+
+    The uids of all edges are encoded once; the edges of each connection type
+    are split into connected components and the components of both types are
+    grouped together (in one Pool for "communities").
+
+    Parameters:
+        pair_df (DataFrame): Edge list with User1, User2 and Connection_Type.
+        mode (str): See detect_groups.
+        workers (int): Worker processes for "communities".
+
+    Returns:
+        dict: Connection type -> groups (sorted uid lists), largest first.
+    """
+    nodes, left, right = encode_edges(pair_df["User1"], pair_df["User2"])
+    kinds = pair_df["Connection_Type"].to_numpy()
+    components = []
+    owners = []
+    for kind in CONNECTION_TYPES:
+        selected = kinds == kind
+        found = split_components(nodes, left[selected], right[selected])
+        components.extend(found)
+        owners.extend([kind] * len(found))
+    groups = {kind: [] for kind in CONNECTION_TYPES}
+    for kind, component_groups in zip(owners, detect_groups(components, mode, workers)):
+        groups[kind].extend(component_groups)
+    return {kind: order_groups(found) for kind, found in groups.items()}
+
+
+def group_edges(edges, mode="communities", workers=None):
+    """
+    Group a single edge list component by component.
+
+    Parameters:
+        edges (list): (uid, uid) tuples.
+
+    Returns:
+        list: (members, groups) per connected component.
+    """
+    user1 = [edge[0] for edge in edges]
+    user2 = [edge[1] for edge in edges]
+    components = split_components(*encode_edges(user1, user2))
+    found = detect_groups(components, mode, workers)
+    return [
+        (members, order_groups(groups))
+        for (members, _, _), groups in zip(components, found)
+    ]
@@ -1,62 +1,430 @@
-import psycopg2
+import argparse
 
 import settings
-from data_collection import fetch_random_users, save_users_to_csv
+from checkpoints import (
+    code_version,
+    fingerprint,
+    open_checkpoints,
+    run_stage,
+    stage_digest,
+)
+from data_collection import (
+    fetch_random_users_concurrent,
+    fetch_random_users_stored,
+    normalize_users,
+    save_users_to_csv,
+    save_users_to_csv_async,
+)
 from database import (
+    create_indexes,
     create_tables,
-    fetch_users,
+    fetch_similarity_users,
+    fetch_trigram_candidates,
+    fetch_unscored_uids,
     load_normalized_data,
+    load_normalized_data_parallel,
     most_common_properties,
+    similarity_frame,
+    users_signature,
+)
+from features import MATCH_SCORE, STRONG_THRESHOLD, WEAK_THRESHOLD
+from metrics import PROFILE_MODES, enable_profiling, write_metrics
+from pipeline import run_pipeline
+from pool import close_pool, get_pool, pooled_connection
+from response_store import open_store
+from user_similarity import (
+    find_similar_users,
+    load_groups,
+    update_similar_users,
+)
+from util import (
+    OUTPUT_FORMATS,
+    get_dataset_filepath,
+    get_png_filepath,
+    read_dataset,
+)
+from visualization import (
+    close_renderer,
+    visualize_common_properties_async,
+    visualize_groups_async,
+)
+
+# Stages of main() in order (see checkpoints.run_stage).
+STAGES = ("collect", "load", "properties", "similarity", "visualize")
+
+# Modules whose code the similarity stage runs.
+SIMILARITY_MODULES = (
+    "user_similarity",
+    "blocking",
+    "features",
+    "fuzzy",
+    "geo",
+    "grouping",
+    "results",
+)
+
+VISUALIZATION_FILES = (
+    "group_count.png",
+    "group_sizes.png",
+    "group_size_distribution.png",
+    "most_common_properties.png",
 )
-from user_similarity import find_similar_users
-from util import get_csv_filepath
-from visualization import visualize_common_properties, visualize_groups
 
 
-def main():
+def main(
+    incremental=False,
+    dimensions=False,
+    partitions=settings.LOAD_PARTITIONS,
+    trigram=False,
+    in_memory=False,
+    csv=True,
+    store=False,
+    offline=False,
+    stream=False,
+    output_format=settings.OUTPUT_FORMAT,
+    checkpoint=False,
+    rerun=(),
+    profile=None,
+    metrics_file="metrics.json",
+):
     """
     Main function to execute the following tasks:
     1. Fetch random users, save them to a CSV file, and load the data into a database.
     2. Query the database to analyze user similarities and build groups.
     3. Visualize the results.
-    """
 
-    # Part 1: Data Collection and Database Setup
-    print("Fetching random users...")
-    users = fetch_random_users(total=1000, batch_size=100)
-    save_users_to_csv(users, filename="random_users.csv")
+    With incremental=True only the users not scored by a previous run are
+    compared, and pairs and groups are updated in the database. With
+    dimensions=True employment and subscriptions are stored as deduplicated
+    dimension rows. With partitions > 1 the CSV is loaded in that many
+    partitions over pooled connections (see load_normalized_data_parallel).
+    With trigram=True the database proposes the candidate pairs through its
+    pg_trgm indexes (see fetch_trigram_candidates) instead of blocking.
+    With in_memory=True the normalized users go straight to the loader and (in
+    full runs) to the similarity analysis, which then compares the users of
+    this run instead of every stored user; the CSV is written in the
+    background, or not at all with csv=False. With store=True raw responses
+    are kept in the response store and reused by later runs (only missing
+    users are fetched); offline=True replays the store without any request.
+    With stream=True users flow batch by batch from the API (or the store)
+    through normalization and the CSV into the database (see
+    pipeline.run_pipeline), holding at most
+    settings.PIPELINE_MAX_BUFFERED_USERS of them in memory; the similarity
+    analysis then reads them back from the database. output_format picks
+    the format of the user, pair and group files: "csv", or "parquet" /
+    "arrow" (typed, compressed, read back memory-mapped). With
+    checkpoint=True every stage (see STAGES) records a fingerprint of its
+    inputs and is skipped while its persisted output is still valid, so a run
+    resumes at the first stage that failed or whose inputs changed; the
+    stages named in rerun run regardless (e.g. "collect" to fetch new users).
+    Stage timings, throughput, worker stats, database round trips and HTTP
+    retries are written to output_metrics/metrics_file (see metrics.py);
+    profile ("cprofile" or "sample") also profiles the hot functions.
+    Charts are rendered in a worker process (see visualization.render_async):
+    without checkpoints the properties chart renders during the similarity
+    analysis, the group charts while the CSV is finished.
+    """
+    if profile:
+        enable_profiling(profile)
 
-    conn = None
     try:
-        conn = psycopg2.connect(
-            dbname=settings.POSTGRES_DB,
-            user=settings.POSTGRES_USER,
-            password=settings.POSTGRES_PASSWORD,
-            host=settings.POSTGRES_HOST,
-            port=settings.POSTGRES_PORT,
-        )
+        # Part 1: Data Collection and Database Setup
+        checkpoints = open_checkpoints(enabled=checkpoint, rerun=rerun)
+        if checkpoint and in_memory and not stream and not csv:
+            print("Checkpoints resume from the users file, writing it anyway.")
+            csv = True
+        users_path = get_dataset_filepath("random_users.csv", output_format)
+        source = "offline" if offline else "store" if store else "api"
+        csv_sink = None
+        users_source = None
+        properties_chart = None
 
-        create_tables(conn)
-        users_csv_path = get_csv_filepath("random_users.csv")
-        load_normalized_data(conn, users_csv_path)
-        common_props = most_common_properties(conn)
-        print("Most Common Properties:", common_props)
-
-        # Part 2: Similarity Analysis
-        users_df = fetch_users(conn)
-    except Exception as e:
-        print(f"Database error: {e}")
-        return
-    finally:
-        if conn:
-            conn.close()
+        def collect():
+            nonlocal csv_sink
+            print("Fetching random users...")
+            if store or offline:
+                users = fetch_random_users_stored(
+                    total=1000, batch_size=100, offline=offline
+                )
+            else:
+                users = fetch_random_users_concurrent(total=1000, batch_size=100)
+            if not in_memory:
+                save_users_to_csv(users, "random_users.csv", output_format)
+                return users_path
+            users_df = normalize_users(users)
+            if csv and checkpoint:
+                # The checkpoint hashes the file, so it must be complete first.
+                save_users_to_csv(users_df, "random_users.csv", output_format)
+            elif csv:
+                csv_sink = save_users_to_csv_async(
+                    users_df, "random_users.csv", output_format
+                )
+            return users_df
+
+        if not stream:
+            users_source = run_stage(
+                checkpoints,
+                "collect",
+                {
+                    "total": 1000,
+                    "batch_size": 100,
+                    "source": source,
+                    "output_format": output_format,
+                    "code": code_version("data_collection", "response_store"),
+                },
+                collect,
+                outputs=[users_path],
+                restore=lambda: (
+                    read_dataset(users_path, dtype=str) if in_memory else users_path
+                ),
+            )
+
+        try:
+            with pooled_connection() as conn:
+                create_tables(conn)
+
+                def load():
+                    # The loaders report a failure by returning None (a partition
+                    # by counting its rows as failed); raise instead, so the stage
+                    # is not recorded as done.
+                    if stream:
+                        print("Streaming random users into the database...")
+                        counts = run_pipeline(
+                            conn,
+                            total=1000,
+                            batch_size=100,
+                            dimensions=dimensions,
+                            store=open_store() if store or offline else None,
+                            offline=offline,
+                            csv=csv,
+                            output_format=output_format,
+                        )
+                    elif partitions > 1:
+                        counts = load_normalized_data_parallel(
+                            get_pool(),
+                            users_source,
+                            partitions,
+                            # One pooled connection stays with this block.
+                            workers=min(partitions, settings.POSTGRES_POOL_MAX - 1),
+                            dimensions=dimensions,
+                        )
+                    else:
+                        counts = load_normalized_data(
+                            conn, users_source, dimensions=dimensions
+                        )
+                    if counts is None:
+                        raise RuntimeError("Loading the users failed")
+                    if counts.get("failed"):
+                        raise RuntimeError(
+                            f"Loading {counts['failed']} users failed "
+                            "(see the partition errors above)"
+                        )
+
+                if stream:
+                    load_inputs = {
+                        "total": 1000,
+                        "batch_size": 100,
+                        "source": source,
+                        "code": code_version("data_collection", "pipeline", "database"),
+                    }
+                else:
+                    load_inputs = {
+                        "users": stage_digest(checkpoints, "collect"),
+                        "code": code_version("database"),
+                    }
+                run_stage(
+                    checkpoints,
+                    "load",
+                    {**load_inputs, "dimensions": dimensions},
+                    load,
+                    validate=lambda: users_signature(conn),
+                )
 
-    pair_df, strong_groups, weak_groups = find_similar_users(users_df)
+                # Cheap once the indexes exist, and a reloaded database needs them.
+                has_trigram = create_indexes(conn, trigram=trigram)
+                common_props = run_stage(
+                    checkpoints,
+                    "properties",
+                    {
+                        "users": stage_digest(checkpoints, "load"),
+                        "code": code_version("database"),
+                    },
+                    lambda: most_common_properties(conn),
+                    keep_value=True,
+                )
+                print("Most Common Properties:", common_props)
+                if not checkpoint:
+                    # A checkpointed stage must not touch its images before it
+                    # knows whether they are up to date; see visualize().
+                    properties_chart = visualize_common_properties_async(common_props)
 
-    # Part 3: Visualization
-    visualize_groups(strong_groups, weak_groups)
-    visualize_common_properties(common_props)
+                # Part 2: Similarity Analysis
+                in_memory_users = in_memory and not stream and not incremental
+                if in_memory_users:
+                    users_df = similarity_frame(users_source)
+                else:
+                    users_df = fetch_similarity_users(conn)
+                candidates = fetch_trigram_candidates(conn) if has_trigram else None
+                if incremental:
+                    pair_df, strong_groups, weak_groups = update_similar_users(
+                        conn,
+                        users_df,
+                        fetch_unscored_uids(conn),
+                        candidates=candidates,
+                        output_format=output_format,
+                    )
+        except Exception as e:
+            print(f"Database error: {e}")
+            return
+        finally:
+            close_pool()
+
+        if not incremental:
+            strong_groups, weak_groups = run_stage(
+                checkpoints,
+                "similarity",
+                {
+                    "users": stage_digest(
+                        checkpoints, "collect" if in_memory_users else "load"
+                    ),
+                    "trigram": has_trigram,
+                    "thresholds": [MATCH_SCORE, STRONG_THRESHOLD, WEAK_THRESHOLD],
+                    "output_format": output_format,
+                    "code": code_version(*SIMILARITY_MODULES),
+                },
+                lambda: find_similar_users(
+                    users_df, candidates=candidates, output_format=output_format
+                )[1:],
+                outputs=[
+                    get_dataset_filepath(filename, output_format)
+                    for filename in (
+                        "pairwise_similarities.csv",
+                        "strong_groups.csv",
+                        "weak_groups.csv",
+                    )
+                ],
+                restore=lambda: load_groups(output_format),
+            )
+
+        # Part 3: Visualization
+        def visualize():
+            charts = [
+                visualize_groups_async(strong_groups, weak_groups),
+                properties_chart or visualize_common_properties_async(common_props),
+            ]
+            if csv_sink is not None:
+                csv_sink.result()
+            for chart in charts:
+                chart.result()
+
+        run_stage(
+            checkpoints,
+            "visualize",
+            {
+                "groups": fingerprint([strong_groups, weak_groups]),
+                "common_props": common_props,
+                "code": code_version("visualization"),
+            },
+            visualize,
+            outputs=[get_png_filepath(filename) for filename in VISUALIZATION_FILES],
+        )
+    finally:
+        # Waits for the queued charts, so their stages reach the metrics.
+        close_renderer()
+        write_metrics(metrics_file)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Random user similarity analysis.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Score only users added since the last run and update stored groups.",
+    )
+    parser.add_argument(
+        "--dimensions",
+        action="store_true",
+        help="Share one employment/subscription row per distinct value.",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=settings.LOAD_PARTITIONS,
+        help="Load the CSV in this many partitions over pooled connections.",
+    )
+    parser.add_argument(
+        "--trigram",
+        action="store_true",
+        help="Score only the candidate pairs found by pg_trgm similarity in the database.",
+    )
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        help="Load and analyse the fetched users in memory; the CSV is written in the background.",
+    )
+    parser.add_argument(
+        "--no-csv",
+        action="store_true",
+        help="With --in-memory, do not write random_users.csv.",
+    )
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help="Keep raw API responses in output_responses/ and reuse them on later runs.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Replay the users of the response store without any API request.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream users batch by batch from the API into the database with bounded memory.",
+    )
+    parser.add_argument(
+        "--output-format",
+        default=settings.OUTPUT_FORMAT,
+        choices=list(OUTPUT_FORMATS),
+        help="Format of the user, pair and group files (parquet/arrow need pyarrow).",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="Skip stages whose inputs and outputs are unchanged since the last run.",
+    )
+    parser.add_argument(
+        "--rerun",
+        nargs="+",
+        default=[],
+        choices=STAGES,
+        help="With --checkpoint, run these stages even if they are up to date.",
+    )
+    parser.add_argument(
+        "--profile",
+        default=settings.PROFILE or None,
+        choices=PROFILE_MODES,
+        help="Profile the hot functions with cProfile or stack sampling (output_metrics/).",
+    )
+    parser.add_argument(
+        "--metrics",
+        default="metrics.json",
+        help="Name of the metrics file written to output_metrics/.",
+    )
+    args = parser.parse_args()
+    main(
+        incremental=args.incremental,
+        dimensions=args.dimensions,
+        partitions=args.partitions,
+        trigram=args.trigram,
+        in_memory=args.in_memory,
+        csv=not args.no_csv,
+        store=args.store,
+        offline=args.offline,
+        stream=args.stream,
+        output_format=args.output_format,
+        checkpoint=args.checkpoint,
+        rerun=args.rerun,
+        profile=args.profile,
+        metrics_file=args.metrics,
+    )
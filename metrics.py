@@ -0,0 +1,334 @@
+import cProfile
+import functools
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from multiprocessing import cpu_count, parent_process
+
+import settings
+from util import get_output_filepath
+
+OUTPUT_METRICS_DIR = "output_metrics"
+
+# "cprofile" records every call of the profiled functions; "sample" records
+# their stacks every SAMPLE_INTERVAL seconds (folded, for flame graphs).
+PROFILE_MODES = ("cprofile", "sample")
+SAMPLE_INTERVAL = 0.005
+
+_lock = threading.Lock()
+
+
+def new_metrics():
+    """Return empty measurements (stages, counters and Pool worker stats)."""
+    return {"stages": [], "counters": Counter(), "workers": {}}
+
+
+# Measurements of this process (see write_metrics).
+_metrics = new_metrics()
+
+# Profiling mode, cProfile profiles and sampled stack counts per function,
+# functions being sampled per thread id, the sampler thread and the lock that
+# lets one cProfile run at a time.
+_profiling = {
+    "mode": settings.PROFILE or None,
+    "profiles": {},
+    "samples": {},
+    "active": {},
+    "sampler": None,
+    "busy": threading.Lock(),
+}
+
+
+def reset_metrics():
+    """Drop the measurements and profiles recorded so far."""
+    global _metrics
+    with _lock:
+        _metrics = new_metrics()
+        _profiling["profiles"] = {}
+        _profiling["samples"] = {}
+
+
+def reset_after_fork():
+    """Start a forked child (a Pool worker) without the parent's measurements."""
+    global _lock, _metrics
+    sys.setprofile(None)  # a cProfile active in the parent is inherited
+    _lock = threading.Lock()
+    _metrics = new_metrics()
+    _profiling.update(
+        profiles={}, samples={}, active={}, sampler=None, busy=threading.Lock()
+    )
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process and of its largest
+    finished child process (Pool workers), in MB.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(own, 1), round(children, 1)
+
+
+def children_cpu():
+    """Return the CPU seconds of the finished child processes."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def count(name, n=1):
+    """Add n to a counter (e.g. db_round_trips, http_429)."""
+    with _lock:
+        _metrics["counters"][name] += n
+
+
+@contextmanager
+def stage(name, items=None, unit="rows"):
+    """
+    Measure a stage: wall and CPU time (own and of finished child processes),
+    throughput and peak RSS.
+
+    Yields the stage record; set record["items"] when the number of processed
+    items is only known at the end.
+    """
+    record = {"stage": name, "items": items, "unit": unit}
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    children_start = children_cpu()
+    try:
+        yield record
+    except BaseException:
+        record["failed"] = True
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        own_rss, children_rss = peak_rss_mb()
+        record.update(
+            wall_s=round(wall, 4),
+            cpu_s=round(time.process_time() - cpu_start, 4),
+            children_cpu_s=round(children_cpu() - children_start, 4),
+            items_per_s=(
+                round(record["items"] / wall, 1)
+                if record["items"] is not None and wall > 0
+                else None
+            ),
+            peak_rss_mb=own_rss,
+            children_peak_rss_mb=children_rss,
+        )
+        with _lock:
+            _metrics["stages"].append(record)
+
+
+def take_stages():
+    """
+    Return the stage records of this process and forget them; a worker
+    process sends them to the parent, which adds them with record_stages.
+    """
+    with _lock:
+        stages = _metrics["stages"]
+        _metrics["stages"] = []
+    return stages
+
+
+def record_stages(stages):
+    """Add stage records measured in another process (see take_stages)."""
+    with _lock:
+        _metrics["stages"].extend(stages)
+
+
+def record_worker(stats):
+    """
+    Add the stats of one Pool task (pid, tasks, items, wall_s, cpu_s) to the
+    totals of its worker process.
+    """
+    with _lock:
+        worker = _metrics["workers"].setdefault(
+            str(stats["pid"]), {"tasks": 0, "items": 0, "wall_s": 0.0, "cpu_s": 0.0}
+        )
+        for key in ("tasks", "items", "wall_s", "cpu_s"):
+            worker[key] += stats[key]
+
+
+def enable_profiling(mode):
+    """Profile the hot functions (see profiled) of this process and its children."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(
+            f"Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}"
+        )
+    _profiling["mode"] = mode
+    os.environ["PROFILE"] = mode  # spawned worker processes
+
+
+def sample_stacks():
+    """Sampler thread: count the stacks of the threads in profiled functions."""
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        frames = sys._current_frames()
+        with _lock:
+            for ident, name in _profiling["active"].items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    samples = _profiling["samples"].setdefault(name, Counter())
+                    samples[";".join(reversed(stack))] += 1
+
+
+def profiled(fn):
+    """
+    Profile the calls of a hot function when profiling is enabled.
+
+    In cProfile mode the calls accumulate in one profile per function; in
+    sample mode the stacks of the calling thread are sampled while it runs the
+    function. Nested profiled calls are covered by the outer one. Pool workers
+    write their profiles after every call, other processes in write_metrics.
+    """
+    name = f"{fn.__module__}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        mode = _profiling["mode"]
+        ident = threading.get_ident()
+        if mode is None or ident in _profiling["active"]:
+            return fn(*args, **kwargs)
+        if mode == "cprofile":
+            if not _profiling["busy"].acquire(blocking=False):
+                return fn(*args, **kwargs)
+            profile = _profiling["profiles"].setdefault(name, cProfile.Profile())
+            _profiling["active"][ident] = name
+            profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                del _profiling["active"][ident]
+                _profiling["busy"].release()
+                if parent_process() is not None:
+                    dump_profiles()
+        sampler = _profiling["sampler"]
+        if sampler is None or not sampler.is_alive():
+            sampler = threading.Thread(target=sample_stacks, name="sampler", daemon=True)
+            _profiling["sampler"] = sampler
+            sampler.start()
+        with _lock:
+            _profiling["active"][ident] = name
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _lock:
+                del _profiling["active"][ident]
+            if parent_process() is not None:
+                dump_profiles()
+
+    return wrapper
+
+
+def timed_stage(name=None, items=None, unit="rows", profile=False):
+    """
+    Decorator measuring every call of a function as a stage (see stage).
+
+    Parameters:
+        name (str): Stage name (defaults to the function name).
+        items (callable): Returns the number of processed items from the
+                          result of the function.
+        unit (str): What the items are (rows, users, pairs...).
+        profile (bool): Also profile the function (see profiled).
+    """
+
+    def decorate(fn):
+        target = profiled(fn) if profile else fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name or fn.__name__, unit=unit) as record:
+                result = target(*args, **kwargs)
+                if items is not None:
+                    record["items"] = items(result)
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+def dump_profiles(directory=OUTPUT_METRICS_DIR):
+    """
+    Write the profiles of this process: profile_<function>_<pid>.prof
+    (pstats) and samples_<function>_<pid>.folded (one "stack count" line per
+    sampled stack).
+
+    Returns:
+        list: The written paths.
+    """
+    pid = os.getpid()
+    paths = []
+    for name, profile in list(_profiling["profiles"].items()):
+        path = get_output_filepath(f"profile_{name}_{pid}.prof", directory)
+        profile.dump_stats(path)
+        paths.append(path)
+    with _lock:
+        samples = {name: dict(counts) for name, counts in _profiling["samples"].items()}
+    for name, counts in samples.items():
+        path = get_output_filepath(f"samples_{name}_{pid}.folded", directory)
+        with open(path, "w") as folded:
+            for stack, hits in sorted(counts.items()):
+                folded.write(f"{stack} {hits}\n")
+        paths.append(path)
+    return paths
+
+
+def metrics_report():
+    """
+    Return the measurements of this process as a JSON-serializable dict.
+    """
+    with _lock:
+        workers = {
+            pid: {
+                **worker,
+                "wall_s": round(worker["wall_s"], 4),
+                "cpu_s": round(worker["cpu_s"], 4),
+                "items_per_s": (
+                    round(worker["items"] / worker["wall_s"], 1)
+                    if worker["wall_s"] > 0
+                    else None
+                ),
+            }
+            for pid, worker in _metrics["workers"].items()
+        }
+        stages = list(_metrics["stages"])
+        counters = dict(_metrics["counters"])
+    own_rss, children_rss = peak_rss_mb()
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "profile": _profiling["mode"],
+        "stages": stages,
+        "counters": counters,
+        "workers": workers,
+        "peak_rss_mb": own_rss,
+        "children_peak_rss_mb": children_rss,
+    }
+
+
+def write_metrics(filename="metrics.json", directory=OUTPUT_METRICS_DIR):
+    """Write the metrics report (and the profiles) and return its path."""
+    dump_profiles(directory)
+    path = get_output_filepath(filename, directory)
+    with open(path, "w") as report_file:
+        json.dump(metrics_report(), report_file, indent=2, default=str)
+    print(f"Metrics saved to {path}")
+    return path
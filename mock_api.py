@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from aiohttp import web
+
+from synthetic import random_user
+
+# Largest size the random-data-api users endpoint accepts.
+MAX_SIZE = 100
+
+USERS_PATH = "/api/v2/users"
+
+
+def create_app(rate=5.0, burst=5, latency=0.0, error_rate=0.0, seed=0):
+    """
+    Build a local stand-in for the random-data-api users endpoint.
+
+    GET /api/v2/users?size=N returns N users in the API's JSON shape (see
+    synthetic.random_user). Requests beyond a token bucket of rate requests
+    per second (burst at most) get a 429 with a Retry-After header, like the
+    real API's rate limiting.
+
+    Parameters:
+        rate (float): Requests per second served (None disables the limit).
+        burst (int): Requests served back to back.
+        latency (float): Seconds every response is delayed.
+        error_rate (float): Share of requests answered with a 500.
+        seed (int): Random seed of the generated users and errors.
+
+    Returns:
+        web.Application: The app; app["stats"] counts the requests, 429s and
+                         500s served.
+    """
+    app = web.Application()
+    app["rng"] = random.Random(seed)
+    app["bucket"] = {"tokens": burst, "updated": time.monotonic(), "next_id": 1}
+    app["stats"] = {"requests": 0, "served": 0, "rate_limited": 0, "errors": 0}
+
+    async def users(request):
+        stats = app["stats"]
+        stats["requests"] += 1
+        if rate is not None:
+            bucket = app["bucket"]
+            now = time.monotonic()
+            bucket["tokens"] = min(
+                burst, bucket["tokens"] + (now - bucket["updated"]) * rate
+            )
+            bucket["updated"] = now
+            if bucket["tokens"] < 1:
+                stats["rate_limited"] += 1
+                retry_after = math.ceil((1 - bucket["tokens"]) / rate)
+                return web.json_response(
+                    {"error": "Rate limit exceeded"},
+                    status=429,
+                    headers={"Retry-After": str(retry_after)},
+                )
+            bucket["tokens"] -= 1
+        if latency:
+            await asyncio.sleep(latency)
+        rng = app["rng"]
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": "Internal server error"}, status=500)
+        try:
+            size = min(max(int(request.query.get("size", 1)), 1), MAX_SIZE)
+        except ValueError:
+            return web.json_response({"error": "Invalid size"}, status=400)
+        first_id = app["bucket"]["next_id"]
+        app["bucket"]["next_id"] += size
+        stats["served"] += 1
+        return web.json_response(
+            [random_user(rng, user_id) for user_id in range(first_id, first_id + size)]
+        )
+
+    app.router.add_get(USERS_PATH, users)
+    return app
+
+
+async def start_mock_server(host="127.0.0.1", port=0, **options):
+    """
+    Start the mock API in the running event loop.
+
+    Parameters:
+        host (str), port (int): Address to listen on (port 0 picks a free one).
+        options: Arguments of create_app.
+
+    Returns:
+        tuple: (runner, url, app) with url the users endpoint; stop the server
+               with await runner.cleanup().
+    """
+    app = create_app(**options)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}{USERS_PATH}", app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the random-data-api.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rate", type=float, default=5.0)
+    parser.add_argument("--burst", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"Serving http://{args.host}:{args.port}{USERS_PATH} "
+        f"(set RANDOM_DATA_API_URL to use it)"
+    )
+    web.run_app(
+        create_app(args.rate, args.burst, args.latency, args.error_rate, args.seed),
+        host=args.host,
+        port=args.port,
+        print=None,
+    )
@@ -0,0 +1,239 @@
+import asyncio
+import math
+import os
+import queue
+import threading
+
+import pandas as pd
+
+import settings
+from data_collection import normalize_users, stream_random_users_async
+from database import COPY_CHUNK_SIZE, load_normalized_stream, loaded_rows
+from metrics import timed_stage
+from response_store import append_batch, iter_batches
+from util import (
+    close_dataset_writer,
+    get_dataset_filepath,
+    open_dataset_writer,
+    write_frame,
+)
+
+# Marks the end of the batches in the queue of fetch_batches.
+END = object()
+
+# How often a blocked producer checks whether the consumer went away (seconds).
+PUT_TIMEOUT = 0.1
+
+
+def fetch_batches(
+    total=1000,
+    batch_size=100,
+    max_buffered=settings.PIPELINE_MAX_BUFFERED_USERS,
+    **options,
+):
+    """
+    Yield fetched batches (lists of user dicts) as they arrive.
+
+    The fetch (see data_collection.stream_random_users_async) runs in a
+    background thread and hands every batch over through a queue of at most
+    max_buffered // batch_size batches. While the consumer works on a batch
+    the next ones are fetched; once the queue is full the fetch workers wait
+    for the consumer (backpressure). Failed batches are left out, and a fetch
+    error is raised here. Closing the generator early stops the fetch.
+
+    Parameters:
+        total (int): Number of users.
+        batch_size (int): Users per request.
+        max_buffered (int): Users held in the queue at most.
+        options: Further arguments of stream_random_users_async.
+    """
+    batches = queue.Queue(maxsize=max(1, max_buffered // batch_size))
+    closed = threading.Event()
+
+    def put(item):
+        """Queue an item; False if the consumer went away meanwhile."""
+        while not closed.is_set():
+            try:
+                batches.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def sink(number, batch):
+        if batch and not await asyncio.to_thread(put, batch):
+            raise RuntimeError("Batch consumer closed")
+
+    def produce():
+        try:
+            stats = asyncio.run(
+                stream_random_users_async(total, batch_size, sink, **options)
+            )
+            print(
+                f"Fetched {stats['batches'] - stats['failed']} of {stats['batches']} "
+                f"batches (rate limited {stats['throttled']} times)."
+            )
+            put(END)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, name="fetch-batches", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closed.set()
+        producer.join()
+
+
+def stored_batches(total=1000, batch_size=100, store=None, offline=False, **options):
+    """
+    Yield the batches of the response store, then fetch the missing users.
+
+    Stored batches are decoded one at a time (see response_store.iter_batches);
+    every fetched batch is appended to the store before it is passed on, so
+    an interrupted run resumes where the store ends.
+
+    Parameters:
+        total, batch_size, offline: See data_collection.fetch_random_users_stored.
+        store (dict): Store of response_store.open_store.
+        options: Further arguments of fetch_batches.
+    """
+    count = 0
+    for batch in iter_batches(store):
+        if count >= total:
+            return
+        batch = batch[: total - count]
+        count += len(batch)
+        yield batch
+    missing = total - count
+    if missing <= 0 or offline:
+        return
+    print(f"{count} users stored, fetching {missing} more...")
+    for batch in fetch_batches(
+        math.ceil(missing / batch_size) * batch_size, batch_size, **options
+    ):
+        append_batch(store, batch)
+        batch = batch[: total - count]
+        count += len(batch)
+        if batch:
+            yield batch
+
+
+def normalize_batches(batches):
+    """Yield every batch normalized (see data_collection.normalize_users)."""
+    columns = None
+    for batch in batches:
+        frame = normalize_users(batch)
+        if columns is None:
+            columns = frame.columns
+        elif not frame.columns.equals(columns):
+            # Fields missing from every user of a batch become empty columns;
+            # fields first seen in a later batch are added to the columns
+            # (the users file is widened, see util.write_frame).
+            columns = columns.append(frame.columns.difference(columns, sort=False))
+            frame = frame.reindex(columns=columns)
+        yield frame
+
+
+def save_frames(frames, filename="random_users.csv", output_format="csv"):
+    """
+    Append every frame to the file of save_users_to_csv (one Parquet row group
+    or Arrow record batch per frame) and pass it on.
+    """
+    path = get_dataset_filepath(filename, output_format)
+    writer = open_dataset_writer(path)
+    try:
+        for frame in frames:
+            write_frame(writer, frame)
+            yield frame
+    finally:
+        rows = close_dataset_writer(writer)
+    print(f"Saved {rows} users to {os.path.basename(path)}")
+
+
+def rebatch(frames, chunk_size=COPY_CHUNK_SIZE):
+    """Regroup frames into chunks of chunk_size rows (the last one may be smaller)."""
+    pending = []
+    rows = 0
+    for frame in frames:
+        pending.append(frame)
+        rows += len(frame)
+        while rows >= chunk_size:
+            merged = pd.concat(pending, ignore_index=True)
+            yield merged.iloc[:chunk_size]
+            rest = merged.iloc[chunk_size:]
+            pending = [rest] if len(rest) else []
+            rows = len(rest)
+    if rows:
+        yield pd.concat(pending, ignore_index=True)
+
+
+def stream_users(
+    total=1000,
+    batch_size=100,
+    store=None,
+    offline=False,
+    csv=True,
+    max_buffered=settings.PIPELINE_MAX_BUFFERED_USERS,
+    output_format="csv",
+    **options,
+):
+    """
+    Build the streaming fetch -> (store) -> normalize -> (CSV) pipeline.
+
+    Every stage is a generator pulling batches from the previous one, so
+    users flow through as they are fetched and nothing keeps them afterwards.
+    Memory is bounded by max_buffered: the fetch queue and the load chunks
+    each hold at most max_buffered users, whatever total is.
+
+    Parameters:
+        total (int): Number of users.
+        batch_size (int): Users per request.
+        store (dict): Response store to replay and extend (see
+                      stored_batches), or None to fetch everything.
+        offline (bool): With a store, never touch the network.
+        csv (bool): Also write random_users.csv on the way.
+        output_format (str): Format of that file (see util.OUTPUT_FORMATS).
+        max_buffered (int): Users held in the fetch queue and in one load
+                            chunk at most.
+        options: Further arguments of stream_random_users_async.
+
+    Returns:
+        generator: DataFrames of normalized users of up to
+                   min(COPY_CHUNK_SIZE, max_buffered) rows.
+    """
+    if store is not None:
+        batches = stored_batches(
+            total, batch_size, store, offline, max_buffered=max_buffered, **options
+        )
+    else:
+        batches = fetch_batches(total, batch_size, max_buffered, **options)
+    frames = normalize_batches(batches)
+    if csv:
+        frames = save_frames(frames, output_format=output_format)
+    return rebatch(frames, max(1, min(COPY_CHUNK_SIZE, max_buffered)))
+
+
+@timed_stage(items=loaded_rows, unit="users")
+def run_pipeline(conn, total=1000, batch_size=100, dimensions=False, **options):
+    """
+    Stream users from the API into the database (see stream_users and
+    database.load_normalized_stream); loading a chunk overlaps with fetching
+    the next batches.
+
+    Returns:
+        dict: Numbers of inserted, updated and skipped rows, or None if the
+              load failed.
+    """
+    chunks = stream_users(total, batch_size, **options)
+    try:
+        return load_normalized_stream(conn, chunks, dimensions=dimensions)
+    finally:
+        chunks.close()
@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import cursor
+from psycopg2.pool import ThreadedConnectionPool
+
+import settings
+from metrics import count
+
+# Shared pool of the process, created on first use by get_pool.
+_pool = None
+
+
+class CountingCursor(cursor):
+    """Cursor counting its database round trips in metrics (db_round_trips)."""
+
+    def execute(self, query, vars=None):
+        count("db_round_trips")
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        count("db_round_trips", len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        count("db_round_trips")
+        return super().copy_expert(sql, file, size)
+
+    def fetchmany(self, size=None):
+        if self.name is not None:  # server-side cursors fetch over the wire
+            count("db_round_trips")
+        return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        if self.name is not None:
+            count("db_round_trips")
+        return super().fetchall()
+
+
+def connection_params():
+    """Return the psycopg2.connect keyword arguments from settings.py."""
+    return {
+        "dbname": settings.POSTGRES_DB,
+        "user": settings.POSTGRES_USER,
+        "password": settings.POSTGRES_PASSWORD,
+        "host": settings.POSTGRES_HOST,
+        "port": settings.POSTGRES_PORT,
+        "cursor_factory": CountingCursor,
+    }
+
+
+def connect():
+    """Open a standalone connection with the settings.py configuration."""
+    return psycopg2.connect(**connection_params())
+
+
+def get_pool(minconn=None, maxconn=None):
+    """
+    Return the shared thread-safe connection pool, creating it on first use.
+
+    Parameters:
+        minconn (int): Connections opened up front (defaults to
+                       settings.POSTGRES_POOL_MIN).
+        maxconn (int): Upper bound of open connections (defaults to
+                       settings.POSTGRES_POOL_MAX); borrowing more raises
+                       psycopg2.pool.PoolError.
+    """
+    global _pool
+    if _pool is None or _pool.closed:
+        _pool = ThreadedConnectionPool(
+            minconn or settings.POSTGRES_POOL_MIN,
+            maxconn or settings.POSTGRES_POOL_MAX,
+            **connection_params(),
+        )
+    return _pool
+
+
+@contextmanager
+def pooled_connection(pool=None):
+    """
+    Borrow a connection from a pool (the shared one by default).
+
+    Whatever the block leaves uncommitted is rolled back before the connection
+    goes back to the pool; broken connections are discarded.
+    """
+    pool = pool or get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    finally:
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+def close_pool():
+    """Close every connection of the shared pool."""
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
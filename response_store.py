@@ -0,0 +1,168 @@
+import json
+import mmap
+import os
+import zlib
+from datetime import datetime, timezone
+
+from util import create_output_dir
+
+OUTPUT_RESPONSES_DIR = "output_responses"
+
+INDEX_FILE = "index.jsonl"
+
+# A new segment file is started once the current one reaches this size.
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+def segment_name(segment, compress):
+    """Return the file name of a segment number."""
+    return f"segment_{segment:05d}.jsonl" + (".gz" if compress else "")
+
+
+def open_store(
+    directory=OUTPUT_RESPONSES_DIR, compress=True, segment_bytes=SEGMENT_BYTES
+):
+    """
+    Open (or create) an append-only store of raw API batch responses.
+
+    Every batch is one JSON line appended to a segment file, gzip-compressed
+    on its own (a gzip member) when compress is set. index.jsonl records the
+    segment, byte offset, length and user count of every batch and is only
+    appended after the batch itself is on disk, so an interrupted write never
+    leaves an indexed batch behind: unindexed bytes at the end of a segment
+    are ignored and a truncated last index line is dropped.
+
+    Parameters:
+        directory (str): Store directory.
+        compress (bool): Compress new batches (stored batches keep their format).
+        segment_bytes (int): Size at which a new segment is started.
+
+    Returns:
+        dict: The store state (directory, options and the loaded index).
+    """
+    create_output_dir(directory)
+    index = []
+    index_path = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(index_path):
+        valid = 0
+        with open(index_path, "rb") as index_file:
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    index.append(json.loads(line))
+                except ValueError:
+                    break
+                valid += len(line)
+        if valid < os.path.getsize(index_path):
+            # Drop the partial line so later entries start on a line of their own.
+            os.truncate(index_path, valid)
+    return {
+        "directory": directory,
+        "compress": compress,
+        "segment_bytes": segment_bytes,
+        "index": index,
+    }
+
+
+def stored_users(store):
+    """Return the number of users in the stored batches."""
+    return sum(entry["users"] for entry in store["index"])
+
+
+def append_batch(store, users):
+    """
+    Append one batch response (a list of user dicts) to the store.
+
+    Returns:
+        dict: The index entry of the batch.
+    """
+    index = store["index"]
+    compress = store["compress"]
+    segment = index[-1]["segment"] if index else 0
+    directory = store["directory"]
+    path = os.path.join(directory, segment_name(segment, compress))
+    if index and (
+        index[-1]["compressed"] != compress
+        or os.path.exists(path)
+        and os.path.getsize(path) >= store["segment_bytes"]
+    ):
+        segment += 1
+        path = os.path.join(directory, segment_name(segment, compress))
+
+    data = (json.dumps(users, separators=(",", ":")) + "\n").encode()
+    if compress:
+        packer = zlib.compressobj(wbits=31)  # gzip member
+        data = packer.compress(data) + packer.flush()
+    with open(path, "ab") as segment_file:
+        offset = segment_file.tell()
+        segment_file.write(data)
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+
+    entry = {
+        "batch": len(index),
+        "segment": segment,
+        "compressed": compress,
+        "offset": offset,
+        "length": len(data),
+        "users": len(users),
+        "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(directory, INDEX_FILE), "a") as index_file:
+        index_file.write(json.dumps(entry) + "\n")
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    index.append(entry)
+    return entry
+
+
+def decode_batch(data, compressed):
+    """Decode the stored bytes of one batch into its list of users."""
+    if compressed:
+        data = zlib.decompress(data, wbits=31)
+    return json.loads(data)
+
+
+def iter_batches(store, start=0, stop=None):
+    """
+    Lazily yield stored batches (lists of user dicts) in the order stored.
+
+    The segment being read is memory-mapped and every batch is decoded only
+    when reached, so at most one batch is held in memory at a time.
+
+    Parameters:
+        store (dict): See open_store.
+        start, stop (int): Range of batch numbers.
+    """
+    segment = None
+    mapped = None
+    try:
+        for entry in store["index"][start:stop]:
+            if (entry["segment"], entry["compressed"]) != segment:
+                if mapped is not None:
+                    mapped.close()
+                segment = entry["segment"], entry["compressed"]
+                path = os.path.join(store["directory"], segment_name(*segment))
+                with open(path, "rb") as segment_file:
+                    mapped = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = mapped[entry["offset"] : entry["offset"] + entry["length"]]
+            yield decode_batch(data, entry["compressed"])
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def read_users(store, total=None):
+    """
+    Read the first total stored users (all of them by default).
+
+    Returns:
+        list: User dicts in the order they were stored.
+    """
+    users = []
+    for batch in iter_batches(store):
+        if total is not None and len(users) >= total:
+            break
+        users.extend(batch)
+    return users if total is None else users[:total]
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+from features import (
+    CATEGORY_FIELDS,
+    FIELDS,
+    MATCH_SCORE,
+    WEAK_THRESHOLD,
+    connection_type,
+    field_label,
+    field_score,
+)
+from util import close_dataset_writer, open_dataset_writer, write_frame
+
+# Compact representation of a reported pair: positional user indices, points per
+# category and a bitmask with bit k set when FIELDS[k] matched (14 bytes per pair).
+PAIR_DTYPE = np.dtype(
+    [
+        ("User1_Index", np.int32),
+        ("User2_Index", np.int32),
+        ("Personal_Points", np.uint8),
+        ("Address_Points", np.uint8),
+        ("Employment_Points", np.uint8),
+        ("Subscription_Points", np.uint8),
+        ("Field_Mask", np.uint16),
+    ]
+)
+
+FIELD_BITS = {field: 1 << k for k, field in enumerate(FIELDS)}
+
+
+def pack_results(left, right, scores):
+    """
+    Keep the pairs reaching the Weak threshold as compact records.
+
+    Parameters:
+        left, right (ndarray): Aligned user indices.
+        scores (ndarray): Score matrix from features.score_pairs/score_block.
+
+    Returns:
+        ndarray: Structured array of PAIR_DTYPE.
+    """
+    matched = scores >= MATCH_SCORE
+    keep = matched.sum(axis=1) >= WEAK_THRESHOLD
+    matched = matched[keep]
+    records = np.empty(int(keep.sum()), dtype=PAIR_DTYPE)
+    records["User1_Index"] = left[keep]
+    records["User2_Index"] = right[keep]
+    start = 0
+    for category, fields in CATEGORY_FIELDS.items():
+        stop = start + len(fields)
+        records[f"{category}_Points"] = matched[:, start:stop].sum(axis=1)
+        start = stop
+    bits = np.array([FIELD_BITS[field] for field in FIELDS], dtype=np.uint16)
+    records["Field_Mask"] = (matched * bits).sum(axis=1)
+    return records
+
+
+def total_points(records):
+    """Return the total points of compact records."""
+    return sum(
+        records[f"{category}_Points"].astype(np.int64) for category in CATEGORY_FIELDS
+    )
+
+
+def edges_frame(records, uids, classify_only=False):
+    """
+    Convert compact records to a DataFrame with uids, totals and connection types.
+
+    Parameters:
+        records (ndarray): Structured array of PAIR_DTYPE.
+        uids (list): User uids by position.
+        classify_only (bool): The records come from classify-only scoring, whose
+                              points are incomplete; keep only users and type.
+    """
+    frame = pd.DataFrame(records)
+    uids = np.asarray(uids, dtype=object)
+    frame.insert(0, "User1", uids[records["User1_Index"]])
+    frame.insert(1, "User2", uids[records["User2_Index"]])
+    totals = total_points(records)
+    frame["Total_Points"] = totals
+    frame["Connection_Type"] = [connection_type(total) for total in totals.tolist()]
+    if classify_only:
+        frame = frame[["User1", "User2", "User1_Index", "User2_Index", "Connection_Type"]]
+    return frame
+
+
+def explain_pair(features, i, j, mask):
+    """
+    Build the compare_users result dict of a reported pair.
+
+    Only the fields set in mask are re-scored, to produce the "field:score"
+    strings.
+
+    Parameters:
+        features (dict): Output of features.encode_users.
+        i, j (int): User indices.
+        mask (int): Field_Mask of the pair.
+
+    Returns:
+        dict: Same keys and values as compare_users.
+    """
+    result = {"User1": features["uid"][i], "User2": features["uid"][j]}
+    total = 0
+    for category, fields in CATEGORY_FIELDS.items():
+        similar = []
+        for field in fields:
+            if mask & FIELD_BITS[field]:
+                score = field_score(features, field, i, j) / 100.0
+                similar.append(f"{field_label(features, field, i)}:{score:.2f}")
+        result[f"{category}_Similar"] = "; ".join(similar)
+        result[f"{category}_Points"] = len(similar)
+        total += len(similar)
+    result["Total_Points"] = total
+    result["Connection_Type"] = connection_type(total)
+    return result
+
+
+def explain_pairs(features, records):
+    """
+    Produce the human-readable pairwise_similarities rows for compact records.
+
+    Use it on export or for the handful of pairs someone inspects.
+
+    Returns:
+        DataFrame: One row per record, in the compare_users layout.
+    """
+    rows = [
+        explain_pair(features, i, j, mask)
+        for i, j, mask in zip(
+            records["User1_Index"].tolist(),
+            records["User2_Index"].tolist(),
+            records["Field_Mask"].tolist(),
+        )
+    ]
+    columns = ["User1", "User2"]
+    for category in CATEGORY_FIELDS:
+        columns += [f"{category}_Similar", f"{category}_Points"]
+    columns += ["Total_Points", "Connection_Type"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def write_pairs(chunks, path, features, explain=True, classify_only=False):
+    """
+    Stream chunks of compact records to a dataset file as they arrive.
+
+    Parameters:
+        chunks (iterable): Structured arrays of PAIR_DTYPE.
+        path (str): Destination CSV, Parquet or Arrow file (format from its
+                    extension, see util.open_dataset_writer); every chunk
+                    becomes one row group / record batch.
+        features (dict): Feature table the records refer to.
+        explain (bool): Write the compare_users layout with "*_Similar" strings;
+                        otherwise write the compact edge list (edges_frame).
+        classify_only (bool): The records come from classify-only scoring; write
+                              only users and connection types.
+
+    Returns:
+        ndarray: All records, sorted by (User1_Index, User2_Index).
+    """
+    collected = []
+    writer = open_dataset_writer(path)
+    try:
+        for records in chunks:
+            if len(records) == 0:
+                continue
+            if explain and not classify_only:
+                frame = explain_pairs(features, records)
+            else:
+                frame = edges_frame(records, features["uid"], classify_only)
+            write_frame(writer, frame)
+            collected.append(records)
+    finally:
+        close_dataset_writer(writer)
+
+    records = np.concatenate(collected) if collected else np.empty(0, dtype=PAIR_DTYPE)
+    return np.sort(records, order=["User1_Index", "User2_Index"])
@@ -11,3 +11,25 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DB = os.getenv("POSTGRES_DB")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
+
+# Connection pool (pool.py) and parallel loading
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "8"))
+LOAD_PARTITIONS = int(os.getenv("LOAD_PARTITIONS", "1"))
+
+# random-data-api endpoint (point it at mock_api.py for offline runs) and the
+# async fetcher of data_collection
+RANDOM_DATA_API_URL = os.getenv(
+    "RANDOM_DATA_API_URL", "https://random-data-api.com/api/v2/users"
+)
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+FETCH_RATE_LIMIT = float(os.getenv("FETCH_RATE_LIMIT", "5"))
+
+# Streaming pipeline (pipeline.py): users held in its buffers at most
+PIPELINE_MAX_BUFFERED_USERS = int(os.getenv("PIPELINE_MAX_BUFFERED_USERS", "20000"))
+
+# Format of the written datasets: csv, parquet or arrow (see util.OUTPUT_FORMATS)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+
+# Profiling of the hot functions (metrics.py): "cprofile", "sample" or empty
+PROFILE = os.getenv("PROFILE", "")
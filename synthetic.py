@@ -0,0 +1,221 @@
+import copy
+import random
+import string
+import uuid
+from datetime import date, timedelta
+
+# Value pools modelled on the random-data-api users endpoint.
+# fmt: off
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+    "William", "Elizabeth", "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica",
+    "Thomas", "Sarah", "Charles", "Karen", "Christopher", "Nancy", "Daniel", "Lisa",
+    "Matthew", "Betty", "Anthony", "Margaret", "Mark", "Sandra", "Donald", "Ashley",
+    "Steven", "Kimberly", "Paul", "Emily", "Andrew", "Donna", "Joshua", "Michelle",
+    "Kenneth", "Carol", "Kevin", "Amanda", "Brian", "Dorothy", "George", "Melissa",
+    "Timothy", "Deborah", "Ronald", "Stephanie", "Edward", "Rebecca", "Jason", "Sharon",
+    "Jeffrey", "Laura", "Ryan", "Cynthia", "Jacob", "Kathleen", "Gary", "Amy",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+    "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson",
+    "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Perez", "Thompson", "White",
+    "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson", "Walker", "Young",
+    "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores", "Green",
+    "Adams", "Nelson", "Baker", "Hall", "Rivera", "Campbell", "Mitchell", "Carter",
+    "Roberts", "Schmitt", "Kuhlman", "Okuneva", "Bashirian", "Wintheiser", "Ziemann",
+)
+GENDERS = (
+    "Male", "Female", "Agender", "Bigender", "Genderfluid", "Genderqueer",
+    "Non-binary", "Polygender",
+)
+CITY_PREFIXES = ("North", "South", "East", "West", "New", "Lake", "Port", "")
+CITY_NAMES = (
+    "Aaron", "Bernier", "Collins", "Dach", "Emmerich", "Feest", "Gislason", "Hauck",
+    "Jast", "Kessler", "Langosh", "Mayert", "Nader", "Ortiz", "Prosacco", "Quigley",
+    "Rempel", "Schaden", "Towne", "Upton", "Volkman", "Weimann", "Yost", "Zboncak",
+)
+CITY_SUFFIXES = ("ville", "burgh", "haven", "side", "port", "fort", "view", "borough", "")
+STREET_SUFFIXES = (
+    "Street", "Avenue", "Road", "Lane", "Drive", "Court", "Place", "Way", "Trail",
+    "Parkway", "Square", "Terrace",
+)
+STATES = (
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut",
+    "Delaware", "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa",
+    "Kansas", "Kentucky", "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan",
+    "Minnesota", "Mississippi", "Missouri", "Montana", "Nebraska", "Nevada",
+    "New Hampshire", "New Jersey", "New Mexico", "New York", "North Carolina",
+    "North Dakota", "Ohio", "Oklahoma", "Oregon", "Pennsylvania", "Rhode Island",
+    "South Carolina", "South Dakota", "Tennessee", "Texas", "Utah", "Vermont",
+    "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming",
+)
+TITLES = (
+    "Accounting Administrator", "Administration Manager", "Consulting Designer",
+    "Construction Analyst", "Design Consultant", "Education Coordinator",
+    "Farming Specialist", "Government Officer", "Healthcare Liaison", "IT Supervisor",
+    "Legacy Accounting Producer", "Manufacturing Architect", "Marketing Developer",
+    "Mining Assistant", "Real-Estate Representative", "Retail Strategist",
+    "Sales Executive", "Senior Banking Engineer", "Technology Planner",
+    "Central Technology Agent",
+)
+KEY_SKILLS = (
+    "Communication", "Confidence", "Fast learner", "Leadership", "Networking skills",
+    "Organisation", "Problem solving", "Self-motivated", "Teamwork", "Technical savvy",
+    "Work under pressure", "Proactive", "Créativité", "Emotional intelligence",
+)
+PLANS = (
+    "Basic", "Bronze", "Business", "Diamond", "Essential", "Free Trial", "Gold",
+    "Platinum", "Premium", "Professional", "Silver", "Standard", "Starter", "Student",
+)
+STATUSES = ("Active", "Blocked", "Idle", "Pending")
+PAYMENT_METHODS = (
+    "Alipay", "Apple Pay", "Bitcoins", "Cash", "Cheque", "Credit card", "Debit card",
+    "Google Pay", "Money transfer", "Paypal", "Visa checkout", "WeChat Pay",
+)
+TERMS = ("Annual", "Full subscription", "Monthly", "Payment in advance")
+# fmt: on
+
+# Coordinates of a near-duplicate move by at most this many degrees (~3 km).
+NEAR_DUPLICATE_JITTER = 0.03
+
+
+def random_uid(rng):
+    """Return a version 4 UUID string drawn from rng."""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def random_digits(rng, count):
+    """Return a string of count random digits."""
+    return "".join(rng.choice(string.digits) for _ in range(count))
+
+
+def random_user(rng, user_id):
+    """Generate one user in the random-data-api JSON shape."""
+    first_name = rng.choice(FIRST_NAMES)
+    last_name = rng.choice(LAST_NAMES)
+    city = (
+        f"{rng.choice(CITY_PREFIXES)} {rng.choice(CITY_NAMES)}{rng.choice(CITY_SUFFIXES)}"
+    ).strip()
+    street_name = f"{rng.choice(CITY_NAMES)} {rng.choice(STREET_SUFFIXES)}"
+    birth = date(1955, 1, 1) + timedelta(days=rng.randrange(365 * 50))
+    return {
+        "id": user_id,
+        "uid": random_uid(rng),
+        "password": "".join(rng.choice(string.ascii_letters) for _ in range(10)),
+        "first_name": first_name,
+        "last_name": last_name,
+        "username": f"{first_name.lower()}.{last_name.lower()}",
+        "email": f"{first_name.lower()}.{last_name.lower()}@email.com",
+        "avatar": "https://robohash.org/"
+        + "".join(rng.choice(string.ascii_lowercase) for _ in range(12))
+        + ".png?size=300x300&set=set1",
+        "gender": rng.choice(GENDERS),
+        "phone_number": f"+1-{random_digits(rng, 3)}-{random_digits(rng, 3)}-"
+        f"{random_digits(rng, 4)}",
+        "social_insurance_number": random_digits(rng, 9),
+        "date_of_birth": birth.isoformat(),
+        "employment": {"title": rng.choice(TITLES), "key_skill": rng.choice(KEY_SKILLS)},
+        "address": {
+            "city": city,
+            "street_name": street_name,
+            "street_address": f"{rng.randrange(1, 99999)} {street_name}",
+            "zip_code": f"{random_digits(rng, 5)}",
+            "state": rng.choice(STATES),
+            "country": "United States",
+            "coordinates": {
+                "lat": rng.uniform(-90, 90),
+                "lng": rng.uniform(-180, 180),
+            },
+        },
+        "credit_card": {"cc_number": f"4{random_digits(rng, 3)}-{random_digits(rng, 4)}"},
+        "subscription": {
+            "plan": rng.choice(PLANS),
+            "status": rng.choice(STATUSES),
+            "payment_method": rng.choice(PAYMENT_METHODS),
+            "term": rng.choice(TERMS),
+        },
+    }
+
+
+def misspell(rng, value):
+    """Apply one random character insertion, deletion or substitution."""
+    if not value:
+        return value
+    position = rng.randrange(len(value))
+    operation = rng.randrange(3)
+    if operation == 0:
+        return value[:position] + rng.choice(string.ascii_lowercase) + value[position:]
+    if operation == 1 and len(value) > 1:
+        return value[:position] + value[position + 1 :]
+    return value[:position] + rng.choice(string.ascii_lowercase) + value[position + 1 :]
+
+
+def duplicate_user(rng, user, user_id, near=False):
+    """
+    Copy a user under a new id and uid.
+
+    A near-duplicate also gets a typo in its names and street address, a
+    slightly moved location and possibly another subscription status.
+    """
+    copied = copy.deepcopy(user)
+    copied["id"] = user_id
+    copied["uid"] = random_uid(rng)
+    if near:
+        copied["first_name"] = misspell(rng, copied["first_name"])
+        copied["last_name"] = misspell(rng, copied["last_name"])
+        address = copied["address"]
+        address["street_address"] = misspell(rng, address["street_address"])
+        coordinates = address["coordinates"]
+        coordinates["lat"] = max(
+            -90.0,
+            min(90.0, coordinates["lat"] + rng.uniform(-1, 1) * NEAR_DUPLICATE_JITTER),
+        )
+        coordinates["lng"] += rng.uniform(-1, 1) * NEAR_DUPLICATE_JITTER
+        if rng.random() < 0.5:
+            copied["subscription"]["status"] = rng.choice(STATUSES)
+    return copied
+
+
+def generate_users(total, seed=0, duplicate_rate=0.05, near_duplicate_rate=0.1):
+    """
+    Generate users in the exact JSON shape of the random-data-api users endpoint.
+
+    The output only depends on the arguments, so a seed reproduces the same
+    population on every run.
+
+    Parameters:
+        total (int): Number of users.
+        seed (int): Random seed.
+        duplicate_rate (float): Share of users that copy an earlier user's
+                                attributes under a new uid.
+        near_duplicate_rate (float): Share of users that copy an earlier user
+                                     with small typos and a moved location.
+
+    Returns:
+        list: User dicts, as fetch_random_users returns them.
+    """
+    rng = random.Random(seed)
+    users = []
+    for user_id in range(1, total + 1):
+        draw = rng.random()
+        if users and draw < duplicate_rate:
+            users.append(duplicate_user(rng, rng.choice(users), user_id))
+        elif users and draw < duplicate_rate + near_duplicate_rate:
+            users.append(duplicate_user(rng, rng.choice(users), user_id, near=True))
+        else:
+            users.append(random_user(rng, user_id))
+    return users
+
+
+def fetch_synthetic_users(total=1000, batch_size=100, seed=0, **rates):
+    """
+    Offline drop-in for data_collection.fetch_random_users.
+
+    Returns the same number of users (total // batch_size full batches); extra
+    keyword arguments are the rates of generate_users.
+    """
+    num_batches = total // batch_size
+    users = generate_users(num_batches * batch_size, seed=seed, **rates)
+    print(f"Total users generated: {len(users)}")
+    return users
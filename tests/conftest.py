@@ -0,0 +1,49 @@
+import uuid
+
+import psycopg2
+import pytest
+
+import pool
+from data_collection import normalize_users
+from synthetic import generate_users
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Skip the test unless the PostgreSQL server of settings.py is reachable."""
+    try:
+        psycopg2.connect(**pool.connection_params(), connect_timeout=3).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL is not reachable: {e}")
+
+
+@pytest.fixture
+def db_schema(database, monkeypatch):
+    """
+    Run the test in a fresh schema, dropped afterwards.
+
+    The schema is set as search path of every new connection (PGOPTIONS), so
+    standalone and pooled connections all see it.
+    """
+    schema = f"pytest_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setenv("PGOPTIONS", f"-c search_path={schema},public")
+    pool.close_pool()
+    conn = pool.connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {schema};")
+        conn.commit()
+        yield schema
+    finally:
+        pool.close_pool()
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def synthetic_users():
+    """300 normalized synthetic users (see synthetic.generate_users)."""
+    return normalize_users(generate_users(300, seed=7))
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+
+import data_collection
+from data_collection import (
+    fetch_random_users_async,
+    retry_after_seconds,
+    stream_random_users_async,
+)
+from metrics import metrics_report, reset_metrics
+from mock_api import start_mock_server
+
+URL = "{url}?size={{batch_size}}&response_type=json"
+
+
+@pytest.fixture(autouse=True)
+def counters():
+    reset_metrics()
+    yield lambda: metrics_report()["counters"]
+    reset_metrics()
+
+
+def run_against_mock(fetch, **options):
+    """Run fetch(url) against a mock API on a free port; return its result and stats."""
+
+    async def run():
+        runner, url, app = await start_mock_server(**options)
+        try:
+            return await fetch(URL.format(url=url)), app["stats"]
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def assert_unique_users(users, total):
+    assert len(users) == total
+    # Failed requests draw no ids, so every user is served exactly once.
+    assert sorted(user["id"] for user in users) == list(range(1, total + 1))
+    assert len({user["uid"] for user in users}) == total
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("3", 3.0), ("-1", 0.0), ("Thu, 01 Jan 1970 00:00:00 GMT", 0.0), ("soon", None)],
+)
+def test_retry_after_seconds(value, expected):
+    assert retry_after_seconds(value) == expected
+
+
+def test_token_bucket_paces_requests(counters):
+    start = time.monotonic()
+    users, stats = run_against_mock(
+        lambda url: fetch_random_users_async(1200, 100, concurrency=8, rate=10, url=url),
+        rate=None,
+    )
+    # A burst of 2 requests, then 10 per second.
+    assert time.monotonic() - start >= (12 - 2) / 10
+    assert_unique_users(users, 1200)
+    assert stats == {"requests": 12, "served": 12, "rate_limited": 0, "errors": 0}
+    assert counters() == {"http_requests": 12}
+
+
+def test_rate_limited_requests_honour_retry_after(counters):
+    batches = []
+
+    async def sink(number, batch):
+        batches.append(batch)
+
+    start = time.monotonic()
+    fetch_stats, stats = run_against_mock(
+        lambda url: stream_random_users_async(
+            1000, 100, sink, concurrency=4, rate=50, url=url
+        ),
+        rate=5,
+        burst=2,
+    )
+    users = [user for batch in batches for user in batch]
+    assert_unique_users(users, 1000)
+    assert fetch_stats["failed"] == 0
+    # Every 429 throttled the client bucket and was retried after Retry-After
+    # (1s) without a backoff, so at least one second passed.
+    assert stats["rate_limited"] > 0
+    assert fetch_stats["throttled"] == stats["rate_limited"]
+    assert time.monotonic() - start >= 1
+    assert counters() == {
+        "http_requests": stats["requests"],
+        "http_429": stats["rate_limited"],
+        "http_retries": stats["rate_limited"],
+    }
+
+
+def test_server_errors_are_retried_with_jitter(counters, monkeypatch):
+    delays = []
+    full_jitter = data_collection.backoff_delay
+
+    def backoff_delay(attempt, delay):
+        # The real full-jitter backoff, from a shorter initial delay.
+        wait = full_jitter(attempt, 0.05)
+        delays.append((attempt, wait))
+        return wait
+
+    monkeypatch.setattr(data_collection, "backoff_delay", backoff_delay)
+    users, stats = run_against_mock(
+        lambda url: fetch_random_users_async(3000, 100, concurrency=8, rate=50, url=url),
+        rate=None,
+        error_rate=0.1,
+    )
+    assert_unique_users(users, 3000)
+    assert stats["errors"] > 0
+    assert stats["served"] == 30
+    # One jittered backoff per 500, each before a retry.
+    assert len(delays) == stats["errors"]
+    assert len({wait for _, wait in delays}) == len(delays)
+    assert all(0 <= wait <= 0.05 * 2**attempt for attempt, wait in delays)
+    assert counters() == {
+        "http_requests": stats["requests"],
+        "http_errors": stats["errors"],
+        "http_retries": stats["errors"],
+    }
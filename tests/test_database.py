@@ -0,0 +1,153 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from database import (
+    create_indexes,
+    create_property_summary,
+    create_tables,
+    fetch_similarity_users,
+    fetch_trigram_candidates,
+    load_normalized_data,
+    load_normalized_data_parallel,
+    most_common_properties,
+    users_signature,
+)
+from features import STRONG_THRESHOLD
+from pool import connect, get_pool
+from user_similarity import measure_blocking_recall
+
+TABLES = ("users", "addresses", "employment", "subscriptions")
+
+
+def table_counts(conn):
+    """Return the row count of every normalized table."""
+    counts = {}
+    with conn.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f"SELECT count(*) FROM {table};")
+            counts[table] = cursor.fetchone()[0]
+    return counts
+
+
+def recreate_tables(conn, schema):
+    """Drop everything in the test schema and create the tables again."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA {schema} CASCADE; CREATE SCHEMA {schema};")
+    conn.commit()
+    create_tables(conn)
+
+
+@pytest.mark.parametrize("dimensions", [False, True])
+def test_parallel_load_matches_serial_load(db_schema, synthetic_users, dimensions):
+    conn = connect()
+    try:
+        recreate_tables(conn, db_schema)
+        serial = load_normalized_data(conn, synthetic_users, dimensions=dimensions)
+        expected = table_counts(conn), users_signature(conn)
+
+        recreate_tables(conn, db_schema)
+        parallel = load_normalized_data_parallel(
+            get_pool(), synthetic_users, partitions=4, workers=3, dimensions=dimensions
+        )
+        assert parallel["failed"] == 0
+        assert parallel["inserted"] == serial["inserted"] == len(synthetic_users)
+        assert (table_counts(conn), users_signature(conn)) == expected
+    finally:
+        conn.close()
+
+
+def test_parallel_reload_skips_stored_users(db_schema, synthetic_users):
+    conn = connect()
+    try:
+        create_tables(conn)
+        first = synthetic_users.iloc[:200]
+        load_normalized_data_parallel(get_pool(), first, partitions=4, workers=3)
+        counts = load_normalized_data_parallel(
+            get_pool(), synthetic_users, partitions=4, workers=3
+        )
+        assert counts == {
+            "inserted": len(synthetic_users) - 200,
+            "updated": 0,
+            "skipped": 200,
+            "failed": 0,
+        }
+        assert table_counts(conn)["users"] == len(synthetic_users)
+    finally:
+        conn.close()
+
+
+def test_most_common_properties_keep_their_types(db_schema, synthetic_users):
+    conn = connect()
+    try:
+        create_tables(conn)
+        load_normalized_data(conn, synthetic_users)
+        counted = most_common_properties(conn)
+        summarized = most_common_properties(conn, summary=True)
+    finally:
+        conn.close()
+    birth_years = synthetic_users["date_of_birth"].str[:4].astype(int)
+    for props in (counted, summarized):
+        year, count = props["birth_year"]
+        assert isinstance(year, int)
+        assert count == birth_years.value_counts().iloc[0] == (birth_years == year).sum()
+        assert isinstance(props["first_name"][0], str)
+    assert {prop: count for prop, (_, count) in counted.items()} == {
+        prop: count for prop, (_, count) in summarized.items()
+    }
+
+
+def test_property_summary_needs_postgres_15():
+    with pytest.raises(RuntimeError, match="PostgreSQL 15"):
+        create_property_summary(SimpleNamespace(server_version=140011))
+
+
+def identical_key_pairs(conn):
+    """
+    Return the uid pairs sharing first and last name, gender and birth date,
+    or street address and city: their trigram similarity is 1, so
+    fetch_trigram_candidates must propose all of them.
+    """
+    keys = {
+        "u.first_name, u.last_name": [],
+        "u.gender, u.date_of_birth": [],
+        "a.street_address, a.city": [],
+    }
+    pairs = set()
+    with conn.cursor() as cursor:
+        for key in keys:
+            cursor.execute(f"""
+                SELECT array_agg(u.uid::text ORDER BY u.id)
+                FROM users u JOIN addresses a ON a.id = u.address_id
+                WHERE ({key}) IS NOT NULL
+                GROUP BY {key} HAVING count(*) > 1;
+                """)
+            for (uids,) in cursor.fetchall():
+                pairs.update(itertools.combinations(uids, 2))
+    return pairs
+
+
+def test_trigram_candidates(db_schema, synthetic_users):
+    conn = connect()
+    try:
+        create_tables(conn)
+        load_normalized_data(conn, synthetic_users)
+        if not create_indexes(conn, trigram=True):
+            pytest.skip("pg_trgm is not available")
+        candidates = fetch_trigram_candidates(conn)
+        proposed = set(zip(*candidates))
+        assert identical_key_pairs(conn) <= proposed
+
+        # Not a superset of the reported pairs: it finds most Strong pairs of
+        # these users but few Weak ones (see fetch_trigram_candidates).
+        users_df = fetch_similarity_users(conn)
+        strong = measure_blocking_recall(
+            users_df, candidates=candidates, threshold=STRONG_THRESHOLD
+        )
+        weak = measure_blocking_recall(users_df, candidates=candidates)
+        assert strong["found_pairs"] <= strong["true_pairs"]
+        assert strong["recall"] >= 0.5
+        assert weak["recall"] < strong["recall"]
+    finally:
+        conn.close()
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from pipeline import normalize_batches, save_frames
+from util import read_dataset
+
+BATCHES = [
+    [{"uid": "a", "address": {"city": "X"}}, {"uid": "b", "address": {"city": "Y"}}],
+    [{"uid": "c", "address": {"city": "Z", "state": "S"}, "employment": {"title": "T"}}],
+    [{"uid": "d"}],
+]
+
+
+def test_normalize_batches_keep_fields_first_seen_later():
+    frames = list(normalize_batches(BATCHES))
+    assert list(frames[-1].columns) == [
+        "uid",
+        "address.city",
+        "address.state",
+        "employment.title",
+    ]
+    assert list(frames[0].columns) == ["uid", "address.city"]
+    assert frames[-1]["address.city"].isna().all()
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet", "arrow"])
+def test_saved_users_keep_fields_first_seen_later(output_format, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = save_frames(normalize_batches(BATCHES), output_format=output_format)
+    assert sum(len(frame) for frame in frames) == 4
+    path = tmp_path / ("output_csv" if output_format == "csv" else "output_data")
+    saved = read_dataset(str(path / f"random_users.{output_format}"), dtype=str)
+    expected = pd.DataFrame(
+        {
+            "uid": ["a", "b", "c", "d"],
+            "address.city": ["X", "Y", "Z", None],
+            "address.state": [None, None, "S", None],
+            "employment.title": [None, None, "T", None],
+        }
+    )
+    pd.testing.assert_frame_equal(saved.fillna(-1), expected.fillna(-1))
@@ -0,0 +1,39 @@
+import pytest
+from psycopg2.pool import PoolError
+
+from pool import get_pool, pooled_connection
+
+
+def test_pooled_connection_rolls_back_uncommitted_work(db_schema):
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TABLE items (id INT);")
+        conn.commit()
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO items VALUES (1);")
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM items;")
+            assert cursor.fetchone()[0] == 0
+
+
+def test_pooled_connection_discards_closed_connections(db_schema):
+    with pooled_connection() as conn:
+        conn.close()
+    with pooled_connection() as conn:
+        assert not conn.closed
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+            assert cursor.fetchone()[0] == 1
+
+
+def test_pool_is_bounded(db_schema):
+    bounded = get_pool(minconn=1, maxconn=2)
+    connections = [bounded.getconn(), bounded.getconn()]
+    try:
+        with pytest.raises(PoolError):
+            bounded.getconn()
+    finally:
+        for conn in connections:
+            bounded.putconn(conn)
@@ -0,0 +1,103 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+from blocking import candidate_pairs
+from database import (
+    create_tables,
+    fetch_similarity_users,
+    fetch_unscored_uids,
+    load_normalized_data,
+    similarity_frame,
+)
+from features import STRONG_THRESHOLD
+from pool import connect
+from user_similarity import (
+    compare_users,
+    find_similar_users,
+    load_groups,
+    measure_blocking_recall,
+    update_similar_users,
+)
+from util import read_dataset
+
+KEY = ["User1", "User2"]
+
+
+@pytest.fixture(scope="module")
+def users_df(synthetic_users):
+    return similarity_frame(synthetic_users)
+
+
+@pytest.fixture(scope="module")
+def brute_force(users_df):
+    """compare_users over every pair, in the layout of pairwise_similarities."""
+    rows = users_df.to_dict("records")
+    results = [compare_users(u1, u2) for u1, u2 in itertools.combinations(rows, 2)]
+    frame = pd.DataFrame([result for result in results if result is not None])
+    return frame.astype(str).sort_values(KEY, ignore_index=True)
+
+
+def test_strict_candidates_contain_every_reported_pair(users_df, brute_force):
+    left, right = candidate_pairs(users_df, mode="strict")
+    uids = users_df["uid"].astype(str).to_numpy()
+    candidates = set(zip(uids[left], uids[right]))
+    reported = set(zip(brute_force["User1"], brute_force["User2"]))
+    assert reported <= candidates
+
+
+def test_approximate_recall_floor(users_df):
+    # Measured on these users: 91% of the Strong and 23% of the Weak pairs.
+    strong = measure_blocking_recall(users_df, threshold=STRONG_THRESHOLD)
+    weak = measure_blocking_recall(users_df)
+    assert strong["recall"] >= 0.85
+    assert weak["recall"] >= 0.2
+    assert weak["reduction"] >= 0.75
+
+
+@pytest.mark.parametrize("blocking", ["strict", None])
+def test_engine_matches_brute_force(
+    users_df, brute_force, blocking, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    # Small tiles, so some are dense and some are reduced to candidates.
+    find_similar_users(users_df, blocking=blocking, workers=2, tile_size=64)
+    written = read_dataset(
+        "output_csv/pairwise_similarities.csv", dtype=str, keep_default_na=False
+    )
+    pd.testing.assert_frame_equal(
+        written.sort_values(KEY, ignore_index=True), brute_force
+    )
+
+
+def test_classify_only_matches_brute_force(users_df, brute_force, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pair_df, _, _ = find_similar_users(users_df, workers=2, classify_only=True)
+    found = set(zip(pair_df["User1"], pair_df["User2"], pair_df["Connection_Type"]))
+    expected = zip(
+        brute_force["User1"], brute_force["User2"], brute_force["Connection_Type"]
+    )
+    assert found == set(expected)
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_incremental_groups_use_the_output_format(
+    db_schema, synthetic_users, output_format, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    conn = connect()
+    try:
+        create_tables(conn)
+        load_normalized_data(conn, synthetic_users.iloc[:100])
+        _, strong_groups, weak_groups = update_similar_users(
+            conn,
+            fetch_similarity_users(conn),
+            fetch_unscored_uids(conn),
+            workers=2,
+            output_format=output_format,
+        )
+    finally:
+        conn.close()
+    assert not (tmp_path / "output_csv" / "strong_groups.csv").exists()
+    assert load_groups(output_format) == (strong_groups, weak_groups)
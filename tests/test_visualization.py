@@ -0,0 +1,16 @@
+import numpy as np
+
+from metrics import metrics_report, reset_metrics
+from visualization import close_renderer, render_async, visualize_group_sizes
+
+
+def test_rendered_stages_reach_the_caller_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reset_metrics()
+    try:
+        render_async(visualize_group_sizes, np.array([3, 2]), np.array([5])).result()
+    finally:
+        close_renderer()
+    stages = [record["stage"] for record in metrics_report()["stages"]]
+    assert stages == ["visualize_group_sizes"]
+    assert (tmp_path / "output_png" / "group_size_distribution.png").exists()
@@ -1,24 +1,67 @@
-from itertools import combinations
+import os
+import tempfile
+import time
+from collections import Counter
 from multiprocessing import Pool, cpu_count
 
-import networkx as nx
-import networkx.algorithms.community as nx_comm
+import numpy as np
 import pandas as pd
-from fuzzywuzzy import fuzz
-from geopy.distance import geodesic
 
-from util import get_csv_filepath
+import settings
+from blocking import (
+    TILE_SIZE,
+    add_cover_keys,
+    candidate_pairs,
+    tile_candidates,
+    tile_ranges,
+    uid_pair_candidates,
+)
+from database import (
+    SIMILARITY_SOURCE_COLUMNS,
+    fetch_affected_uids,
+    fetch_component_edges,
+    fetch_similarity_groups,
+    insert_similarity_pairs,
+    mark_users_scored,
+    replace_similarity_groups,
+    similarity_frame,
+)
+from features import (
+    CATEGORICAL_FIELDS,
+    CATEGORY_FIELDS,
+    EXACT_FIELDS,
+    MATCH_SCORE,
+    STAGED_FIELDS,
+    STRONG_THRESHOLD,
+    VALUE_LABELLED_FIELDS,
+    WEAK_THRESHOLD,
+    connection_type,
+    encode_users,
+    format_counters,
+    load_features,
+    save_features,
+    score_block,
+    score_pairs,
+)
+from fuzzy import cutoff_ratio
+from geo import within_distance
+from grouping import group_edges, group_pairs
+from metrics import count, profiled, record_worker, timed_stage
+from results import PAIR_DTYPE, edges_frame, pack_results, write_pairs
+from util import get_dataset_filepath, read_dataset, write_dataset
 
 
 def compare_personal(u1, u2):
     similar = []
     points = 0
-    sim_fn = fuzz.ratio(str(u1["first_name"]), str(u2["first_name"])) / 100.0
+    sim_fn = (
+        cutoff_ratio(str(u1["first_name"]), str(u2["first_name"]), MATCH_SCORE) / 100.0
+    )
     if sim_fn >= 0.8:
         similar.append((u1["first_name"], sim_fn))
         points += 1
 
-    sim_ln = fuzz.ratio(str(u1["last_name"]), str(u2["last_name"])) / 100.0
+    sim_ln = cutoff_ratio(str(u1["last_name"]), str(u2["last_name"]), MATCH_SCORE) / 100.0
     if sim_ln >= 0.8:
         similar.append((u1["last_name"], sim_ln))
         points += 1
@@ -34,44 +77,52 @@ def compare_personal(u1, u2):
     return points, similar
 
 
-def compare_address(u1, u2):
+def compare_address(u1, u2, near=None):
+    """
+    Compare address fields of two users.
+
+    near is the precomputed result of the location check (see geo.location_pairs);
+    when omitted it is evaluated for this pair alone.
+    """
     similar = []
     points = 0
-    sim_city = fuzz.ratio(str(u1["city"]), str(u2["city"])) / 100.0
+    sim_city = cutoff_ratio(str(u1["city"]), str(u2["city"]), MATCH_SCORE) / 100.0
     if sim_city >= 0.8:
         similar.append(("city", sim_city))
         points += 1
 
-    sim_street = fuzz.ratio(str(u1["street_name"]), str(u2["street_name"])) / 100.0
+    sim_street = (
+        cutoff_ratio(str(u1["street_name"]), str(u2["street_name"]), MATCH_SCORE) / 100.0
+    )
     if sim_street >= 0.8:
         similar.append(("street_name", sim_street))
         points += 1
 
-    sim_addr = fuzz.ratio(str(u1["street_address"]), str(u2["street_address"])) / 100.0
+    sim_addr = (
+        cutoff_ratio(str(u1["street_address"]), str(u2["street_address"]), MATCH_SCORE)
+        / 100.0
+    )
     if sim_addr >= 0.8:
         similar.append(("street_address", sim_addr))
         points += 1
 
-    sim_zip = fuzz.ratio(str(u1["zip_code"]), str(u2["zip_code"])) / 100.0
+    sim_zip = cutoff_ratio(str(u1["zip_code"]), str(u2["zip_code"]), MATCH_SCORE) / 100.0
     if sim_zip >= 0.8:
         similar.append(("zip_code", sim_zip))
         points += 1
 
-    sim_state = fuzz.ratio(str(u1["state"]), str(u2["state"])) / 100.0
+    sim_state = cutoff_ratio(str(u1["state"]), str(u2["state"]), MATCH_SCORE) / 100.0
     if sim_state >= 0.8:
         similar.append(("state", sim_state))
         points += 1
 
-    try:
-        coord1 = (float(u1["latitude"]), float(u1["longitude"]))
-        coord2 = (float(u2["latitude"]), float(u2["longitude"]))
-        distance = geodesic(coord1, coord2).km
-        if distance < 10:
-            similar.append(("location", 1.0))
-            points += 1
-    except Exception as e:
-        print("Error happened during comparing coordinates", e)
-        pass
+    if near is None:
+        near = within_distance(
+            (u1["latitude"], u1["longitude"]), (u2["latitude"], u2["longitude"])
+        )
+    if near:
+        similar.append(("location", 1.0))
+        points += 1
 
     return points, similar
 
@@ -80,13 +131,18 @@ def compare_employment(u1, u2):
     similar = []
     points = 0
     sim_title = (
-        fuzz.ratio(str(u1["employment_title"]), str(u2["employment_title"])) / 100.0
+        cutoff_ratio(
+            str(u1["employment_title"]), str(u2["employment_title"]), MATCH_SCORE
+        )
+        / 100.0
     )
     if sim_title >= 0.8:
         similar.append(("employment_title", sim_title))
         points += 1
 
-    sim_skill = fuzz.ratio(str(u1["key_skill"]), str(u2["key_skill"])) / 100.0
+    sim_skill = (
+        cutoff_ratio(str(u1["key_skill"]), str(u2["key_skill"]), MATCH_SCORE) / 100.0
+    )
     if sim_skill >= 0.8:
         similar.append(("key_skill", sim_skill))
         points += 1
@@ -103,90 +159,360 @@ def compare_subscription(u1, u2):
         "payment_method",
         "subscription_term",
     ]:
-        sim_val = fuzz.ratio(str(u1[field]), str(u2[field])) / 100.0
+        sim_val = cutoff_ratio(str(u1[field]), str(u2[field]), MATCH_SCORE) / 100.0
         if sim_val >= 0.8:
             similar.append((field, sim_val))
             points += 1
     return points, similar
 
 
-def compare_users(u1, u2, strong_threshold=5):
-    pers_pts, pers_sim = compare_personal(u1, u2)
-    addr_pts, addr_sim = compare_address(u1, u2)
-    emp_pts, emp_sim = compare_employment(u1, u2)
-    subs_pts, subs_sim = compare_subscription(u1, u2)
-
-    total_points = pers_pts + addr_pts + emp_pts + subs_pts
-    result = {
-        "User1": u1["uid"],
-        "User2": u2["uid"],
-        "Personal_Similar": "; ".join(
-            [f"{field}:{score:.2f}" for field, score in pers_sim]
-        ),
-        "Personal_Points": pers_pts,
-        "Address_Similar": "; ".join(
-            [f"{field}:{score:.2f}" for field, score in addr_sim]
-        ),
-        "Address_Points": addr_pts,
-        "Employment_Similar": "; ".join(
-            [f"{field}:{score:.2f}" for field, score in emp_sim]
-        ),
-        "Employment_Points": emp_pts,
-        "Subscription_Similar": "; ".join(
-            [f"{field}:{score:.2f}" for field, score in subs_sim]
-        ),
-        "Subscription_Points": subs_pts,
-        "Total_Points": total_points,
+def field_similarity(u1, u2, field, near=None):
+    """Return the similarity (0.0 - 1.0) of one field, as the compare_* functions compute it."""
+    if field == "gender":
+        same = str(u1["gender"]).strip().lower() == str(u2["gender"]).strip().lower()
+        return 1.0 if same else 0.0
+    if field == "date_of_birth":
+        return 1.0 if str(u1[field]) == str(u2[field]) else 0.0
+    if field == "location":
+        if near is None:
+            near = within_distance(
+                (u1["latitude"], u1["longitude"]), (u2["latitude"], u2["longitude"])
+            )
+        return 1.0 if near else 0.0
+    return cutoff_ratio(str(u1[field]), str(u2[field]), MATCH_SCORE) / 100.0
+
+
+@profiled
+def compare_users(
+    u1,
+    u2,
+    strong_threshold=STRONG_THRESHOLD,
+    near=None,
+    classify_only=False,
+    counters=None,
+):
+    """
+    Compare two users field by field and classify the connection.
+
+    The cheap exact and subscription checks run first, then STAGED_FIELDS while
+    tracking the most points the pair can still reach: evaluation stops once the
+    pair can no longer reach the Weak threshold or, with classify_only, once its
+    connection type is settled. Explanation strings are built only for returned
+    pairs.
+
+    Parameters:
+        u1, u2 (dict): User rows.
+        strong_threshold (int): Points needed for a Strong connection.
+        near (bool): Precomputed location check, evaluated here when omitted.
+        classify_only (bool): Return only the users and the connection type.
+        counters (Counter): Optional per-stage counters, updated in place.
+
+    Returns:
+        dict | None: The compare_personal/address/employment/subscription based
+                     result, or None below the Weak threshold.
+    """
+    counters = Counter() if counters is None else counters
+    counters["pairs"] += 1
+    similarities = {
+        field: field_similarity(u1, u2, field)
+        for field in EXACT_FIELDS + CATEGORICAL_FIELDS
     }
-
-    if total_points >= strong_threshold:
-        result["Connection_Type"] = "Strong"
-    elif total_points >= 2:
-        result["Connection_Type"] = "Weak"
-    else:
+    points = sum(sim >= 0.8 for sim in similarities.values())
+    stopped = False
+    for step, field in enumerate(STAGED_FIELDS):
+        remaining = len(STAGED_FIELDS) - step
+        settled = points >= strong_threshold or (
+            points >= WEAK_THRESHOLD and points + remaining < strong_threshold
+        )
+        if points + remaining < WEAK_THRESHOLD or (classify_only and settled):
+            counters[f"skipped:{field}"] += 1
+            stopped = True
+            continue
+        counters[f"evaluated:{field}"] += 1
+        similarities[field] = field_similarity(u1, u2, field, near)
+        points += similarities[field] >= 0.8
+    if stopped:
+        counters["pruned" if points < WEAK_THRESHOLD else "settled"] += 1
+
+    kind = connection_type(points, strong_threshold)
+    if kind is None:
         return None
-
+    counters["emitted"] += 1
+    if classify_only:
+        return {"User1": u1["uid"], "User2": u2["uid"], "Connection_Type": kind}
+
+    result = {"User1": u1["uid"], "User2": u2["uid"]}
+    for category, fields in CATEGORY_FIELDS.items():
+        similar = []
+        for field in fields:
+            if similarities.get(field, 0.0) >= 0.8:
+                label = u1[field] if field in VALUE_LABELLED_FIELDS else field
+                similar.append(f"{label}:{similarities[field]:.2f}")
+        result[f"{category}_Similar"] = "; ".join(similar)
+        result[f"{category}_Points"] = len(similar)
+    result["Total_Points"] = points
+    result["Connection_Type"] = kind
     return result
 
 
 def compare_pair(pair):
-    return compare_users(pair[0], pair[1])
+    near = pair[2] if len(pair) > 2 else None
+    return compare_users(pair[0], pair[1], near=near)
+
+
+# Feature table and options of the current Pool worker, set once by init_worker.
+_worker_features = None
+_worker_classify_only = False
+_worker_strict = False
+
+# Candidate pairs per task when the candidates are given as pair lists.
+CHUNK_SIZE = 20000
 
+# A tile keeping more than this share of its pairs after strict blocking is
+# scored whole (score_block broadcasts over the tile), not pair by pair.
+DENSE_TILE_FRACTION = 0.5
 
-def build_groups(pairs, type_filter):
-    G = nx.Graph()
-    for pair in pairs:
-        if pair["Connection_Type"] == type_filter:
-            G.add_edge(pair["User1"], pair["User2"])
-    communities = list(nx_comm.greedy_modularity_communities(G))
-    groups = [sorted(list(comm)) for comm in communities if len(comm) > 1]
-    return groups
 
+def init_worker(directory, manifest, classify_only=False, strict=False):
+    global _worker_features, _worker_classify_only, _worker_strict
+    _worker_features = load_features(directory, manifest)
+    _worker_classify_only = classify_only
+    _worker_strict = strict
 
-def find_similar_users(users_df):
+
+def iter_tiles(n, tile_size=TILE_SIZE, focus=None):
     """
-    Given a DataFrame of users, perform pairwise fuzzy matching.
-    Note: For 1000 users, there are nearly 500,000 pairs.
-    ##TODO Consider performance implications for larger datasets.
+    Yield ("tile", i0, i1, j0, j1) tasks covering the upper triangle of n users
+    (with a focus mask, the tiles holding a focused user).
     """
-    users = users_df.to_dict("records")
-    user_pairs = list(combinations(users, 2))
-    print(f"Comparing {len(user_pairs)} pairs using {cpu_count()} CPU cores...")
+    for tile in tile_ranges(n, tile_size, focus):
+        yield ("tile", *tile)
+
 
-    with Pool(cpu_count()) as pool:
-        comparisons = pool.map(compare_pair, user_pairs)
-    comparisons = [comp for comp in comparisons if comp is not None]
+def iter_chunks(left, right, chunk_size=CHUNK_SIZE):
+    """
+    Yield ("pairs", left, right) tasks carrying chunk_size candidate pairs
+    each; the Pool sends them to the workers as they free up.
+    """
+    for start in range(0, len(left), chunk_size):
+        yield (
+            "pairs",
+            left[start : start + chunk_size],
+            right[start : start + chunk_size],
+        )
 
-    # Save pairwise similarities
-    pair_df = pd.DataFrame(comparisons)
-    pair_csv_path = get_csv_filepath("pairwise_similarities.csv")
-    pair_df.to_csv(pair_csv_path, index=False)
-    print("Pairwise similarities saved to pairwise_similarities.csv")
+
+@profiled
+def score_task(task):
+    """
+    Score one unit of work against the worker's feature table.
+
+    A task is either ("tile", i0, i1, j0, j1), all pairs (i, j) with
+    i0 <= i < i1, j0 <= j < j1 and i < j, or ("pairs", left, right), aligned
+    candidate arrays. With strict blocking (or a "focus" mask in the table) a
+    tile is first reduced to its candidates (see blocking.tile_candidates);
+    tiles keeping more than DENSE_TILE_FRACTION of their pairs are scored
+    whole, which gives the same records. Returns the compact records
+    (results.PAIR_DTYPE) of the pairs reaching the Weak threshold, the
+    staged-evaluation counters of the task and its worker stats (see
+    metrics.record_worker).
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    features = _worker_features
+    counters = Counter()
+    if task[0] == "tile":
+        _, i0, i1, j0, j1 = task
+        rows, cols = np.arange(i0, i1), np.arange(j0, j1)
+        dense = True
+        if _worker_strict or "focus" in features:
+            left, right, num_pairs = tile_candidates(
+                features, rows, cols, strict=_worker_strict
+            )
+            counters["blocked"] += num_pairs - len(left)
+            dense = (
+                "focus" not in features and len(left) > DENSE_TILE_FRACTION * num_pairs
+            )
+        if dense:
+            left, right, scores = score_block(
+                features,
+                rows,
+                cols,
+                classify_only=_worker_classify_only,
+                counters=counters,
+            )
+        else:
+            scores = score_pairs(
+                features,
+                left,
+                right,
+                classify_only=_worker_classify_only,
+                counters=counters,
+            )
+    else:
+        _, left, right = task
+        scores = score_pairs(
+            features,
+            left,
+            right,
+            classify_only=_worker_classify_only,
+            counters=counters,
+        )
+    records = pack_results(left, right, scores)
+    counters["emitted"] += len(records)
+    stats = {
+        "pid": os.getpid(),
+        "tasks": 1,
+        "items": len(left),
+        "wall_s": time.perf_counter() - wall_start,
+        "cpu_s": time.process_time() - cpu_start,
+    }
+    return records, counters, stats
+
+
+def collect_counters(results, counters):
+    """
+    Pass the records of (records, counters, stats) results through, summing
+    the counters and recording the worker stats.
+    """
+    for records, task_counters, stats in results:
+        counters.update(task_counters)
+        record_worker(stats)
+        yield records
+
+
+def iter_records(
+    features, tasks, workers, classify_only=False, counters=None, strict=False
+):
+    """
+    Score tasks on a Pool of workers sharing the memory-mapped feature table.
+
+    Yields the compact records of each task as it completes; counters, when
+    given, accumulate the staged-evaluation counters of all tasks. strict
+    applies strict blocking to tile tasks (see score_task).
+    """
+    counters = Counter() if counters is None else counters
+    with tempfile.TemporaryDirectory(prefix="user_features_") as directory:
+        manifest = save_features(features, directory)
+        with Pool(
+            workers,
+            initializer=init_worker,
+            initargs=(directory, manifest, classify_only, strict),
+        ) as pool:
+            results = pool.imap_unordered(score_task, tasks)
+            yield from collect_counters(results, counters)
+
+
+@timed_stage(items=lambda result: len(result[0]), unit="pairs", profile=True)
+def find_similar_users(
+    users_df,
+    blocking="strict",
+    workers=None,
+    tile_size=TILE_SIZE,
+    chunk_size=CHUNK_SIZE,
+    explain=True,
+    classify_only=False,
+    grouping="communities",
+    candidates=None,
+    output_format="csv",
+):
+    """
+    Given a DataFrame of users, perform pairwise fuzzy matching.
+
+    The encoded feature table is written once to memory-mapped files that the
+    Pool workers open at start-up; tasks only carry index ranges (or one chunk
+    of a given candidate list) and compact results (results.PAIR_DTYPE) stream
+    back through imap_unordered straight into pairwise_similarities.csv. With
+    strict blocking every worker reduces its own tiles to their candidates, so
+    no candidate list is built and memory does not grow with the number of
+    pairs.
+
+    Parameters:
+        users_df (DataFrame): Users as returned by fetch_similarity_users.
+        blocking (str | None): Candidate generation mode passed to
+            blocking.candidate_pairs. "strict" scores only the pairs of each
+            tile that can reach the Weak threshold (see
+            blocking.tile_candidates) and returns the same results as
+            comparing every pair; "approximate" trades recall for speed; None
+            compares all n * (n - 1) / 2 pairs.
+        workers (int): Number of worker processes (defaults to cpu_count()).
+        tile_size (int): Users per side of a tile (strict blocking or none).
+        chunk_size (int): Candidate pairs per task for approximate blocking
+            and given candidates.
+        explain (bool): Write pairwise_similarities.csv with the "*_Similar"
+            strings (generated while exporting); otherwise write the compact
+            edge list.
+        classify_only (bool): Stop scoring a pair as soon as its connection type
+            is known; the CSV and pair_df then only hold the users and
+            Connection_Type of each pair.
+        grouping (str): Group building mode passed to grouping.group_pairs:
+            "communities" (greedy modularity per connected component, in
+            parallel) or "components" (connected components).
+        candidates (tuple): (user1, user2) uid arrays of pre-filtered pairs,
+            e.g. from database.fetch_trigram_candidates; when given, only these
+            pairs are scored and blocking is ignored.
+        output_format (str): Format of the pair and group files: "csv",
+            "parquet" or "arrow" (see util.get_dataset_filepath).
+
+    Returns:
+        tuple: (pair_df, strong_groups, weak_groups), pair_df being the compact
+               edge list (see results.edges_frame); results.explain_pairs gives
+               the readable form of any subset of it.
+    """
+    workers = workers or cpu_count()
+    features = encode_users(users_df)
+    n = features["size"]
+    if candidates is not None:
+        blocking = "database"
+    if blocking in (None, "strict"):
+        if blocking == "strict":
+            add_cover_keys(features)
+        num_pairs = n * (n - 1) // 2
+        tasks = iter_tiles(n, tile_size)
+    else:
+        if candidates is not None:
+            left, right = uid_pair_candidates(users_df, *candidates)
+        else:
+            left, right = candidate_pairs(users_df, mode=blocking, features=features)
+        num_pairs = len(left)
+        tasks = iter_chunks(left, right, chunk_size)
+    print(
+        f"Comparing {num_pairs} pairs ({blocking or 'no'} blocking) "
+        f"using {workers} worker processes..."
+    )
+
+    pair_path = get_dataset_filepath("pairwise_similarities.csv", output_format)
+    counters = Counter()
+    records = write_pairs(
+        iter_records(
+            features, tasks, workers, classify_only, counters, blocking == "strict"
+        ),
+        pair_path,
+        features,
+        explain,
+        classify_only,
+    )
+    count("pairs_compared", counters["pairs"])
+    print(f"Pairwise similarities saved to {os.path.basename(pair_path)}")
+    if counters["blocked"]:
+        print(f"Strict blocking left out {counters['blocked']} of {num_pairs} pairs.")
+    print(format_counters(counters))
+    pair_df = edges_frame(records, features["uid"], classify_only)
 
     # Build groups
-    strong_groups = build_groups(comparisons, "Strong")
-    weak_groups = build_groups(comparisons, "Weak")
+    groups = group_pairs(pair_df, mode=grouping, workers=workers)
+    strong_groups = groups["Strong"]
+    weak_groups = groups["Weak"]
+    save_groups(strong_groups, weak_groups, output_format)
 
+    return pair_df, strong_groups, weak_groups
+
+
+def save_groups(strong_groups, weak_groups, output_format="csv"):
+    """
+    Write the Strong and Weak groups to strong_groups.csv and weak_groups.csv
+    (or their Parquet / Arrow counterparts, see util.get_dataset_filepath).
+    """
     strong_df = pd.DataFrame(
         {
             "Group": range(1, len(strong_groups) + 1),
@@ -200,21 +526,196 @@ def find_similar_users(users_df):
         }
     )
 
-    strong_csv_path = get_csv_filepath("strong_groups.csv")
-    weak_csv_path = get_csv_filepath("weak_groups.csv")
-    strong_df.to_csv(strong_csv_path, index=False)
-    weak_df.to_csv(weak_csv_path, index=False)
-    print("Strong groups saved to strong_groups.csv")
-    print("Weak groups saved to weak_groups.csv")
+    for groups_df, filename in ((strong_df, "strong_groups"), (weak_df, "weak_groups")):
+        groups_path = get_dataset_filepath(filename, output_format)
+        write_dataset(groups_df, groups_path)
+        print(
+            f"{filename.split('_')[0].capitalize()} groups saved to {os.path.basename(groups_path)}"
+        )
 
+
+def load_groups(output_format="csv"):
+    """
+    Read the groups written by save_groups.
+
+    Returns:
+        tuple: (strong_groups, weak_groups), lists of uid lists.
+    """
+    groups = []
+    for filename in ("strong_groups", "weak_groups"):
+        groups_df = read_dataset(
+            get_dataset_filepath(filename, output_format),
+            dtype=str,
+            keep_default_na=False,
+        )
+        groups.append(
+            [uids.split(", ") for uids in groups_df["User_UIDs"].tolist() if uids]
+        )
+    return tuple(groups)
+
+
+@timed_stage(items=lambda result: len(result[0]), unit="pairs")
+def update_similar_users(
+    conn,
+    users_df,
+    new_uids,
+    blocking="strict",
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    grouping="communities",
+    candidates=None,
+    output_format="csv",
+):
+    """
+    Incrementally score a batch of new users against the persisted results.
+
+    Only pairs involving at least one new user (new x existing and new x new)
+    are scored; the pairs reaching the Weak threshold are added to
+    similarity_pairs. For each connection type, groups are recomputed only in
+    the connected components touched by the new edges (merged with the
+    components their endpoints already belonged to); every other component
+    keeps its groups. The group files are then exported from similarity_groups.
+
+    Parameters:
+        conn: Database connection with the similarity tables.
+        users_df (DataFrame): All users, as returned by fetch_similarity_users.
+        new_uids (list): Uids of users not scored yet (see fetch_unscored_uids).
+        blocking (str | None): Candidate generation mode, as in find_similar_users.
+        workers (int): Number of worker processes (defaults to cpu_count()).
+        chunk_size (int): Candidate pairs per task (approximate blocking and
+            given candidates).
+        grouping (str): Group building mode, as in find_similar_users.
+        candidates (tuple): Pre-filtered uid pairs, as in find_similar_users;
+            only those involving a new user are scored.
+        output_format (str): Format of the group files, as in find_similar_users.
+
+    Returns:
+        tuple: (pair_df, strong_groups, weak_groups) with the new pairs only and
+               all persisted groups.
+    """
+    workers = workers or cpu_count()
+    new_uids = sorted({str(uid) for uid in new_uids})
+    uids = np.array([str(uid) for uid in users_df["uid"]], dtype=object)
+    focus = np.isin(uids, new_uids)
+
+    features = encode_users(users_df)
+    if candidates is not None:
+        blocking = "database"
+    if blocking in (None, "strict"):
+        # Tiles holding a new user, reduced to the pairs involving one.
+        if blocking == "strict":
+            add_cover_keys(features)
+        features["focus"] = focus
+        tasks = iter_tiles(len(users_df), focus=focus)
+        described = "the pairs"
+    else:
+        if candidates is not None:
+            left, right = uid_pair_candidates(users_df, *candidates, focus=focus)
+        else:
+            left, right = candidate_pairs(
+                users_df, mode=blocking, focus=focus, features=features
+            )
+        tasks = iter_chunks(left, right, chunk_size)
+        described = f"{len(left)} pairs"
+    print(
+        f"Comparing {described} involving {int(focus.sum())} new users "
+        f"({blocking or 'no'} blocking) using {workers} worker processes..."
+    )
+    counters = Counter()
+    chunks = list(
+        iter_records(features, tasks, workers, False, counters, blocking == "strict")
+    )
+    records = np.concatenate(chunks) if chunks else np.empty(0, dtype=PAIR_DTYPE)
+    print(format_counters(counters))
+    pair_df = edges_frame(records, uids)
+
+    try:
+        with conn.cursor() as cursor:
+            insert_similarity_pairs(cursor, pair_df)
+            for kind in ("Strong", "Weak"):
+                selected = pair_df[pair_df["Connection_Type"] == kind]
+                touched = set(selected["User1"]) | set(selected["User2"])
+                if not touched:
+                    continue
+                affected = fetch_affected_uids(cursor, kind, touched)
+                edges = fetch_component_edges(cursor, kind, affected)
+                replace_similarity_groups(
+                    cursor, kind, affected, group_edges(edges, grouping, workers)
+                )
+            mark_users_scored(cursor, new_uids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"Stored {len(pair_df)} new similarity pairs.")
+
+    strong_groups = fetch_similarity_groups(conn, "Strong")
+    weak_groups = fetch_similarity_groups(conn, "Weak")
+    save_groups(strong_groups, weak_groups, output_format)
     return pair_df, strong_groups, weak_groups
 
 
+def measure_blocking_recall(
+    users_df, mode="approximate", candidates=None, threshold=WEAK_THRESHOLD
+):
+    """
+    Measure how many reportable pairs a blocking mode keeps.
+
+    The strict candidate set provably contains every pair reaching the Weak
+    threshold, so scoring it yields the ground truth for the given users.
+
+    Parameters:
+        users_df (DataFrame): Users as returned by fetch_similarity_users.
+        mode (str): Blocking mode of candidate_pairs.
+        candidates (tuple): (user1, user2) uid arrays of pre-filtered pairs
+                            measured instead of mode, e.g. from
+                            database.fetch_trigram_candidates.
+        threshold (int): Points a pair needs to count (the Weak threshold by
+                         default, STRONG_THRESHOLD for Strong pairs only).
+
+    Returns:
+        dict: Candidate counts, reduction against all pairs and recall.
+    """
+    features = encode_users(users_df)
+    n = features["size"]
+    total_pairs = n * (n - 1) // 2
+
+    def reported(left, right):
+        totals = (score_pairs(features, left, right) >= MATCH_SCORE).sum(axis=1)
+        keep = totals >= threshold
+        return set((left[keep] * n + right[keep]).tolist())
+
+    truth = reported(*candidate_pairs(users_df, mode="strict", features=features))
+    if candidates is not None:
+        mode = "candidates"
+        left, right = uid_pair_candidates(users_df, *candidates)
+    else:
+        left, right = candidate_pairs(users_df, mode=mode, features=features)
+    found = reported(left, right)
+    return {
+        "mode": mode,
+        "total_pairs": total_pairs,
+        "candidates": len(left),
+        "reduction": 1 - len(left) / total_pairs if total_pairs else 0.0,
+        "true_pairs": len(truth),
+        "found_pairs": len(found),
+        "recall": len(found) / len(truth) if truth else 1.0,
+    }
+
+
 if __name__ == "__main__":
+    users_path = get_dataset_filepath("random_users.csv", settings.OUTPUT_FORMAT)
     try:
-        users_df = pd.read_csv("output_csv/random_users.csv")
+        # Only the compared columns are read (memory-mapped for Parquet / Arrow).
+        users_df = similarity_frame(
+            read_dataset(
+                users_path, columns=list(SIMILARITY_SOURCE_COLUMNS.values()), dtype=str
+            )
+        )
     except Exception as e:
-        print("Error loading CSV file:", e)
+        print("Error loading users file:", e)
         exit(1)
 
-    pair_df, strong_groups, weak_groups = find_similar_users(users_df)
+    pair_df, strong_groups, weak_groups = find_similar_users(
+        users_df, output_format=settings.OUTPUT_FORMAT
+    )
@@ -1,9 +1,24 @@
 import os
 
+import numpy as np
+import pandas as pd
+
 # Define default directories for CSV and PNG files.
 OUTPUT_CSV_DIR = "output_csv"
 OUTPUT_PNG_DIR = "output_png"
 
+# Parquet and Arrow IPC datasets (see get_dataset_filepath).
+OUTPUT_DATA_DIR = "output_data"
+
+# File extension of every dataset format. Parquet and Arrow IPC keep dtypes and
+# can be read memory-mapped and column-projected; they need pyarrow.
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+PARQUET_COMPRESSION = "zstd"
+
+# Rows read per chunk when a CSV file is rewritten with new columns.
+CSV_REWRITE_CHUNK_SIZE = 50000
+
 
 def create_output_dir(directory):
     """
@@ -58,3 +73,347 @@ def get_png_filepath(filename):
         str: The full PNG file path.
     """
     return get_output_filepath(filename, OUTPUT_PNG_DIR)
+
+
+def dataset_format(path):
+    """Return the output format of a dataset file from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for output_format, format_extension in OUTPUT_FORMATS.items():
+        if extension == format_extension:
+            return output_format
+    raise ValueError(f"Unknown dataset format of {path!r}")
+
+
+def get_dataset_filepath(filename, output_format="csv"):
+    """
+    Get the file path of a dataset in the given output format.
+
+    The extension of filename is replaced by the one of the format; CSV files
+    stay in the CSV output directory (see get_csv_filepath), Parquet and Arrow
+    files go to the data output directory.
+
+    Parameters:
+        filename (str): The dataset file name (e.g. "random_users.csv").
+        output_format (str): One of OUTPUT_FORMATS.
+
+    Returns:
+        str: The full dataset file path.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown output format {output_format!r}, expected one of "
+            f"{tuple(OUTPUT_FORMATS)}"
+        )
+    filename = os.path.splitext(filename)[0] + OUTPUT_FORMATS[output_format]
+    if output_format == "csv":
+        return get_csv_filepath(filename)
+    return get_output_filepath(filename, OUTPUT_DATA_DIR)
+
+
+def open_dataset_writer(path):
+    """
+    Open a dataset file for incremental writing (format from its extension).
+
+    Every frame passed to write_frame becomes a Parquet row group, an Arrow
+    record batch or a block of CSV rows. The first frame sets the columns and
+    types of the file. Later frames are cast to them, or widen the file with
+    their new columns and wider types (see widen_dataset_writer and
+    widen_csv_writer); columns they lack are left empty.
+
+    Returns:
+        dict: The writer state; finish the file with close_dataset_writer.
+    """
+    return {
+        "path": path,
+        "format": dataset_format(path),
+        "file": None,
+        "writer": None,
+        "schema": None,
+        "columns": None,
+        "rows": 0,
+    }
+
+
+def conform_table(table, schema):
+    """Return an Arrow table cast to schema (its missing columns all null)."""
+    import pyarrow as pa
+
+    columns = [
+        (
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(table.num_rows, field.type)
+        )
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def missing_as_null(table):
+    """
+    Type the columns of an Arrow table that hold only missing values as null
+    (pandas makes them float64), so any type of a later frame can widen them.
+    """
+    import pyarrow as pa
+
+    for index, column in enumerate(table.columns):
+        if column.null_count == len(column) and column.type != pa.null():
+            table = table.set_column(
+                index, table.field(index).name, pa.nulls(len(column))
+            )
+    return table
+
+
+def open_table_writer(writer, schema):
+    """Start the Parquet or Arrow file of a dataset writer with schema."""
+    import pyarrow as pa
+
+    writer["schema"] = schema
+    if writer["format"] == "parquet":
+        import pyarrow.parquet as pq
+
+        writer["writer"] = pq.ParquetWriter(
+            writer["path"], schema, compression=PARQUET_COMPRESSION
+        )
+    else:
+        writer["file"] = pa.OSFile(writer["path"], "wb")
+        writer["writer"] = pa.ipc.new_file(writer["file"], schema)
+
+
+def iter_batches(path, output_format):
+    """Yield the record batches of a Parquet or Arrow file."""
+    import pyarrow as pa
+
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        yield from pq.ParquetFile(path).iter_batches()
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+
+
+def widen_dataset_writer(writer, schema):
+    """
+    Continue a Parquet or Arrow file with a wider schema, rewriting the rows
+    written so far once.
+
+    A column inferred from the first frames can be too narrow for a later
+    one: all missing values (null) before strings arrive, or integers before
+    a frame with missing values (float64).
+    """
+    import pyarrow as pa
+
+    writer["writer"].close()
+    if writer["file"] is not None:
+        writer["file"].close()
+        writer["file"] = None
+    written = writer["path"] + ".partial"
+    os.replace(writer["path"], written)
+    open_table_writer(writer, schema)
+    for batch in iter_batches(written, writer["format"]):
+        writer["writer"].write_table(
+            conform_table(pa.Table.from_batches([batch]), schema)
+        )
+    os.remove(written)
+
+
+def widen_csv_writer(writer, columns):
+    """
+    Continue a CSV file with more columns, rewriting the rows written so far
+    once (their new columns empty).
+    """
+    writer["file"].close()
+    written = writer["path"] + ".partial"
+    os.replace(writer["path"], written)
+    writer["file"] = open(writer["path"], "w", newline="")
+    pd.DataFrame(columns=columns).to_csv(writer["file"], index=False)
+    for chunk in pd.read_csv(
+        written, dtype=str, keep_default_na=False, chunksize=CSV_REWRITE_CHUNK_SIZE
+    ):
+        chunk.reindex(columns=columns).to_csv(writer["file"], header=False, index=False)
+    os.remove(written)
+    writer["columns"] = columns
+
+
+def write_frame(writer, frame):
+    """Append a DataFrame to a dataset writer (see open_dataset_writer)."""
+    if writer["format"] == "csv":
+        if writer["columns"] is None:
+            writer["file"] = open(writer["path"], "w", newline="")
+            writer["columns"] = frame.columns
+            frame.to_csv(writer["file"], index=False)
+            writer["rows"] += len(frame)
+            return
+        if not frame.columns.equals(writer["columns"]):
+            added = frame.columns.difference(writer["columns"], sort=False)
+            if len(added):
+                widen_csv_writer(writer, writer["columns"].append(added))
+            frame = frame.reindex(columns=writer["columns"])
+        frame.to_csv(writer["file"], header=False, index=False)
+        writer["rows"] += len(frame)
+        return
+
+    import pyarrow as pa
+
+    table = missing_as_null(pa.Table.from_pandas(frame, preserve_index=False))
+    if writer["schema"] is None:
+        open_table_writer(writer, table.schema)
+    elif not table.schema.equals(writer["schema"]):
+        schema = pa.unify_schemas(
+            [writer["schema"], table.schema], promote_options="permissive"
+        )
+        if not schema.equals(writer["schema"]):
+            widen_dataset_writer(writer, schema)
+        table = conform_table(table, writer["schema"])
+    writer["writer"].write_table(table)
+    writer["rows"] += len(frame)
+
+
+def close_dataset_writer(writer):
+    """
+    Finish a dataset file; a dataset without any frame is written empty.
+
+    Returns:
+        int: The number of rows written.
+    """
+    if writer["format"] == "csv":
+        if writer["file"] is None:
+            writer["file"] = open(writer["path"], "w", newline="")
+            writer["file"].write("\n")
+    elif writer["writer"] is None:
+        import pyarrow as pa
+
+        if writer["format"] == "parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(pa.table({}), writer["path"])
+        else:
+            with pa.OSFile(writer["path"], "wb") as sink:
+                pa.ipc.new_file(sink, pa.schema([])).close()
+    else:
+        writer["writer"].close()
+    if writer["file"] is not None:
+        writer["file"].close()
+    return writer["rows"]
+
+
+def write_dataset(frame, path):
+    """Write a DataFrame to a dataset file in one go (format from its extension)."""
+    writer = open_dataset_writer(path)
+    try:
+        write_frame(writer, frame)
+    finally:
+        close_dataset_writer(writer)
+
+
+def read_dataset(path, columns=None, **csv_options):
+    """
+    Read a dataset file (format from its extension) into a DataFrame.
+
+    Parquet and Arrow files are memory-mapped and only the requested columns
+    are read; the dtypes are the ones written, unless changed by the dtype
+    and keep_default_na options (see apply_csv_options).
+
+    Parameters:
+        path (str): Dataset file.
+        columns (list): Columns to read (all by default).
+        csv_options: Further arguments of pd.read_csv for CSV files; only
+                     dtype and keep_default_na apply to Parquet and Arrow
+                     files.
+
+    Returns:
+        DataFrame: The dataset.
+    """
+    return next(iter_dataset(path, None, columns, **csv_options))
+
+
+def apply_csv_options(frame, dtype=None, keep_default_na=True):
+    """
+    Convert a frame read from a Parquet or Arrow file the way pd.read_csv
+    would with these options: dtype=str turns every value into a string
+    (missing values stay missing), keep_default_na=False turns the missing
+    values of text columns into empty strings, as an empty CSV field.
+    """
+    if dtype is not None:
+        if not isinstance(dtype, dict):
+            dtype = dict.fromkeys(frame.columns, dtype)
+        for column, column_dtype in dtype.items():
+            if column not in frame.columns:
+                continue
+            values = frame[column]
+            if column_dtype in (str, "str"):
+                frame[column] = values.astype(str).where(values.notna(), np.nan)
+            else:
+                frame[column] = values.astype(column_dtype)
+    if not keep_default_na:
+        text = frame.select_dtypes(include="object").columns
+        frame[text] = frame[text].fillna("")
+    return frame
+
+
+def iter_dataset(path, chunk_size=None, columns=None, **csv_options):
+    """
+    Yield a dataset file as DataFrames of up to chunk_size rows (in one piece
+    without chunk_size); see read_dataset.
+    """
+    output_format = dataset_format(path)
+    if output_format == "csv":
+        frames = pd.read_csv(path, usecols=columns, chunksize=chunk_size, **csv_options)
+        yield from [frames] if chunk_size is None else frames
+        return
+
+    unsupported = set(csv_options) - {"dtype", "keep_default_na"}
+    if unsupported:
+        raise ValueError(
+            f"CSV options {sorted(unsupported)} do not apply to {output_format} files"
+        )
+
+    import pyarrow as pa
+
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        # The table refers to the mapped file, which stays open as long as it.
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    if chunk_size is None or table.num_rows <= chunk_size:
+        yield apply_csv_options(table.to_pandas(), **csv_options)
+        return
+    for start in range(0, table.num_rows, chunk_size):
+        yield apply_csv_options(table.slice(start, chunk_size).to_pandas(), **csv_options)
+
+
+def unique_codes(codes):
+    """Sort and deduplicate an int64 array."""
+    codes = np.sort(codes)
+    if len(codes):
+        codes = codes[np.concatenate([[True], codes[1:] != codes[:-1]])]
+    return codes
+
+
+def join_indices(keys_a, keys_b):
+    """
+    Equi-join two key arrays.
+
+    Returns:
+        tuple: (ia, ib) so that keys_a[ia] == keys_b[ib] for every matching combination.
+    """
+    order = np.argsort(keys_a, kind="stable")
+    sorted_keys = keys_a[order]
+    lo = np.searchsorted(sorted_keys, keys_b, side="left")
+    hi = np.searchsorted(sorted_keys, keys_b, side="right")
+    counts = hi - lo
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    ib = np.repeat(np.arange(len(keys_b)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    ia = order[np.repeat(lo, counts) + offsets]
+    return ia, ib
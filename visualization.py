@@ -1,24 +1,90 @@
-import matplotlib.pyplot as plt
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
 
-from util import get_png_filepath
+import matplotlib
+import numpy as np
 
+# Render to files only; no display is needed (or available in a worker process).
+matplotlib.use("Agg")
 
-def visualize_groups(strong_groups, weak_groups):
+import matplotlib.pyplot as plt  # noqa: E402
+
+from metrics import record_stages, take_stages, timed_stage  # noqa: E402
+from util import get_png_filepath  # noqa: E402
+
+# Groups drawn one bar each; above that only the largest ones are drawn, so
+# rendering time does not grow with the number of groups.
+MAX_PLOTTED_GROUPS = 50
+
+# Logarithmic bins of the group size distribution.
+SIZE_BINS = 30
+
+# Worker process of render_async (see get_renderer).
+_renderer = None
+
+
+def group_sizes(groups):
+    """Return the sizes of groups (lists of user IDs) as an integer array."""
+    return np.fromiter((len(grp) for grp in groups), dtype=np.int64, count=len(groups))
+
+
+def size_bins(sizes, bins=SIZE_BINS):
     """
-    Visualize the number and size of strong vs. weak groups.
+    Return logarithmic bin edges covering sizes, at most bins of them and at
+    least one integer wide (small sizes get a bin each).
+    """
+    largest = int(sizes.max()) if len(sizes) else 1
+    edges = np.unique(np.round(np.geomspace(1, largest + 1, bins + 1)))
+    return edges.astype(np.int64)
+
+
+def plot_group_sizes(ax, sizes, title, color, top_n=MAX_PLOTTED_GROUPS):
+    """
+    Draw one bar per group, or only the top_n largest groups when there are
+    more of them.
+    """
+    if len(sizes) > top_n:
+        largest = np.sort(sizes)[::-1][:top_n]
+        ax.bar(range(1, top_n + 1), largest, color=color)
+        ax.set_title(f"{title} (largest {top_n} of {len(sizes)})")
+        ax.set_xlabel("Group Rank")
+    else:
+        ax.bar(range(1, len(sizes) + 1), sizes, color=color)
+        ax.set_title(title)
+        ax.set_xlabel("Group Number")
+    ax.set_ylabel("Number of Users")
+
+
+def plot_size_distribution(ax, sizes, title, color, bins=SIZE_BINS):
+    """Draw a histogram of group sizes over logarithmic bins (log-log axes)."""
+    counts, edges = np.histogram(sizes, bins=size_bins(sizes, bins))
+    ax.stairs(counts, edges, fill=True, color=color)
+    ax.set_xscale("log")
+    if counts.any():
+        ax.set_yscale("log")
+    ax.set_title(title)
+    ax.set_xlabel("Group Size (Users)")
+    ax.set_ylabel("Number of Groups")
+
+
+@timed_stage()
+def visualize_group_sizes(strong_sizes, weak_sizes):
+    """
+    Visualize the number, the size and the size distribution of strong vs.
+    weak groups.
+
+    Every figure has a bounded number of artists (see MAX_PLOTTED_GROUPS and
+    SIZE_BINS), however many groups there are.
 
     Parameters:
-        strong_groups (list): List of strong groups (each a list of user IDs).
-        weak_groups (list): List of weak groups (each a list of user IDs).
+        strong_sizes (array): Sizes of the strong groups (see group_sizes).
+        weak_sizes (array): Sizes of the weak groups.
     """
     # Compare total number of strong groups vs. weak groups
-    num_strong_groups = len(strong_groups)
-    num_weak_groups = len(weak_groups)
-
     plt.figure(figsize=(8, 6))
     plt.bar(
         ["Strong Groups", "Weak Groups"],
-        [num_strong_groups, num_weak_groups],
+        [len(strong_sizes), len(weak_sizes)],
         color=["lightcoral", "lightblue"],
     )
     plt.xlabel("Group Type")
@@ -29,31 +95,43 @@ def visualize_groups(strong_groups, weak_groups):
     plt.close()
     print(f"Group count visualization saved to {group_count_path}")
 
-    # Show distribution of group sizes for strong and weak groups
-    strong_sizes = [len(grp) for grp in strong_groups]
-    weak_sizes = [len(grp) for grp in weak_groups]
-
+    # Show the sizes of the (largest) strong and weak groups
     fig, axes = plt.subplots(1, 2, figsize=(14, 6))
-
-    # Bar chart for Strong group sizes
-    axes[0].bar(range(1, len(strong_sizes) + 1), strong_sizes, color="lightcoral")
-    axes[0].set_title("Strong Group Sizes")
-    axes[0].set_xlabel("Group Number")
-    axes[0].set_ylabel("Number of Users")
-
-    # Bar chart for Weak group sizes
-    axes[1].bar(range(1, len(weak_sizes) + 1), weak_sizes, color="lightblue")
-    axes[1].set_title("Weak Group Sizes")
-    axes[1].set_xlabel("Group Number")
-    axes[1].set_ylabel("Number of Users")
-
+    plot_group_sizes(axes[0], strong_sizes, "Strong Group Sizes", "lightcoral")
+    plot_group_sizes(axes[1], weak_sizes, "Weak Group Sizes", "lightblue")
     plt.tight_layout()
     group_sizes_path = get_png_filepath("group_sizes.png")
     plt.savefig(group_sizes_path)
     plt.close()
     print(f"Group sizes visualization saved to {group_sizes_path}")
 
+    # Show how many groups there are of each size
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    plot_size_distribution(
+        axes[0], strong_sizes, "Strong Group Size Distribution", "lightcoral"
+    )
+    plot_size_distribution(
+        axes[1], weak_sizes, "Weak Group Size Distribution", "lightblue"
+    )
+    plt.tight_layout()
+    distribution_path = get_png_filepath("group_size_distribution.png")
+    plt.savefig(distribution_path)
+    plt.close()
+    print(f"Group size distribution saved to {distribution_path}")
+
 
+def visualize_groups(strong_groups, weak_groups):
+    """
+    Visualize the number and size of strong vs. weak groups.
+
+    Parameters:
+        strong_groups (list): List of strong groups (each a list of user IDs).
+        weak_groups (list): List of weak groups (each a list of user IDs).
+    """
+    visualize_group_sizes(group_sizes(strong_groups), group_sizes(weak_groups))
+
+
+@timed_stage()
 def visualize_common_properties(common_props):
     """
     Visualizes the most common property values with their counts.
@@ -91,3 +169,71 @@ def visualize_common_properties(common_props):
     plt.savefig(common_props_path)
     plt.close()
     print(f"Common properties visualization saved to {common_props_path}")
+
+
+def get_renderer():
+    """
+    Return the worker process rendering charts, starting it on first use.
+
+    The process is spawned rather than forked: a fork would inherit the pooled
+    database connections (and any threads) of the caller. It is kept for the
+    whole run, so only the first chart pays for its start.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+    return _renderer
+
+
+def close_renderer():
+    """Wait for the queued charts and stop the worker process."""
+    global _renderer
+    if _renderer is not None:
+        _renderer.shutdown()
+        _renderer = None
+
+
+def render(function, *args):
+    """
+    Worker side of render_async: run a visualization function and return its
+    result with the stage records of the worker process (see
+    metrics.take_stages).
+    """
+    return function(*args), take_stages()
+
+
+def render_async(function, *args):
+    """
+    Run a visualization function in the worker process (see get_renderer), so
+    rendering overlaps with the caller. The stages it measures are added to
+    the metrics of the caller before the returned future completes.
+
+    Returns:
+        Future: Call result() to wait for the images (and raise their errors).
+    """
+    future = Future()
+
+    def finish(rendered):
+        try:
+            result, stages = rendered.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        record_stages(stages)
+        future.set_result(result)
+
+    get_renderer().submit(render, function, *args).add_done_callback(finish)
+    return future
+
+
+def visualize_groups_async(strong_groups, weak_groups):
+    """Render the images of visualize_groups in the worker process."""
+    # Only the sizes are sent to the worker, not the groups themselves.
+    return render_async(
+        visualize_group_sizes, group_sizes(strong_groups), group_sizes(weak_groups)
+    )
+
+
+def visualize_common_properties_async(common_props):
+    """Render the image of visualize_common_properties in the worker process."""
+    return render_async(visualize_common_properties, common_props)